@@ -0,0 +1,361 @@
+#!/usr/bin/env python3
+"""
+Shared HTTP transport for the Appwrite Python scripts.
+
+The Appwrite SDK sends every request through the module-level
+``requests.request``, which opens (and TLS-handshakes) a fresh connection
+per call. ``PooledTransport`` replaces that with one ``requests.Session``
+per process: keep-alive connections from a bounded pool sized to the
+caller's concurrency, gzip responses, and a default timeout. The same
+settings drive the aiohttp connector of the cleaner's --async engine.
+
+Every request also passes through one ``AdaptiveRateController``, which
+lowers concurrency when Appwrite throttles or slows down, raises it again
+while requests succeed, and holds all requests back while a Retry-After
+is in effect.
+
+Usage:
+    transport = PooledTransport(pool_size=workers)
+    transport.install()          # every appwrite Client in the process now uses it
+    ...
+    print(transport.summary())   # "12 opened, 4988 reused (99.8% reuse)"
+    print(transport.controller.summary())
+"""
+
+import os
+import random
+import threading
+import time
+from email.utils import parsedate_to_datetime
+from datetime import datetime, timedelta, timezone
+from typing import Dict
+
+import requests
+from requests.adapters import HTTPAdapter
+from urllib3.connectionpool import HTTPConnectionPool, HTTPSConnectionPool
+
+# Pool and connection defaults shared by the sync and async clients
+DEFAULT_POOL_SIZE = 10
+DEFAULT_TIMEOUT = (10, 120)  # (connect, read) seconds
+KEEPALIVE_TIMEOUT = 60
+DNS_CACHE_TTL = 300
+ACCEPT_ENCODING = 'gzip, deflate'
+
+# Adaptive rate control: responses that mean "slow down", how hard to back
+# off, and when rising latency counts as congestion (smoothed latency this
+# many times the baseline and at least LATENCY_FLOOR seconds above it)
+THROTTLE_STATUS_CODES = {429}
+CONGESTION_STATUS_CODES = {429, 500, 502, 503, 504}
+DECREASE_FACTOR = 0.5
+LATENCY_TOLERANCE = 3.0
+LATENCY_FLOOR = 0.05
+LATENCY_SMOOTHING = 0.2
+BASELINE_DRIFT = 1.001
+LATENCY_METHODS = {'GET', 'DELETE'}
+MAX_RETRY_AFTER = 120
+ASYNC_POLL_INTERVAL = 0.005
+
+# Jittered exponential backoff for retried calls
+BACKOFF_CAP = 30.0
+
+def appwrite_headers(project_id: str, api_key: str) -> Dict[str, str]:
+    """Project and API key headers for REST calls made outside the Appwrite SDK"""
+    return {'x-appwrite-project': project_id, 'x-appwrite-key': api_key}
+
+def backoff_delay(attempt: int, base: float) -> float:
+    """Jittered exponential backoff delay for the given retry attempt"""
+    return min(BACKOFF_CAP, base * (2 ** attempt)) * random.uniform(0.5, 1.5)
+
+def parse_retry_after(value: str) -> float:
+    """Seconds to wait from a Retry-After header (delay or HTTP date), None if invalid"""
+    if not value:
+        return None
+    try:
+        seconds = float(value)
+    except ValueError:
+        try:
+            seconds = (parsedate_to_datetime(value) - datetime.now(timezone.utc)).total_seconds()
+        except (TypeError, ValueError):
+            return None
+    return min(max(seconds, 0.0), MAX_RETRY_AFTER)
+
+class AdaptiveRateController:
+    """AIMD concurrency limit shared by every Appwrite request of a process
+    
+    The limit starts at ``max_concurrency`` and follows what the endpoint
+    reports:
+    
+    - Each successful response adds ``1 / limit``, about +1 per round of
+      requests, up to ``max_concurrency``
+    - Throttling (429), 5xx responses, network errors and latency that
+      climbs well above the baseline multiply it by DECREASE_FACTOR, at
+      most once per round trip (smoothed latency), so a burst of
+      rejections from one round of requests counts once
+    - A Retry-After header holds back every new request until it has passed
+    
+    Latency is judged per HTTP method, and only for GET and DELETE,
+    because upload time grows with the payload. The baseline is the
+    lowest latency seen, drifting up slowly so that a lasting change in
+    the network is eventually accepted as normal.
+    """
+    
+    def __init__(self, max_concurrency: int, min_concurrency: int = 1):
+        self.max_concurrency = max(1, max_concurrency)
+        self.min_concurrency = max(1, min(min_concurrency, self.max_concurrency))
+        self.limit = float(self.max_concurrency)
+        self.in_flight = 0
+        self.paused_until = 0.0
+        self.counters = {'throttled': 0, 'congested': 0, 'decreases': 0, 'pauses': 0}
+        self._baseline = {}
+        self._smoothed = {}
+        self._round_trip = 0.0
+        self._last_decrease = 0.0
+        self._condition = threading.Condition()
+    
+    def _try_acquire(self) -> float:
+        """Take a request slot; return 0, or how long to wait before trying again"""
+        delay = self.paused_until - time.monotonic()
+        if delay > 0:
+            return delay
+        if self.in_flight < int(self.limit):
+            self.in_flight += 1
+            return 0
+        return None
+    
+    def acquire(self):
+        """Block until a request may be sent"""
+        with self._condition:
+            while (delay := self._try_acquire()) != 0:
+                self._condition.wait(delay)
+    
+    async def acquire_async(self):
+        """``acquire`` for asyncio callers, polling instead of blocking the loop"""
+        import asyncio
+        while True:
+            with self._condition:
+                delay = self._try_acquire()
+            if delay == 0:
+                return
+            await asyncio.sleep(delay or ASYNC_POLL_INTERVAL)
+    
+    def release(self, method: str, status: int, latency: float, retry_after: str = None):
+        """Return a request slot and adjust the limit from the response
+        
+        ``status`` is None when the request failed without a response.
+        """
+        now = time.monotonic()
+        with self._condition:
+            self.in_flight -= 1
+            
+            pause = parse_retry_after(retry_after)
+            if pause:
+                self.paused_until = max(self.paused_until, now + pause)
+                self.counters['pauses'] += 1
+            
+            self._round_trip = self._round_trip * (1 - LATENCY_SMOOTHING) + latency * LATENCY_SMOOTHING
+            if status in THROTTLE_STATUS_CODES:
+                self.counters['throttled'] += 1
+            congested = status is None or status in CONGESTION_STATUS_CODES
+            if not congested and status < 400 and method in LATENCY_METHODS:
+                congested = self._latency_congested(method, latency)
+            
+            if congested:
+                self.counters['congested'] += 1
+                if now - self._last_decrease >= self._round_trip:
+                    self.limit = max(self.min_concurrency, self.limit * DECREASE_FACTOR)
+                    self._last_decrease = now
+                    self.counters['decreases'] += 1
+            elif status < 400:
+                self.limit = min(self.max_concurrency, self.limit + 1 / self.limit)
+            
+            self._condition.notify_all()
+    
+    def _latency_congested(self, method: str, latency: float) -> bool:
+        baseline = min(latency, self._baseline.get(method, latency) * BASELINE_DRIFT)
+        smoothed = self._smoothed.get(method, latency) * (1 - LATENCY_SMOOTHING) + latency * LATENCY_SMOOTHING
+        self._baseline[method] = baseline
+        self._smoothed[method] = smoothed
+        return smoothed > baseline * LATENCY_TOLERANCE and smoothed - baseline > LATENCY_FLOOR
+    
+    def stats(self) -> Dict:
+        with self._condition:
+            return {
+                'concurrency_limit': int(self.limit),
+                'max_concurrency': self.max_concurrency,
+                **self.counters
+            }
+    
+    def summary(self) -> str:
+        """One-line rate control summary for console output"""
+        stats = self.stats()
+        return (f"limit {stats['concurrency_limit']}/{stats['max_concurrency']}, "
+                f"{stats['throttled']} throttled, {stats['decreases']} slowdowns, {stats['pauses']} Retry-After pauses")
+
+class PooledTransport:
+    """Keep-alive connection pool with reuse counters for Appwrite requests"""
+    
+    def __init__(self, pool_size: int = DEFAULT_POOL_SIZE, timeout=DEFAULT_TIMEOUT, endpoint: str = None):
+        self.pool_size = max(1, pool_size)
+        self.timeout = timeout
+        self.controller = AdaptiveRateController(self.pool_size)
+        self._ca_bundle = None
+        self.counters = {'requests': 0, 'new_connections': 0}
+        self._server_clock = None
+        self._lock = threading.Lock()
+        
+        # pool_block makes extra threads wait for a free connection instead
+        # of opening throwaway ones that are closed right after use
+        adapter = HTTPAdapter(pool_connections=4, pool_maxsize=self.pool_size, pool_block=True)
+        adapter.poolmanager.pool_classes_by_scheme = {
+            'http': self._counting_pool(HTTPConnectionPool),
+            'https': self._counting_pool(HTTPSConnectionPool)
+        }
+        
+        self.session = requests.Session()
+        self.session.mount('http://', adapter)
+        self.session.mount('https://', adapter)
+        self.session.headers.update({
+            'Accept-Encoding': ACCEPT_ENCODING,
+            'Connection': 'keep-alive'
+        })
+        
+        # With a known endpoint, resolve proxy and CA-bundle settings from
+        # the environment once instead of on every request
+        if endpoint:
+            self.session.proxies.update(requests.utils.get_environ_proxies(endpoint))
+            self._ca_bundle = os.environ.get('REQUESTS_CA_BUNDLE') or os.environ.get('CURL_CA_BUNDLE')
+            self.session.trust_env = False
+    
+    def _counting_pool(self, base: type) -> type:
+        """Connection pool class that counts the connections it opens"""
+        transport = self
+        
+        class CountingPool(base):
+            def _new_conn(self):
+                transport.count('new_connections')
+                return super()._new_conn()
+        
+        return CountingPool
+    
+    def count(self, key: str, amount: int = 1):
+        with self._lock:
+            self.counters[key] += amount
+    
+    def request(self, method: str, url: str, **kwargs) -> requests.Response:
+        """Drop-in for ``requests.request`` that goes through the pooled session
+        
+        The request waits for the rate controller first. Its latency (up to
+        the response headers, so streamed downloads count as answered) and
+        status are reported back to the controller.
+        """
+        kwargs.setdefault('timeout', self.timeout)
+        if self._ca_bundle and kwargs.get('verify', True) is True:
+            kwargs['verify'] = self._ca_bundle
+        self.controller.acquire()
+        self.count('requests')
+        started = time.monotonic()
+        response = None
+        try:
+            response = self.session.request(method, url, **kwargs)
+            return response
+        finally:
+            self.controller.release(
+                method.upper(),
+                response.status_code if response is not None else None,
+                time.monotonic() - started,
+                response.headers.get('Retry-After') if response is not None else None
+            )
+            if response is not None:
+                self.observe_date(response.headers.get('Date'))
+    
+    def observe_date(self, value: str):
+        """Remember the server clock from a response Date header"""
+        if not value:
+            return
+        try:
+            server_time = parsedate_to_datetime(value)
+        except (TypeError, ValueError):
+            return
+        if server_time.tzinfo is None:
+            return
+        with self._lock:
+            self._server_clock = (server_time, time.monotonic())
+    
+    def server_time(self, at: float = None) -> datetime:
+        """Appwrite server time now, or at an earlier ``time.monotonic()`` reading
+        
+        Projected from the last Date header seen; the local clock stands in
+        until a response has carried one.
+        """
+        at = time.monotonic() if at is None else at
+        with self._lock:
+            clock = self._server_clock
+        if clock is None:
+            return datetime.now(timezone.utc) - timedelta(seconds=time.monotonic() - at)
+        server_time, seen = clock
+        return server_time + timedelta(seconds=at - seen)
+    
+    def install(self):
+        """Route every Appwrite SDK request in this process through the pool"""
+        import appwrite.client
+        appwrite.client.requests = _RequestsShim(self)
+    
+    def aiohttp_connector_kwargs(self) -> Dict:
+        """aiohttp.TCPConnector arguments matching this pool"""
+        return {
+            'limit': self.pool_size,
+            'keepalive_timeout': KEEPALIVE_TIMEOUT,
+            'ttl_dns_cache': DNS_CACHE_TTL
+        }
+    
+    def aiohttp_trace_config(self):
+        """aiohttp TraceConfig feeding the same request/connection counters"""
+        import aiohttp
+        
+        async def on_request_start(session, context, params):
+            self.count('requests')
+        
+        async def on_connection_create_end(session, context, params):
+            self.count('new_connections')
+        
+        async def on_request_end(session, context, params):
+            self.observe_date(params.response.headers.get('Date'))
+        
+        trace_config = aiohttp.TraceConfig()
+        trace_config.on_request_start.append(on_request_start)
+        trace_config.on_request_end.append(on_request_end)
+        trace_config.on_connection_create_end.append(on_connection_create_end)
+        return trace_config
+    
+    def stats(self) -> Dict:
+        with self._lock:
+            requests_sent = self.counters['requests']
+            opened = self.counters['new_connections']
+        return {
+            'pool_size': self.pool_size,
+            'requests': requests_sent,
+            'new_connections': opened,
+            'reused_connections': max(0, requests_sent - opened),
+            **self.controller.stats()
+        }
+    
+    def summary(self) -> str:
+        """One-line connection reuse summary for console output"""
+        stats = self.stats()
+        reuse = stats['reused_connections'] / stats['requests'] * 100 if stats['requests'] else 0.0
+        return f"{stats['new_connections']} opened, {stats['reused_connections']} reused ({reuse:.1f}% reuse)"
+    
+    def close(self):
+        self.session.close()
+
+class _RequestsShim:
+    """Stands in for the ``requests`` module inside ``appwrite.client``"""
+    
+    def __init__(self, transport: PooledTransport):
+        self._transport = transport
+    
+    def request(self, method: str, url: str, **kwargs) -> requests.Response:
+        return self._transport.request(method, url, **kwargs)
+    
+    def __getattr__(self, name):
+        return getattr(requests, name)
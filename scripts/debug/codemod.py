@@ -0,0 +1,368 @@
+#!/usr/bin/env python3
+"""
+Codemod Engine
+Applies regex rewrite rules from a JSON file across the project sources,
+scanning each file once.
+
+Usage:
+    python scripts/debug/codemod.py --dry-run
+    python scripts/debug/codemod.py --dry-run --diff
+    python scripts/debug/codemod.py --rules my-rules.json
+    python scripts/debug/codemod.py --files App.tsx pages/HomePage.tsx
+
+Files come from the include/exclude globs in .i18nrc.json, or from
+--files. All rules are merged into one compiled alternation, each rule
+in its own named group, and every match is handed to the replacement of
+the group that matched. Files are spread over a process pool and only
+written back when their content changed.
+
+Rules file (default: translation-fixes.json next to this script):
+    {"rules": [{"name": "...", "pattern": "...", "replacement": "...",
+                "flags": ["IGNORECASE"]}]}
+
+Unlike one re.sub pass per rule, every rule sees the original text: where
+several rules match at the same position the first one listed wins, and
+text produced by one rule is never rewritten by another. Replacements
+may use group references (\\1, \\g<name>); patterns may not use numbered
+backreferences, since group numbers shift inside the merged pattern.
+"""
+
+import os
+import re
+import sys
+import json
+import time
+import difflib
+import argparse
+import tempfile
+from pathlib import Path
+from itertools import repeat
+from collections import Counter
+from concurrent.futures import ProcessPoolExecutor
+from typing import Dict, List
+
+from i18n_sources import PROJECT_ROOT, I18NRC_PATH, load_i18nrc, discover_files
+
+DEFAULT_RULES = Path(__file__).parent / 'translation-fixes.json'
+
+# Rule flags, applied as scoped inline flags so that each rule keeps its
+# own flags inside the merged pattern
+RULE_FLAGS = {'IGNORECASE': 'i', 'MULTILINE': 'm', 'DOTALL': 's', 'VERBOSE': 'x'}
+NUMBERED_BACKREFERENCE = re.compile(r'(?<!\\)(?:\\\\)*\\[1-9]')
+
+# Literal prefix extraction: characters that end the literal part of a
+# pattern, and an unescaped '|' (a pattern with alternatives gets none)
+REGEX_METACHARS = set('.^$*+?{}[]|()')
+QUANTIFIERS = set('*+?{')
+ALTERNATION = re.compile(r'(?<!\\)(?:\\\\)*\|')
+LOOKBEHIND = re.compile(r'\(\?<[!=](?:[^()\\]|\\.)*\)')
+
+# Files handed to each pool worker per task: a few tasks per worker keeps
+# the load even without paying inter-process overhead per file
+TASKS_PER_WORKER = 4
+
+def literal_prefix(pattern: str) -> str:
+    """Text that every match of the pattern starts with ('' if none is known)"""
+    if ALTERNATION.search(pattern):
+        return ''
+    chars = []
+    i = 0
+    # A leading lookbehind matches no text of its own
+    while (lookbehind := LOOKBEHIND.match(pattern, i)):
+        i = lookbehind.end()
+    while i < len(pattern):
+        char = pattern[i]
+        step = 1
+        if char == '\\':
+            # Escaped punctuation is literal; \d, \b, \n and friends are not
+            if i + 1 >= len(pattern) or pattern[i + 1].isalnum():
+                break
+            char = pattern[i + 1]
+            step = 2
+        elif char in REGEX_METACHARS:
+            break
+        if pattern[i + step:i + step + 1] in QUANTIFIERS:
+            break
+        chars.append(char)
+        i += step
+    return ''.join(chars)
+
+class Rule:
+    """One rewrite rule and its branch of the merged pattern"""
+    
+    def __init__(self, index: int, name: str, pattern: str, replacement: str, flags: List[str] = None):
+        self.name = name
+        self.group = f'rule{index}'
+        self.pattern = pattern
+        self.replacement = replacement
+        
+        unknown = [flag for flag in flags or [] if flag not in RULE_FLAGS]
+        if unknown:
+            raise ValueError(f"rule {name}: unknown flags {', '.join(unknown)}")
+        if NUMBERED_BACKREFERENCE.search(pattern):
+            raise ValueError(f"rule {name}: numbered backreferences are not supported in patterns, use (?P=name)")
+        
+        self.inline_flags = ''.join(RULE_FLAGS[flag] for flag in flags or [])
+        try:
+            self.regex = re.compile(f'(?{self.inline_flags}:{pattern})' if self.inline_flags else pattern)
+        except re.error as e:
+            raise ValueError(f"rule {name}: invalid pattern: {e}") from e
+        
+        # Expand the replacement once against an empty match with the same
+        # groups, so a bad escape or a reference to a group the pattern
+        # does not have fails here instead of in the middle of a run
+        names = {number: group for group, number in self.regex.groupindex.items()}
+        shape = ''.join(f'(?P<{names[number]}>)' if number in names else '()'
+                        for number in range(1, self.regex.groups + 1))
+        try:
+            re.compile(shape).match('').expand(replacement)
+        except (re.error, IndexError) as e:
+            raise ValueError(f"rule {name}: invalid replacement: {e}") from e
+        
+        # Without backslashes the replacement is plain text and needs no
+        # template expansion
+        self.plain_replacement = replacement if '\\' not in replacement else None
+        
+        # Files that do not contain the prefix cannot match this rule
+        self.prefix = '' if self.inline_flags else literal_prefix(pattern)
+    
+    def branch(self) -> str:
+        return f'(?P<{self.group}>{self.regex.pattern})'
+    
+    def replace(self, match) -> str:
+        if self.plain_replacement is not None:
+            return self.plain_replacement
+        # Re-match the rule on its own at the same position so that group
+        # references in the replacement resolve to the rule's own groups
+        return self.regex.match(match.string, match.start()).expand(self.replacement)
+
+class RuleSet:
+    """All rules merged into a single alternation
+    
+    A merged pattern loses the literal-prefix search that a single pattern
+    such as ``t\\?\\.home`` gets from the regex engine, so before scanning
+    a file the rules whose literal prefix does not occur in it are dropped
+    (a plain substring search), and the alternation of the remaining rules
+    is compiled once per combination. Most files contain no prefix at all
+    and are never scanned by the regex.
+    """
+    
+    def __init__(self, specs: List[Dict]):
+        if not specs:
+            raise ValueError("no rules defined")
+        self.rules = []
+        for index, spec in enumerate(specs):
+            if not isinstance(spec, dict):
+                raise ValueError(f"rule {index + 1}: expected an object, got {type(spec).__name__}")
+            for key in ('pattern', 'replacement'):
+                if key in spec and not isinstance(spec[key], str):
+                    raise ValueError(f"rule {index + 1}: {key} must be a string")
+            try:
+                self.rules.append(Rule(index, spec.get('name') or f'rule-{index + 1}', spec['pattern'],
+                                       spec['replacement'], spec.get('flags')))
+            except KeyError as e:
+                raise ValueError(f"rule {index + 1}: missing {e}") from e
+        
+        names = Counter(rule.name for rule in self.rules)
+        duplicates = [name for name, count in names.items() if count > 1]
+        if duplicates:
+            raise ValueError(f"duplicate rule names: {', '.join(duplicates)}")
+        
+        self.by_group = {rule.group: rule for rule in self.rules}
+        self._merged = {}
+        try:
+            self.merged(tuple(self.rules))
+        except re.error as e:
+            raise ValueError(f"rules cannot be merged: {e}") from e
+    
+    def merged(self, rules: tuple):
+        """Compiled alternation of the given rules, in rule order"""
+        regex = self._merged.get(rules)
+        if regex is None:
+            regex = self._merged[rules] = re.compile('|'.join(rule.branch() for rule in rules))
+        return regex
+    
+    def apply(self, text: str):
+        """Rewrite text in one scan; return (new text, replacements per rule)"""
+        counts = Counter()
+        candidates = tuple(rule for rule in self.rules if rule.prefix in text)
+        if not candidates:
+            return text, counts
+        
+        def dispatch(match):
+            rule = self.by_group[match.lastgroup]
+            counts[rule.name] += 1
+            return rule.replace(match)
+        
+        return self.merged(candidates).sub(dispatch, text), counts
+
+def load_rules(path) -> List[Dict]:
+    """Read the rule specs from a rules file"""
+    with open(path, 'r', encoding='utf-8') as f:
+        config = json.load(f)
+    return config['rules'] if isinstance(config, dict) else config
+
+def write_atomic(path: str, content: str):
+    """Replace a file's content without leaving it half-written"""
+    directory = os.path.dirname(path) or '.'
+    fd, temp_path = tempfile.mkstemp(dir=directory, prefix='.codemod-')
+    try:
+        with os.fdopen(fd, 'w', encoding='utf-8', newline='') as f:
+            f.write(content)
+        os.chmod(temp_path, os.stat(path).st_mode & 0o7777)
+        os.replace(temp_path, path)
+    except BaseException:
+        os.unlink(temp_path)
+        raise
+
+# Rule set of the current process, built once per pool worker
+_rule_set = None
+
+def init_worker(specs: List[Dict]):
+    global _rule_set
+    _rule_set = RuleSet(specs)
+
+def process_file(path: str, write: bool, show_diff: bool) -> Dict:
+    """Apply the rules to one file; the result is sent back to the parent"""
+    result = {'path': path, 'changed': False, 'replacements': {}, 'diff': None, 'error': None}
+    try:
+        # newline='' keeps CRLF files byte-for-byte outside the replaced text
+        with open(path, 'r', encoding='utf-8', newline='') as f:
+            content = f.read()
+        
+        updated, counts = _rule_set.apply(content)
+        if updated == content:
+            return result
+        
+        result['changed'] = True
+        result['replacements'] = dict(counts)
+        if show_diff:
+            result['diff'] = ''.join(difflib.unified_diff(
+                content.splitlines(keepends=True), updated.splitlines(keepends=True),
+                fromfile=path, tofile=path, n=2
+            ))
+        if write:
+            write_atomic(path, updated)
+    except (OSError, UnicodeDecodeError) as e:
+        result['error'] = str(e)
+    return result
+
+def run_codemod(specs: List[Dict], paths: List[str], write: bool = True, show_diff: bool = False, workers: int = None):
+    """Yield process_file results, in parallel unless a single worker is asked for"""
+    workers = max(1, min(workers or os.cpu_count() or 1, len(paths) or 1))
+    if workers == 1:
+        init_worker(specs)
+        for path in paths:
+            yield process_file(path, write, show_diff)
+        return
+    
+    chunksize = max(1, len(paths) // (workers * TASKS_PER_WORKER))
+    with ProcessPoolExecutor(max_workers=workers, initializer=init_worker, initargs=(specs,)) as executor:
+        yield from executor.map(process_file, paths, repeat(write), repeat(show_diff), chunksize=chunksize)
+
+def display_path(path: str) -> str:
+    try:
+        return Path(path).resolve().relative_to(PROJECT_ROOT.resolve()).as_posix()
+    except ValueError:
+        return path
+
+def main():
+    parser = argparse.ArgumentParser(
+        description='Apply regex rewrite rules across the project sources in one pass per file',
+        formatter_class=argparse.RawDescriptionHelpFormatter,
+        epilog="""
+Examples:
+  # Preview the translation fixes with diffs
+  python scripts/debug/codemod.py --dry-run --diff
+  
+  # Apply custom rules to two files
+  python scripts/debug/codemod.py --rules my-rules.json --files App.tsx pages/HomePage.tsx
+        """
+    )
+    
+    parser.add_argument(
+        '--rules',
+        default=str(DEFAULT_RULES),
+        help=f'Rules file (default: {DEFAULT_RULES.name})'
+    )
+    
+    parser.add_argument(
+        '--config',
+        default=str(I18NRC_PATH),
+        help='i18n Ally config whose include/exclude globs select the files (default: .i18nrc.json)'
+    )
+    
+    parser.add_argument(
+        '--files',
+        nargs='+',
+        metavar='PATH',
+        help='Rewrite these files instead of the ones selected by the config'
+    )
+    
+    parser.add_argument(
+        '--dry-run',
+        action='store_true',
+        help='Report what would change without writing any file'
+    )
+    
+    parser.add_argument(
+        '--diff',
+        action='store_true',
+        help='Print a unified diff of every changed file'
+    )
+    
+    parser.add_argument(
+        '--workers',
+        type=int,
+        default=os.cpu_count() or 1,
+        help='Worker processes (default: number of CPUs; 1 runs in this process)'
+    )
+    
+    args = parser.parse_args()
+    
+    try:
+        specs = load_rules(args.rules)
+        rule_names = [rule.name for rule in RuleSet(specs).rules]
+        paths = [str(Path(p)) for p in args.files] if args.files else [str(p) for p in discover_files(load_i18nrc(args.config))]
+    except (OSError, ValueError, KeyError) as e:
+        print(f"❌ {e}")
+        sys.exit(1)
+    
+    print(f"🔧 {len(rule_names)} rules from {args.rules}")
+    print(f"📁 {len(paths)} files{' (dry run)' if args.dry_run else ''}\n")
+    
+    started = time.monotonic()
+    totals = Counter()
+    changed = 0
+    errors = 0
+    
+    for result in run_codemod(specs, paths, write=not args.dry_run, show_diff=args.diff, workers=args.workers):
+        path = display_path(result['path'])
+        if result['error']:
+            errors += 1
+            print(f"❌ Error fixing {path}: {result['error']}")
+        elif result['changed']:
+            changed += 1
+            totals.update(result['replacements'])
+            count = sum(result['replacements'].values())
+            print(f"{'📝 Would fix' if args.dry_run else '✅ Fixed'}: {path} ({count} replacements)")
+            if result['diff']:
+                print(result['diff'])
+    
+    elapsed = time.monotonic() - started
+    print(f"\n{'='*60}")
+    print(f"Files scanned:  {len(paths)}")
+    print(f"Files changed:  {changed}")
+    print(f"Errors:         {errors}")
+    print(f"Duration:       {elapsed:.2f}s")
+    for name in rule_names:
+        if totals[name]:
+            print(f"  • {name}: {totals[name]}")
+    
+    if args.dry_run and changed:
+        print("\n🔒 DRY RUN: No files were written")
+    
+    sys.exit(1 if errors else 0)
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,138 @@
+#!/usr/bin/env python3
+"""
+Source file discovery for the translation tooling.
+
+Reads ``.i18nrc.json`` (the i18n Ally config at the project root) and turns
+its ``include`` / ``exclude`` globs into the list of source files the
+codemod and key indexer work on. The globs use the editor's syntax: ``**``
+spans directories, ``{ts,tsx}`` expands to alternatives, and an exclude
+entry without a slash or wildcard (``node_modules``) drops every path
+that has a directory or file of that name.
+
+Usage:
+    config = load_i18nrc()
+    for path in discover_files(config):
+        ...
+    locale_files = discover_locale_files(config)   # localesPaths
+"""
+
+import os
+import re
+import json
+from pathlib import Path
+from typing import Dict, List
+
+# Project root and the i18n Ally config read by default
+PROJECT_ROOT = Path(__file__).parent.parent.parent
+I18NRC_PATH = PROJECT_ROOT / '.i18nrc.json'
+
+# Characters that make a path component a pattern rather than a directory
+GLOB_CHARS = set('*?[{')
+
+def load_i18nrc(path=I18NRC_PATH) -> Dict:
+    """Load the i18n Ally config"""
+    with open(path, 'r', encoding='utf-8') as f:
+        return json.load(f)
+
+def expand_braces(pattern: str) -> List[str]:
+    """Expand ``{a,b}`` alternatives, innermost groups included, into plain globs"""
+    match = re.search(r'\{([^{}]*)\}', pattern)
+    if not match:
+        return [pattern]
+    head, tail = pattern[:match.start()], pattern[match.end():]
+    expanded = []
+    for option in match.group(1).split(','):
+        expanded.extend(expand_braces(head + option + tail))
+    return expanded
+
+def glob_to_regex(pattern: str) -> str:
+    """Translate one brace-free glob to a regex over '/'-separated relative paths"""
+    parts = []
+    i = 0
+    while i < len(pattern):
+        if pattern.startswith('**/', i):
+            parts.append('(?:.*/)?')
+            i += 3
+        elif pattern.startswith('**', i):
+            parts.append('.*')
+            i += 2
+        elif pattern[i] == '*':
+            parts.append('[^/]*')
+            i += 1
+        elif pattern[i] == '?':
+            parts.append('[^/]')
+            i += 1
+        else:
+            parts.append(re.escape(pattern[i]))
+            i += 1
+    return ''.join(parts)
+
+def compile_globs(patterns: List[str]):
+    """One regex matching a relative path against any of the globs"""
+    globs = [glob for pattern in patterns for glob in expand_braces(pattern)]
+    if not globs:
+        return None
+    return re.compile('|'.join(f'(?:{glob_to_regex(glob)})' for glob in globs) + r'\Z')
+
+def normalize_glob(pattern: str) -> str:
+    """Project-relative glob without a leading './'"""
+    return pattern[2:] if pattern.startswith('./') else pattern
+
+def static_prefix(pattern: str) -> str:
+    """Leading directories of a glob that contain no wildcards"""
+    prefix = []
+    for part in pattern.split('/')[:-1]:
+        if GLOB_CHARS & set(part):
+            break
+        prefix.append(part)
+    return '/'.join(prefix)
+
+class SourceFilter:
+    """Include/exclude matching for project-relative paths"""
+    
+    def __init__(self, include: List[str], exclude: List[str] = None):
+        include = [normalize_glob(p) for p in include]
+        exclude = [normalize_glob(p) for p in exclude or []]
+        self.include = compile_globs(include)
+        self.excluded_names = {p for p in exclude if '/' not in p and not GLOB_CHARS & set(p)}
+        self.exclude = compile_globs([p for p in exclude if p not in self.excluded_names])
+        
+        # Walk only the directories the include globs can reach: the
+        # wildcard-free prefix of each one (lib/**/*.ts -> lib)
+        roots = {static_prefix(glob) for pattern in include for glob in expand_braces(pattern)}
+        self.roots = sorted(root for root in roots if not any(
+            root.startswith(other + '/') or (other == '' and root) for other in roots if other != root
+        ))
+    
+    def excludes_dir(self, relative: str) -> bool:
+        return os.path.basename(relative) in self.excluded_names
+    
+    def matches(self, relative: str) -> bool:
+        if set(relative.split('/')) & self.excluded_names:
+            return False
+        if self.exclude and self.exclude.match(relative):
+            return False
+        return bool(self.include and self.include.match(relative))
+
+def discover_files(config: Dict, root: Path = PROJECT_ROOT) -> List[Path]:
+    """Source files selected by the config's include/exclude globs, sorted"""
+    source_filter = SourceFilter(config.get('include', []), config.get('exclude', []))
+    root = Path(root)
+    found = set()
+    
+    for base in source_filter.roots:
+        top = root / base if base else root
+        for directory, dirnames, filenames in os.walk(top):
+            relative_dir = Path(directory).relative_to(root).as_posix()
+            relative_dir = '' if relative_dir == '.' else relative_dir + '/'
+            dirnames[:] = [d for d in dirnames if not source_filter.excludes_dir(relative_dir + d)]
+            for name in filenames:
+                relative = relative_dir + name
+                if source_filter.matches(relative):
+                    found.add(relative)
+    
+    return [root / relative for relative in sorted(found)]
+
+def discover_locale_files(config: Dict, root: Path = PROJECT_ROOT) -> List[Path]:
+    """Translation files selected by the config's localesPaths, sorted"""
+    return discover_files({'include': config.get('localesPaths', [])}, root)
@@ -0,0 +1,532 @@
+#!/usr/bin/env python3
+"""
+Translation Key Index
+Finds translation keys that are used but not defined (missing) and keys
+that are defined but never used (unused).
+
+Usage:
+    python scripts/debug/translation-keys.py                 # index summary
+    python scripts/debug/translation-keys.py missing
+    python scripts/debug/translation-keys.py unused
+    python scripts/debug/translation-keys.py usages home.therapistsTitle
+    python scripts/debug/translation-keys.py missing --no-update   # query the cache as is
+
+Keys are used through the ``keyMatcherRegex`` of .i18nrc.json
+(``t('home.title')``) and through optional chaining on the translation
+object (``translationsObject?.home?.title``, ``t?.home?.title``). Keys
+are defined in the files matched by its ``localesPaths``: en.json and
+id.json, and the object literals of the src/translations/*.ts modules
+(``export const x = { en: {...}, id: {...} }`` and
+``translations.en.home = {...}``).
+
+Every file's extracted keys are cached in SQLite under its content hash.
+A file whose size and modification time are unchanged is not even read,
+so after a small edit only the edited files are parsed again, and
+queries are answered from the cache.
+"""
+
+import os
+import re
+import sys
+import json
+import time
+import bisect
+import sqlite3
+import hashlib
+import argparse
+from pathlib import Path
+from collections import defaultdict
+from typing import Dict, Iterator, List
+
+from i18n_sources import PROJECT_ROOT, I18NRC_PATH, load_i18nrc, discover_files, discover_locale_files
+
+DEFAULT_CACHE = PROJECT_ROOT / '.i18n-index' / 'keys.sqlite'
+
+# Bumped whenever extraction changes, so cached results are rebuilt
+EXTRACTOR_VERSION = 1
+
+# Optional-chaining access: translation objects the chain can start from.
+# `t` is also a common name for a therapist, so a chain only counts when
+# its first segment is a defined top-level section (home, common, ...)
+CHAIN_ROOTS = ('translationsObject', 'translations', '_t', 't')
+CHAIN_PATTERN = (r'(?<![\w$.])(?:' + '|'.join(CHAIN_ROOTS) + r')\?\.'
+                 r'([A-Za-z_$][\w$]*(?:\??\.[A-Za-z_$][\w$]*)*)')
+
+# Members that end a key chain: t?.home?.title?.replace(...) uses home.title
+ACCESS_METHODS = {
+    'replace', 'split', 'trim', 'toUpperCase', 'toLowerCase', 'toString', 'length',
+    'map', 'filter', 'find', 'forEach', 'includes', 'join', 'slice', 'substring',
+    'startsWith', 'endsWith', 'indexOf', 'charAt'
+}
+
+# Report limits for console output
+MAX_LOCATIONS = 3
+
+# TypeScript/JSON tokens: enough of the grammar to follow object literals
+TOKEN = re.compile(r"""
+    (?P<space>\s+)
+  | (?P<comment>//[^\n]*|/\*.*?(?:\*/|\Z))
+  | (?P<string>'(?:[^'\\\n]|\\.)*'|"(?:[^"\\\n]|\\.)*")
+  | (?P<template>`)
+  | (?P<name>[A-Za-z_$][\w$]*)
+  | (?P<number>\d[\w.]*)
+  | (?P<punct>\.\.\.|\?\.|=>|[=!]==?|[<>]=|[{}()\[\]:,;=.])
+  | (?P<other>.)
+""", re.S | re.X)
+
+def skip_template(text: str, pos: int) -> int:
+    """End offset of the template literal whose backtick is at pos"""
+    i = pos + 1
+    while i < len(text):
+        if text[i] == '\\':
+            i += 2
+        elif text[i] == '`':
+            return i + 1
+        elif text.startswith('${', i):
+            i = skip_block(text, i + 1)
+        else:
+            i += 1
+    return len(text)
+
+def skip_block(text: str, pos: int) -> int:
+    """End offset of the brace block that opens at pos"""
+    depth = 0
+    while pos < len(text):
+        match = TOKEN.match(text, pos)
+        value = match.group()
+        if match.lastgroup == 'template':
+            pos = skip_template(text, pos)
+            continue
+        if value == '{':
+            depth += 1
+        elif value == '}':
+            depth -= 1
+            if depth == 0:
+                return match.end()
+        pos = match.end()
+    return len(text)
+
+def tokenize(text: str) -> List[tuple]:
+    """(kind, value, line) tokens without whitespace and comments"""
+    tokens = []
+    pos = 0
+    line = 1
+    while pos < len(text):
+        match = TOKEN.match(text, pos)
+        kind = match.lastgroup
+        end = skip_template(text, pos) if kind == 'template' else match.end()
+        if kind not in ('space', 'comment'):
+            tokens.append(('string' if kind == 'template' else kind, text[pos:end], line))
+        line += text.count('\n', pos, end)
+        pos = end
+    return tokens
+
+def skip_value(tokens: List[tuple], i: int) -> int:
+    """Index of the ',' or '}' that ends the property value starting at i"""
+    depth = 0
+    while i < len(tokens):
+        value = tokens[i][1]
+        if value in ('{', '(', '['):
+            depth += 1
+        elif value in ('}', ')', ']'):
+            if depth == 0:
+                return i
+            depth -= 1
+        elif value == ',' and depth == 0:
+            return i
+        i += 1
+    return i
+
+def parse_object(tokens: List[tuple], i: int, path: List[str], definitions: List):
+    """Record the leaf keys of the object literal opening at i; return the index after it"""
+    i += 1
+    while i < len(tokens):
+        kind, value, line = tokens[i]
+        if value == '}':
+            return i + 1
+        if value == ',':
+            i += 1
+            continue
+        if kind in ('name', 'string', 'number') and i + 1 < len(tokens) and tokens[i + 1][1] == ':':
+            key = value[1:-1] if kind == 'string' else value
+            if i + 2 < len(tokens) and tokens[i + 2][1] == '{':
+                i = parse_object(tokens, i + 2, path + [key], definitions)
+            else:
+                definitions.append(['.'.join(path + [key]), line])
+                i = skip_value(tokens, i + 2)
+            continue
+        # Spreads, shorthand properties and methods define nothing we can name
+        i = skip_value(tokens, i + 1) if value == '...' else skip_value(tokens, i)
+        if i < len(tokens) and tokens[i][1] == ',':
+            i += 1
+        elif i < len(tokens) and tokens[i][1] != '}':
+            i += 1
+    return i
+
+def assignment_path(tokens: List[tuple], i: int) -> List[str]:
+    """Object path assigned to by the '=' at i: translations.en.home = ... -> [en, home]"""
+    chain = []
+    j = i - 1
+    while j >= 0 and tokens[j][0] == 'name':
+        chain.insert(0, tokens[j][1])
+        if j >= 1 and tokens[j - 1][1] == '.':
+            j -= 2
+        else:
+            break
+    return chain[1:]
+
+def extract_definitions(text: str, is_json: bool) -> List:
+    """[dotted path, line] of every leaf defined in a translation file"""
+    tokens = tokenize(text)
+    definitions = []
+    if is_json:
+        start = next((i for i, token in enumerate(tokens) if token[1] == '{'), None)
+        if start is not None:
+            parse_object(tokens, start, [], definitions)
+        return definitions
+    
+    i = 0
+    while i < len(tokens) - 1:
+        if tokens[i][1] == '=' and tokens[i + 1][1] == '{':
+            i = parse_object(tokens, i + 1, assignment_path(tokens, i), definitions)
+        else:
+            i += 1
+    return definitions
+
+class UsageExtractor:
+    """Translation key usages of a source file"""
+    
+    def __init__(self, config: Dict):
+        # The editor's regex matches t( at the end of any word (format('x'),
+        # split('.')), so usages must start at a word boundary here
+        self.key_call = re.compile(r'(?<![\w$])' + config['keyMatcherRegex'])
+        self.chain = re.compile(CHAIN_PATTERN)
+        self.id = hashlib.sha256(
+            f"{EXTRACTOR_VERSION}\n{self.key_call.pattern}\n{self.chain.pattern}".encode()
+        ).hexdigest()
+    
+    def extract(self, text: str) -> List:
+        """[key, kind, line] per usage; kind is 'call' or 'chain'"""
+        newlines = [m.start() for m in re.finditer('\n', text)]
+        usages = []
+        for kind, regex in (('call', self.key_call), ('chain', self.chain)):
+            for match in regex.finditer(text):
+                key = match.group(1).replace('?.', '.')
+                usages.append([key, kind, bisect.bisect(newlines, match.start()) + 1])
+        return usages
+
+class KeyCache:
+    """Per-file extraction results, keyed by content hash
+    
+    ``files`` maps each indexed path to the size, modification time and
+    SHA-256 of its content when it was last read; ``extractions`` holds
+    the usages or definitions extracted from a given content hash. A file
+    whose size and mtime still match is not read again, and identical
+    content in several files is parsed once. Results for content that no
+    indexed file has any more are pruned after each update.
+    """
+    
+    def __init__(self, path: str):
+        os.makedirs(os.path.dirname(os.path.abspath(path)), exist_ok=True)
+        self.db = sqlite3.connect(path, timeout=60)
+        self.db.execute("""
+            CREATE TABLE IF NOT EXISTS files (
+                path TEXT PRIMARY KEY,
+                size INTEGER NOT NULL,
+                mtime_ns INTEGER NOT NULL,
+                sha256 TEXT NOT NULL,
+                locale_file INTEGER NOT NULL
+            )
+        """)
+        self.db.execute("""
+            CREATE TABLE IF NOT EXISTS extractions (
+                sha256 TEXT NOT NULL,
+                kind TEXT NOT NULL,
+                data TEXT NOT NULL,
+                PRIMARY KEY (sha256, kind)
+            )
+        """)
+        self.db.execute("CREATE TABLE IF NOT EXISTS meta (key TEXT PRIMARY KEY, value TEXT)")
+        self.db.commit()
+    
+    def check_extractor(self, extractor_id: str):
+        """Drop cached results made by a different extractor or key regex"""
+        row = self.db.execute("SELECT value FROM meta WHERE key = 'extractor'").fetchone()
+        if row and row[0] == extractor_id:
+            return
+        self.db.execute("DELETE FROM extractions")
+        self.db.execute("DELETE FROM files")
+        self.db.execute("INSERT OR REPLACE INTO meta VALUES ('extractor', ?)", (extractor_id,))
+        self.db.commit()
+    
+    def update(self, sources: Dict[str, bool], extractor: UsageExtractor, rehash: bool = False) -> Dict:
+        """Bring the cache up to date with the given {relative path: is locale file}"""
+        stats = {'files': len(sources), 'unchanged': 0, 'hashed': 0, 'parsed': 0, 'removed': 0}
+        known = {row[0]: row[1:] for row in self.db.execute("SELECT path, size, mtime_ns, sha256, locale_file FROM files")}
+        extracted = {tuple(row) for row in self.db.execute("SELECT sha256, kind FROM extractions")}
+        
+        for relative, locale_file in sources.items():
+            path = PROJECT_ROOT / relative
+            try:
+                stat = path.stat()
+            except OSError:
+                continue
+            cached = known.get(relative)
+            if (not rehash and cached and cached[0] == stat.st_size and cached[1] == stat.st_mtime_ns
+                    and cached[3] == locale_file):
+                stats['unchanged'] += 1
+                continue
+            
+            content = path.read_bytes()
+            sha256 = hashlib.sha256(content).hexdigest()
+            stats['hashed'] += 1
+            kinds = ['usages', 'definitions'] if locale_file else ['usages']
+            missing = [kind for kind in kinds if (sha256, kind) not in extracted]
+            if missing:
+                stats['parsed'] += 1
+                text = content.decode('utf-8', errors='replace')
+                for kind in missing:
+                    data = extractor.extract(text) if kind == 'usages' else extract_definitions(text, relative.endswith('.json'))
+                    self.db.execute("INSERT OR REPLACE INTO extractions VALUES (?, ?, ?)", (sha256, kind, json.dumps(data)))
+                    extracted.add((sha256, kind))
+            self.db.execute(
+                "INSERT OR REPLACE INTO files VALUES (?, ?, ?, ?, ?)",
+                (relative, stat.st_size, stat.st_mtime_ns, sha256, int(locale_file))
+            )
+        
+        gone = [(path,) for path in known if path not in sources]
+        if gone:
+            self.db.executemany("DELETE FROM files WHERE path = ?", gone)
+            stats['removed'] = len(gone)
+        self.db.execute("DELETE FROM extractions WHERE sha256 NOT IN (SELECT sha256 FROM files)")
+        self.db.commit()
+        return stats
+    
+    def results(self, kind: str) -> Iterator[tuple]:
+        """(path, extracted data) of every indexed file"""
+        rows = self.db.execute("""
+            SELECT f.path, e.data FROM files f
+            JOIN extractions e ON e.sha256 = f.sha256 AND e.kind = ?
+            ORDER BY f.path
+        """, (kind,))
+        for path, data in rows:
+            yield path, json.loads(data)
+    
+    def close(self):
+        self.db.close()
+
+class KeyIndex:
+    """Defined keys per locale and resolved usages, answering missing/unused queries"""
+    
+    def __init__(self, cache: KeyCache, source_language: str = 'en'):
+        self.source_language = source_language
+        self.defined = defaultdict(dict)   # locale -> key -> (path, line)
+        
+        definitions = list(cache.results('definitions'))
+        locales = {Path(path).stem for path, _ in definitions if path.endswith('.json')} | {source_language}
+        for path, entries in definitions:
+            json_locale = Path(path).stem if path.endswith('.json') else None
+            for key, line in entries:
+                locale = json_locale
+                if locale is None:
+                    locale, _, key = key.partition('.')
+                    if locale not in locales or not key:
+                        continue
+                self.defined[locale].setdefault(key, (path, line))
+        
+        self.leaves = set().union(*self.defined.values()) if self.defined else set()
+        self.sections = {key.rsplit('.', n)[0] for key in self.leaves for n in range(1, key.count('.') + 1)}
+        self.top_sections = {key.split('.', 1)[0] for key in self.leaves}
+        
+        # Resolved usages: key -> [(path, line)], plus whole sections that
+        # are passed around (t?.home) and so count every key below as used
+        self.used = defaultdict(list)
+        self.used_sections = defaultdict(list)
+        self.unknown = defaultdict(list)
+        for path, usages in cache.results('usages'):
+            for key, kind, line in usages:
+                resolved = self.resolve(key, kind)
+                if resolved:
+                    target, key = resolved
+                    {'leaf': self.used, 'section': self.used_sections, 'missing': self.unknown}[target][key].append((path, line))
+    
+    def resolve(self, key: str, kind: str):
+        """('leaf' | 'section' | 'missing', key) for one usage, None if it is not a translation"""
+        if kind == 'call':
+            if key in self.leaves:
+                return 'leaf', key
+            if key in self.sections:
+                return 'section', key
+            # Keys are namespaced (home.title); a bare word is a label
+            # passed to a local helper such as t('Freelance', 'Lepas')
+            return ('missing', key) if '.' in key else None
+        
+        segments = key.split('.')
+        if segments[0] not in self.top_sections:
+            return None
+        for n in range(len(segments), 0, -1):
+            prefix = '.'.join(segments[:n])
+            if prefix in self.leaves:
+                return 'leaf', prefix
+            if prefix in self.sections:
+                rest = segments[n:]
+                if not rest or rest[0] in ACCESS_METHODS:
+                    return 'section', prefix
+                return 'missing', f'{prefix}.{rest[0]}'
+        return None
+    
+    def locales(self) -> List[str]:
+        return sorted(self.defined)
+    
+    def missing(self) -> List[tuple]:
+        """(key, locales lacking it, usage locations) for every used key some locale lacks"""
+        report = []
+        for key, locations in self.unknown.items():
+            report.append((key, self.locales(), locations))
+        for key, locations in self.used.items():
+            lacking = [locale for locale in self.locales() if key not in self.defined[locale]]
+            if lacking:
+                report.append((key, lacking, locations))
+        return sorted(report)
+    
+    def is_used(self, key: str) -> bool:
+        if key in self.used:
+            return True
+        parts = key.split('.')
+        return any('.'.join(parts[:n]) in self.used_sections for n in range(1, len(parts)))
+    
+    def unused(self, locale: str = None) -> List[tuple]:
+        """(key, definition location) for every key of the locale that nothing uses"""
+        defined = self.defined.get(locale or self.source_language, {})
+        return sorted((key, location) for key, location in defined.items() if not self.is_used(key))
+    
+    def usages(self, key: str) -> List[tuple]:
+        """Locations using the key, a key below it, or a section containing it"""
+        locations = []
+        for table in (self.used, self.used_sections, self.unknown):
+            for used_key, entries in table.items():
+                if used_key == key or used_key.startswith(key + '.') or key.startswith(used_key + '.'):
+                    locations.extend((used_key, path, line) for path, line in entries)
+        return sorted(locations, key=lambda entry: (entry[1], entry[2]))
+
+def format_locations(locations: List[tuple]) -> str:
+    shown = ', '.join(f"{path}:{line}" for path, line in locations[:MAX_LOCATIONS])
+    more = len(locations) - MAX_LOCATIONS
+    return shown + (f" (+{more} more)" if more > 0 else '')
+
+def collect_sources(config: Dict) -> Dict[str, bool]:
+    """{project-relative path: is locale file} for every file to index"""
+    sources = {path.relative_to(PROJECT_ROOT).as_posix(): False for path in discover_files(config)}
+    for path in discover_locale_files(config):
+        sources[path.relative_to(PROJECT_ROOT).as_posix()] = True
+    return sources
+
+def main():
+    parser = argparse.ArgumentParser(
+        description='Index translation key usage and report missing or unused keys',
+        formatter_class=argparse.RawDescriptionHelpFormatter,
+        epilog="""
+Queries:
+  stats            Index summary (default)
+  missing          Keys used in code but not defined in every locale
+  unused           Keys defined in the source language that nothing uses
+  usages KEY       Where a key (or its section) is used
+        """
+    )
+    
+    parser.add_argument(
+        'query',
+        nargs='?',
+        default='stats',
+        choices=['stats', 'missing', 'unused', 'usages'],
+        help='What to report (default: stats)'
+    )
+    
+    parser.add_argument(
+        'key',
+        nargs='?',
+        help='Key for the usages query'
+    )
+    
+    parser.add_argument(
+        '--config',
+        default=str(I18NRC_PATH),
+        help='i18n Ally config with the include globs, localesPaths and keyMatcherRegex (default: .i18nrc.json)'
+    )
+    
+    parser.add_argument(
+        '--cache',
+        default=str(DEFAULT_CACHE),
+        help='SQLite cache of extracted keys (default: .i18n-index/keys.sqlite)'
+    )
+    
+    parser.add_argument(
+        '--locale',
+        help='Locale for the unused query (default: the config\'s sourceLanguage)'
+    )
+    
+    parser.add_argument(
+        '--no-update',
+        action='store_true',
+        help='Answer from the cache without checking files for changes'
+    )
+    
+    parser.add_argument(
+        '--rehash',
+        action='store_true',
+        help='Hash every file instead of trusting unchanged size and mtime'
+    )
+    
+    args = parser.parse_args()
+    if args.query == 'usages' and not args.key:
+        parser.error('usages needs a KEY')
+    
+    try:
+        config = load_i18nrc(args.config)
+        extractor = UsageExtractor(config)
+    except (OSError, ValueError, KeyError, re.error) as e:
+        print(f"❌ Invalid config {args.config}: {e}")
+        sys.exit(1)
+    
+    cache = KeyCache(args.cache)
+    try:
+        cache.check_extractor(extractor.id)
+        if not args.no_update:
+            started = time.monotonic()
+            stats = cache.update(collect_sources(config), extractor, rehash=args.rehash)
+            print(f"🔄 Indexed {stats['files']} files in {(time.monotonic() - started) * 1000:.0f} ms: "
+                  f"{stats['unchanged']} unchanged, {stats['parsed']} parsed, {stats['removed']} removed")
+        
+        started = time.monotonic()
+        index = KeyIndex(cache, config.get('sourceLanguage', 'en'))
+        
+        if args.query == 'missing':
+            report = index.missing()
+            for key, locales, locations in report:
+                print(f"  • {key} [{', '.join(locales)}] - {format_locations(locations)}")
+            print(f"\n❓ {len(report)} keys missing from at least one locale")
+        elif args.query == 'unused':
+            report = index.unused(args.locale)
+            for key, (path, line) in report:
+                print(f"  • {key} - {path}:{line}")
+            print(f"\n🗑️  {len(report)} unused keys in {args.locale or index.source_language}")
+        elif args.query == 'usages':
+            report = index.usages(args.key)
+            for used_key, path, line in report:
+                print(f"  • {path}:{line} ({used_key})")
+            print(f"\n🔍 {len(report)} usages of {args.key}")
+        else:
+            print(f"\n{'='*60}")
+            for locale in index.locales():
+                print(f"Keys ({locale}):      {len(index.defined[locale])}")
+            print(f"Used keys:      {len(index.used)}")
+            print(f"Used sections:  {len(index.used_sections)}")
+            print(f"Missing keys:   {len(index.missing())}")
+            print(f"Unused keys:    {len(index.unused())}")
+        
+        print(f"⏱️  Query answered in {(time.monotonic() - started) * 1000:.0f} ms")
+    finally:
+        cache.close()
+
+if __name__ == '__main__':
+    main()
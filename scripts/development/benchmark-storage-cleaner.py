@@ -0,0 +1,574 @@
+#!/usr/bin/env python3
+"""
+Storage Cleaner Benchmark
+Runs storage-cleaner.py against a local stand-in for the Appwrite storage
+and databases REST API, so performance can be measured without touching
+production.
+
+The fake server generates synthetic buckets on the fly (file N's
+attributes are derived from its index, so 1M files cost almost no memory),
+injects latency and rate limits, and counts every API call. Each scenario
+runs the cleaner as a subprocess against a fresh dataset and reports wall
+time, throughput, peak memory and API call counts.
+
+Usage:
+    python scripts/development/benchmark-storage-cleaner.py
+    python scripts/development/benchmark-storage-cleaner.py --sizes 10k 100k --scenarios age-only orphaned
+    python scripts/development/benchmark-storage-cleaner.py --sizes 1m --latency-ms 20 --rate-limit 500
+    python scripts/development/benchmark-storage-cleaner.py --cleaner-args="--async --workers 32" --output bench.json
+"""
+
+import os
+import sys
+import json
+import time
+import math
+import random
+import shlex
+import shutil
+import argparse
+import tempfile
+import threading
+import subprocess
+from datetime import datetime, timedelta, timezone
+from http.server import ThreadingHTTPServer, BaseHTTPRequestHandler
+from pathlib import Path
+from typing import Dict, List
+from urllib.parse import urlparse, parse_qsl
+
+# Project root
+PROJECT_ROOT = Path(__file__).parent.parent.parent
+CLEANER_SCRIPT = PROJECT_ROOT / 'scripts' / 'storage-cleaner.py'
+
+# Cleaner arguments per scenario
+SCENARIOS = {
+    'age-only': {
+        'description': 'Files older than 30 days, server-side filtered',
+        'args': ['--days', '30', '--no-temp', '--bucket', 'payment_proofs']
+    },
+    'orphaned': {
+        'description': 'Orphan detection against the reference collections',
+        'args': ['--orphaned-only', '--no-temp', '--bucket', 'payment_proofs']
+    },
+    'temp': {
+        'description': 'Temporary/test file names only',
+        'args': ['--bucket', 'payment_proofs']
+    },
+    'all-buckets': {
+        'description': 'Age, orphan and temp rules over every bucket',
+        'args': ['--days', '30', '--orphaned-only', '--bucket', 'all']
+    }
+}
+
+DEFAULT_SIZES = ['10k', '100k', '1m']
+
+# Synthetic data shape: creation dates spread evenly over DATA_SPAN_DAYS
+# (oldest first), a share of temp names, and reference documents per
+# collection as a fraction of the bucket size
+DATA_SPAN_DAYS = 365
+TEMP_NAME_RATIO = 0.1
+REFERENCES_PER_FILE = 0.5
+NAMES = ['payment_proof', 'transfer', 'receipt', 'chat_image', 'attachment']
+TEMP_NAMES = ['test_upload', 'temp_proof', 'debug_capture']
+
+def parse_size(value: str) -> int:
+    """Parse a dataset size such as 10000, 10k or 1m"""
+    value = value.strip().lower()
+    multiplier = {'k': 1_000, 'm': 1_000_000}.get(value[-1:], 1)
+    number = value[:-1] if multiplier > 1 else value
+    try:
+        return int(float(number) * multiplier)
+    except ValueError:
+        raise argparse.ArgumentTypeError(f"invalid size: {value}")
+
+def mix(value: int, salt: int) -> int:
+    """Cheap deterministic 32-bit hash for synthetic attributes"""
+    value = (value * 2654435761 + salt * 40503) & 0xFFFFFFFF
+    value ^= value >> 16
+    return (value * 0x45D9F3B) & 0xFFFFFFFF
+
+def format_timestamp(moment: datetime) -> str:
+    """Format a datetime the way Appwrite stores $createdAt/$updatedAt"""
+    return moment.strftime('%Y-%m-%dT%H:%M:%S.') + f"{moment.microsecond // 1000:03d}+00:00"
+
+def parse_timestamp(value: str) -> datetime:
+    return datetime.fromisoformat(value.replace('Z', '+00:00'))
+
+class TimeAxis:
+    """Evenly spaced timestamps: item i sits at ``start + i * step``"""
+    
+    def __init__(self, start: datetime, count: int, span: timedelta):
+        self.start = start
+        self.count = count
+        self.step = span / max(count, 1)
+    
+    def __len__(self) -> int:
+        return self.count
+    
+    def __getitem__(self, index: int) -> str:
+        return format_timestamp(self.start + self.step * index)
+    
+    def index_of(self, value: str) -> int:
+        """Index of the first item at or after ``value``"""
+        offset = (parse_timestamp(value) - self.start) / self.step
+        return min(max(0, math.ceil(offset)), self.count)
+
+class SyntheticBucket:
+    """A bucket of ``size`` generated files plus a deleted-file bitmap"""
+    
+    def __init__(self, bucket_id: str, size: int, axis: TimeAxis):
+        self.bucket_id = bucket_id
+        self.prefix = bucket_id[:4]
+        self.size = size
+        self.axis = axis
+        self.deleted = bytearray(size)
+    
+    def file_id(self, index: int) -> str:
+        return f"{self.prefix}{index:016d}"
+    
+    def index_of(self, file_id: str) -> int:
+        if not file_id.startswith(self.prefix) or not file_id[4:].isdigit():
+            return -1
+        index = int(file_id[4:])
+        return index if index < self.size else -1
+    
+    def file(self, index: int) -> Dict:
+        h = mix(index, 1)
+        if h % 1000 < TEMP_NAME_RATIO * 1000:
+            name = TEMP_NAMES[h % len(TEMP_NAMES)]
+        else:
+            name = NAMES[h % len(NAMES)]
+        created_at = self.axis[index]
+        return {
+            '$id': self.file_id(index),
+            'bucketId': self.bucket_id,
+            '$createdAt': created_at,
+            '$updatedAt': created_at,
+            '$permissions': [],
+            'name': f"{name}_{index}.jpg",
+            'signature': f"{h:08x}",
+            'mimeType': 'image/jpeg',
+            'sizeOriginal': 10_000 + mix(index, 2) % 2_000_000,
+            'chunksTotal': 1,
+            'chunksUploaded': 1
+        }
+
+class SyntheticCollection:
+    """Reference documents pointing at (mostly) existing files in the buckets"""
+    
+    def __init__(self, collection_id: str, size: int, buckets: List[SyntheticBucket], axis: TimeAxis):
+        self.collection_id = collection_id
+        self.salt = mix(sum(map(ord, collection_id)), 3)
+        self.size = size
+        self.buckets = buckets
+        self.axis = axis
+    
+    def document(self, index: int, field: str) -> Dict:
+        bucket = self.buckets[index % len(self.buckets)]
+        return {
+            '$id': f"{self.collection_id[:4]}{index:016d}",
+            '$updatedAt': self.axis[index],
+            field: bucket.file_id(mix(index, self.salt) % bucket.size)
+        }
+
+class FakeAppwrite:
+    """In-process stand-in for the Appwrite endpoints the cleaner uses
+    
+    Implements file listing (limit, cursorAfter, lessThan/orderAsc on
+    $createdAt), document listing (limit, cursorAfter, select, isNotNull,
+    greaterThanEqual/orderAsc on $updatedAt) and file deletion. Buckets
+    and collections are created on first use with the configured size.
+    """
+    
+    def __init__(self, size: int, latency_ms: float = 0.0, rate_limit: float = 0.0):
+        self.size = size
+        self.latency = latency_ms / 1000
+        self.rate_limit = rate_limit
+        self.now = datetime.now(timezone.utc)
+        self.file_axis = TimeAxis(self.now - timedelta(days=DATA_SPAN_DAYS), size, timedelta(days=DATA_SPAN_DAYS))
+        self.lock = threading.Lock()
+        self.reset()
+        
+        self.server = ThreadingHTTPServer(('127.0.0.1', 0), self._handler())
+        self.server.daemon_threads = True
+        self.thread = threading.Thread(target=self.server.serve_forever, daemon=True)
+    
+    @property
+    def endpoint(self) -> str:
+        host, port = self.server.server_address[:2]
+        return f"http://{host}:{port}/v1"
+    
+    def start(self):
+        self.thread.start()
+    
+    def stop(self):
+        self.server.shutdown()
+        self.server.server_close()
+    
+    def reset(self):
+        """Restore a fresh dataset and clear the call counters"""
+        with self.lock:
+            self.buckets = {}
+            self.collections = {}
+            self.calls = {}
+            self.tokens = self.rate_limit
+            self.refilled = time.monotonic()
+    
+    def count(self, call_type: str):
+        with self.lock:
+            self.calls[call_type] = self.calls.get(call_type, 0) + 1
+    
+    def bucket(self, bucket_id: str) -> SyntheticBucket:
+        with self.lock:
+            if bucket_id not in self.buckets:
+                self.buckets[bucket_id] = SyntheticBucket(bucket_id, self.size, self.file_axis)
+            return self.buckets[bucket_id]
+    
+    def collection(self, collection_id: str) -> SyntheticCollection:
+        # Buckets are created up front so references can point into them
+        self.bucket('67a3a0f5001a05f4c982')
+        self.bucket('67c5f85a00262bb6ea19')
+        with self.lock:
+            if collection_id not in self.collections:
+                size = int(self.size * REFERENCES_PER_FILE)
+                axis = TimeAxis(self.now - timedelta(days=30), size, timedelta(days=30))
+                buckets = sorted(self.buckets.values(), key=lambda bucket: bucket.bucket_id)
+                self.collections[collection_id] = SyntheticCollection(collection_id, size, buckets, axis)
+            return self.collections[collection_id]
+    
+    def take_token(self) -> bool:
+        """Token bucket shared by all requests; False means respond 429"""
+        if not self.rate_limit:
+            return True
+        with self.lock:
+            now = time.monotonic()
+            self.tokens = min(self.rate_limit, self.tokens + (now - self.refilled) * self.rate_limit)
+            self.refilled = now
+            if self.tokens < 1:
+                return False
+            self.tokens -= 1
+            return True
+    
+    def list_files(self, bucket: SyntheticBucket, queries: List[Dict]) -> Dict:
+        limit, start, stop = 25, 0, bucket.size
+        for query in queries:
+            method = query['method']
+            if method == 'limit':
+                limit = query['values'][0]
+            elif method == 'lessThan' and query['attribute'] == '$createdAt':
+                stop = min(stop, bucket.axis.index_of(query['values'][0]))
+            elif method == 'cursorAfter':
+                index = bucket.index_of(query['values'][0])
+                if index < 0 or bucket.deleted[index]:
+                    raise LookupError(f"Cursor not found: {query['values'][0]}")
+                start = index + 1
+        
+        files = []
+        index = start
+        while index < stop and len(files) < limit:
+            if not bucket.deleted[index]:
+                files.append(bucket.file(index))
+            index += 1
+        return {'total': stop, 'files': files}
+    
+    def list_documents(self, collection: SyntheticCollection, queries: List[Dict]) -> Dict:
+        limit, start, field, select = 25, 0, 'fileId', None
+        for query in queries:
+            method = query['method']
+            if method == 'limit':
+                limit = query['values'][0]
+            elif method == 'isNotNull':
+                field = query['attribute']
+            elif method == 'select':
+                select = query['values']
+            elif method == 'greaterThanEqual' and query['attribute'] == '$updatedAt':
+                start = max(start, collection.axis.index_of(query['values'][0]))
+            elif method == 'cursorAfter':
+                start = max(start, int(query['values'][0][4:]) + 1)
+        if select:
+            field = next((name for name in select if not name.startswith('$')), field)
+        
+        stop = min(start + limit, collection.size)
+        documents = [collection.document(index, field) for index in range(start, stop)]
+        return {'total': collection.size, 'documents': documents}
+    
+    def delete_file(self, bucket: SyntheticBucket, file_id: str) -> bool:
+        index = bucket.index_of(file_id)
+        with self.lock:
+            if index < 0 or bucket.deleted[index]:
+                return False
+            bucket.deleted[index] = 1
+            return True
+    
+    def _handler(self):
+        fake = self
+        
+        class Handler(BaseHTTPRequestHandler):
+            protocol_version = 'HTTP/1.1'
+            # Send headers and body in one segment; split writes stall
+            # keep-alive clients on delayed ACKs
+            wbufsize = 1 << 16
+            disable_nagle_algorithm = True
+            
+            def log_message(self, *args):
+                pass
+            
+            def send_json(self, status: int, body: Dict, headers: Dict = None):
+                data = json.dumps(body).encode()
+                self.send_response(status)
+                self.send_header('Content-Type', 'application/json')
+                self.send_header('Content-Length', str(len(data)))
+                for key, value in (headers or {}).items():
+                    self.send_header(key, value)
+                self.end_headers()
+                self.wfile.write(data)
+            
+            def send_error_json(self, status: int, message: str, error_type: str, headers: Dict = None):
+                self.send_json(status, {'message': message, 'code': status, 'type': error_type}, headers)
+            
+            def read_body(self) -> bytes:
+                # The SDK sends a JSON body even with GET; it must be consumed
+                # or it corrupts the next request on a keep-alive connection
+                length = int(self.headers.get('Content-Length') or 0)
+                return self.rfile.read(length) if length else b''
+            
+            def prepare(self, call_type: str) -> bool:
+                fake.count(call_type)
+                if fake.latency:
+                    time.sleep(fake.latency * random.uniform(0.5, 1.5))
+                if not fake.take_token():
+                    fake.count('rate_limited')
+                    self.send_error_json(429, 'Rate limit for the current endpoint has been exceeded.',
+                                         'general_rate_limit_exceeded', {'Retry-After': '1'})
+                    return False
+                return True
+            
+            def do_GET(self):
+                self.read_body()
+                url = urlparse(self.path)
+                parts = url.path.strip('/').split('/')
+                queries = [json.loads(value) for key, value in parse_qsl(url.query) if key.startswith('queries[')]
+                
+                if len(parts) == 5 and parts[1] == 'storage' and parts[4] == 'files':
+                    if not self.prepare('list_files'):
+                        return
+                    try:
+                        return self.send_json(200, fake.list_files(fake.bucket(parts[3]), queries))
+                    except LookupError as e:
+                        return self.send_error_json(400, str(e), 'general_cursor_not_found')
+                
+                if len(parts) == 6 and parts[1] == 'databases' and parts[5] == 'documents':
+                    if not self.prepare('list_documents'):
+                        return
+                    return self.send_json(200, fake.list_documents(fake.collection(parts[4]), queries))
+                
+                self.send_error_json(404, 'Route not found', 'general_route_not_found')
+            
+            def do_DELETE(self):
+                self.read_body()
+                parts = urlparse(self.path).path.strip('/').split('/')
+                if len(parts) == 6 and parts[1] == 'storage' and parts[4] == 'files':
+                    if not self.prepare('delete_file'):
+                        return
+                    if fake.delete_file(fake.bucket(parts[3]), parts[5]):
+                        self.send_response(204)
+                        self.send_header('Content-Type', 'text/plain')
+                        self.send_header('Content-Length', '0')
+                        self.end_headers()
+                        return
+                    return self.send_error_json(404, 'The requested file could not be found.', 'storage_file_not_found')
+                
+                self.send_error_json(404, 'Route not found', 'general_route_not_found')
+        
+        return Handler
+
+def run_cleaner(endpoint: str, args: List[str], workdir: str) -> Dict:
+    """Run the cleaner once, returning exit code, wall time, peak RSS and metrics"""
+    metrics_path = os.path.join(workdir, 'metrics.json')
+    log_path = os.path.join(workdir, 'cleaner.log')
+    cmd = [
+        sys.executable, str(CLEANER_SCRIPT), *args,
+        '--metrics-json', metrics_path,
+        '--journal-dir', os.path.join(workdir, 'journal')
+    ]
+    env = dict(
+        os.environ,
+        VITE_APPWRITE_ENDPOINT=endpoint,
+        VITE_APPWRITE_PROJECT_ID='benchmark',
+        APPWRITE_API_KEY='benchmark'
+    )
+    
+    started = time.monotonic()
+    with open(log_path, 'w') as log:
+        process = subprocess.Popen(cmd, cwd=PROJECT_ROOT, env=env, stdout=log, stderr=subprocess.STDOUT)
+        peak_rss_mb = None
+        if hasattr(os, 'wait4'):
+            # wait4 reports the child's own peak RSS (KB on Linux, bytes on macOS)
+            _, status, usage = os.wait4(process.pid, 0)
+            process.returncode = os.waitstatus_to_exitcode(status)
+            peak_rss_mb = usage.ru_maxrss / (1024 * 1024 if sys.platform == 'darwin' else 1024)
+        else:
+            process.wait()
+    elapsed = time.monotonic() - started
+    
+    metrics = None
+    if os.path.exists(metrics_path):
+        with open(metrics_path) as f:
+            metrics = json.load(f)
+    
+    return {
+        'returncode': process.returncode,
+        'seconds': elapsed,
+        'peak_rss_mb': peak_rss_mb,
+        'metrics': metrics,
+        'log': log_path
+    }
+
+def keep_log(result: Dict, size: int, scenario: str, log_dir: str):
+    """Copy a failed run's log out of its temporary workdir before it is removed"""
+    if log_dir:
+        os.makedirs(log_dir, exist_ok=True)
+    fd, kept = tempfile.mkstemp(prefix=f'cleaner-bench-{size}-{scenario}-', suffix='.log', dir=log_dir)
+    os.close(fd)
+    shutil.copyfile(result['log'], kept)
+    result['log'] = kept
+
+def print_result(size: int, scenario: str, result: Dict, calls: Dict):
+    stats = (result['metrics'] or {}).get('stats', {})
+    scanned = stats.get('scanned', 0)
+    rss = f"{result['peak_rss_mb']:.0f} MB" if result['peak_rss_mb'] is not None else 'n/a'
+    print(f"  {scenario:12} {result['seconds']:8.2f}s  {scanned / result['seconds']:9.0f} files/s  "
+          f"{stats.get('deleted', 0):8} deleted  {rss:>8}  "
+          f"list_files={calls.get('list_files', 0)} list_documents={calls.get('list_documents', 0)} "
+          f"delete_file={calls.get('delete_file', 0)} 429s={calls.get('rate_limited', 0)}")
+    
+    phases = (result['metrics'] or {}).get('phases')
+    if phases:
+        print(f"  {'':12} phases: " + ', '.join(f"{name} {seconds:.2f}s" for name, seconds in phases.items()))
+    if result['returncode'] != 0:
+        print(f"  ❌ Cleaner exited with code {result['returncode']} (log: {result['log']})")
+
+def main():
+    parser = argparse.ArgumentParser(
+        description='Benchmark storage-cleaner.py against a local fake Appwrite server',
+        formatter_class=argparse.RawDescriptionHelpFormatter,
+        epilog=f"""
+Available Scenarios:
+{'='*60}
+""" + '\n'.join(f"  {name:12} - {info['description']}" for name, info in SCENARIOS.items())
+    )
+    
+    parser.add_argument(
+        '--sizes',
+        nargs='+',
+        type=parse_size,
+        default=[parse_size(size) for size in DEFAULT_SIZES],
+        help=f"Files per bucket, e.g. 10k 100k 1m (default: {' '.join(DEFAULT_SIZES)})"
+    )
+    
+    parser.add_argument(
+        '--scenarios',
+        nargs='+',
+        choices=list(SCENARIOS.keys()),
+        default=list(SCENARIOS.keys()),
+        help='Scenarios to run (default: all)'
+    )
+    
+    parser.add_argument(
+        '--latency-ms',
+        type=float,
+        default=0.0,
+        help='Mean injected latency per API request in milliseconds (default: 0)'
+    )
+    
+    parser.add_argument(
+        '--rate-limit',
+        type=float,
+        default=0.0,
+        help='Requests per second before the fake server answers 429 (default: unlimited)'
+    )
+    
+    parser.add_argument(
+        '--dry-run',
+        action='store_true',
+        help='Run the cleaner in dry-run mode (no deletions are benchmarked)'
+    )
+    
+    parser.add_argument(
+        '--cleaner-args',
+        default='',
+        help='Extra arguments for storage-cleaner.py, e.g. --cleaner-args="--async --workers 32"'
+    )
+    
+    parser.add_argument(
+        '--output',
+        metavar='PATH',
+        help='Write all results as JSON for regression tracking'
+    )
+    
+    args = parser.parse_args()
+    
+    if not CLEANER_SCRIPT.exists():
+        print(f"❌ Error: Storage cleaner not found at {CLEANER_SCRIPT}")
+        sys.exit(1)
+    
+    extra_args = shlex.split(args.cleaner_args)
+    if args.dry_run:
+        extra_args.append('--dry-run')
+    
+    results = []
+    failures = 0
+    
+    # Logs of failed runs are kept beside the --output file (or in the
+    # system temp directory), since each run's workdir is deleted
+    log_dir = os.path.dirname(os.path.abspath(args.output)) if args.output else None
+    
+    for size in args.sizes:
+        fake = FakeAppwrite(size, args.latency_ms, args.rate_limit)
+        fake.start()
+        print(f"{'='*60}")
+        print(f"📦 {size:,} files per bucket ({fake.endpoint})")
+        print(f"{'='*60}")
+        
+        try:
+            for scenario in args.scenarios:
+                fake.reset()
+                cleaner_args = SCENARIOS[scenario]['args'] + extra_args
+                with tempfile.TemporaryDirectory(prefix='cleaner-bench-') as workdir:
+                    result = run_cleaner(fake.endpoint, cleaner_args, workdir)
+                    if result['returncode'] != 0:
+                        failures += 1
+                        with open(result['log']) as log:
+                            print(''.join(log.readlines()[-10:]))
+                        keep_log(result, size, scenario, log_dir)
+                calls = dict(fake.calls)
+                print_result(size, scenario, result, calls)
+                
+                results.append({
+                    'size': size,
+                    'scenario': scenario,
+                    'args': cleaner_args,
+                    'returncode': result['returncode'],
+                    'seconds': round(result['seconds'], 3),
+                    'peak_rss_mb': result['peak_rss_mb'],
+                    'api_calls': calls,
+                    'metrics': result['metrics'],
+                    'log': result['log'] if result['returncode'] != 0 else None
+                })
+        finally:
+            fake.stop()
+        print()
+    
+    if args.output:
+        with open(args.output, 'w') as f:
+            json.dump({
+                'latency_ms': args.latency_ms,
+                'rate_limit': args.rate_limit,
+                'results': results
+            }, f, indent=2)
+        print(f"📈 Results written to {args.output}")
+    
+    sys.exit(1 if failures else 0)
+
+if __name__ == '__main__':
+    main()
@@ -6,14 +6,25 @@ Generates test files in storage buckets for development and testing purposes.
 Usage:
     python scripts/development/populate-storage.py --bucket payment_proofs --count 50
     python scripts/development/populate-storage.py --all --count 100
+    python scripts/development/populate-storage.py --count 5000 --workers 16
+    python scripts/development/populate-storage.py --count 500 --seed 42
+    python scripts/development/populate-storage.py --bucket chat_files --size-profile realistic
 """
 
 import os
 import sys
 import argparse
 import random
+import threading
+import time
+import math
+import uuid
+import zlib
+import mimetypes
+from collections import Counter
+from concurrent.futures import ThreadPoolExecutor, wait, FIRST_COMPLETED
 from datetime import datetime, timedelta
-from io import BytesIO
+from typing import List
 from dotenv import load_dotenv
 
 # Add parent directory to path
@@ -23,14 +34,16 @@ load_dotenv()
 
 try:
     from appwrite.client import Client
-    from appwrite.services.storage import Storage
-    from appwrite.input_file import InputFile
+    from appwrite.exception import AppwriteException
     from appwrite.id import ID
 except ImportError:
     print("❌ Error: appwrite package not installed")
     print("Install with: pip install appwrite")
     sys.exit(1)
 
+import requests
+from appwrite_transport import PooledTransport, appwrite_headers, backoff_delay
+
 # Configuration
 APPWRITE_ENDPOINT = os.getenv('VITE_APPWRITE_ENDPOINT', 'https://cloud.appwrite.io/v1')
 APPWRITE_PROJECT_ID = os.getenv('VITE_APPWRITE_PROJECT_ID')
@@ -41,28 +54,348 @@ BUCKETS = {
     'chat_files': '67c5f85a00262bb6ea19'
 }
 
+DEFAULT_WORKERS = 4
+PROGRESS_INTERVAL = 2.0  # seconds between progress lines
+MAX_ERROR_CAUSES = 5
+
+# Random bytes generated once per run; every file body is a slice of it
+CONTENT_POOL_SIZE = 16 * 1024 * 1024
+JPEG_SEGMENT_MAX = 65533  # payload bytes per JPEG COM segment
+
+# Files of at least CHUNK_SIZE bytes are uploaded in chunks, like the SDK
+CHUNK_SIZE = 5 * 1024 * 1024
+CHUNK_ATTEMPTS = 4
+CHUNK_RETRY_DELAY = 1.0  # seconds, base of the jittered exponential backoff
+RETRYABLE_STATUS = {408, 429, 500, 502, 503, 504}
+
+KB = 1024
+MB = 1024 * 1024
+
+# Size bands per profile: (weight, min bytes, max bytes, extensions).
+# Sizes are drawn log-uniformly within a band, which follows the long
+# tail of real uploads better than a flat range.
+SIZE_PROFILES = {
+    'small': [
+        (1.0, 50 * KB, 500 * KB, ['jpg', 'png', 'pdf', 'jpeg'])
+    ],
+    'realistic': [
+        (0.65, 30 * KB, 1 * MB, ['jpg', 'jpeg', 'png']),  # photos, screenshots
+        (0.20, 50 * KB, 3 * MB, ['pdf']),                 # receipts, documents
+        (0.10, 2 * MB, 25 * MB, ['mp4', 'pdf']),          # short clips, scans
+        (0.05, 25 * MB, 150 * MB, ['mp4'])                # chat videos
+    ],
+    'large': [
+        (1.0, 8 * MB, 200 * MB, ['mp4', 'pdf'])
+    ]
+}
+DEFAULT_SIZE_PROFILE = 'small'
+
+# Minimal valid 1x1 grey baseline JPEG, split around the comment segments
+JPEG_HEAD = bytes.fromhex('ffd8ffe000104a46494600010100000100010000')
+JPEG_TAIL = (
+    bytes.fromhex('ffdb004300') + b'\x01' * 64 +
+    bytes.fromhex('ffc0000b080001000101011100') +
+    bytes.fromhex('ffc4001400') + b'\x01' + b'\x00' * 15 + b'\x00' +
+    bytes.fromhex('ffc4001410') + b'\x01' + b'\x00' * 15 + b'\x00' +
+    bytes.fromhex('ffda0008010100003f00') + b'\x3f' +
+    bytes.fromhex('ffd9')
+)
+
+class PartsReader:
+    """Read-only file object over a list of byte buffers
+    
+    ``read`` hands out memoryview slices of the parts themselves, so a
+    request body assembled from pool slices is streamed without copying.
+    """
+    
+    def __init__(self, parts: List):
+        self.parts = [memoryview(part) for part in parts if len(part)]
+        self.length = sum(len(part) for part in self.parts)
+        self._index = 0
+        self._offset = 0
+    
+    def __len__(self) -> int:
+        return self.length
+    
+    def read(self, size: int = -1):
+        if self._index >= len(self.parts):
+            return b''
+        
+        if size is None or size < 0:
+            rest = [self.parts[self._index][self._offset:], *self.parts[self._index + 1:]]
+            self._index, self._offset = len(self.parts), 0
+            return b''.join(rest)
+        
+        part = self.parts[self._index]
+        chunk = part[self._offset:self._offset + size]
+        self._offset += len(chunk)
+        if self._offset >= len(part):
+            self._index += 1
+            self._offset = 0
+        return chunk
+
+class ContentPool:
+    """Pool of random bytes that file payloads are sliced from
+    
+    The pool is filled once, from ``os.urandom`` or from a seeded PRNG
+    for reproducible fixtures, and payloads longer than the remaining
+    pool wrap around to its start.
+    """
+    
+    def __init__(self, seed: int = None, size: int = CONTENT_POOL_SIZE):
+        if seed is None:
+            data = os.urandom(size)
+        else:
+            data = random.Random(seed).randbytes(size)
+        self.view = memoryview(data)
+        self.size = size
+    
+    def payload(self, offset: int, length: int, max_slice: int = None) -> List[memoryview]:
+        """Slices covering ``length`` pool bytes starting at ``offset``"""
+        slices = []
+        offset %= self.size
+        max_slice = max_slice or self.size
+        while length > 0:
+            take = min(length, self.size - offset, max_slice)
+            slices.append(self.view[offset:offset + take])
+            length -= take
+            offset = (offset + take) % self.size
+        return slices
+    
+    def jpeg(self, tag: bytes, size: int, offset: int) -> List:
+        """JPEG with the payload carried in comment segments"""
+        comment = b'\xff\xfe' + (len(tag) + 2).to_bytes(2, 'big') + tag
+        base = len(JPEG_HEAD) + len(comment) + len(JPEG_TAIL)
+        segments = -(-max(0, size - base) // (JPEG_SEGMENT_MAX + 4))
+        parts = [JPEG_HEAD, comment]
+        for chunk in self.payload(offset, max(0, size - base - 4 * segments), JPEG_SEGMENT_MAX):
+            parts += [b'\xff\xfe' + (len(chunk) + 2).to_bytes(2, 'big'), chunk]
+        parts.append(JPEG_TAIL)
+        return parts
+    
+    def png(self, tag: bytes, size: int, offset: int) -> List:
+        """PNG with the payload in a private ancillary chunk"""
+        def chunk(kind: bytes, data: bytes) -> bytes:
+            return len(data).to_bytes(4, 'big') + kind + data + zlib.crc32(kind + data).to_bytes(4, 'big')
+        
+        head = b'\x89PNG\r\n\x1a\n' + chunk(b'IHDR', bytes.fromhex('00000001000000010800000000'))
+        head += chunk(b'tEXt', b'Comment\x00' + tag)
+        tail = chunk(b'IDAT', zlib.compress(b'\x00\x80')) + chunk(b'IEND', b'')
+        
+        payload = self.payload(offset, max(0, size - len(head) - len(tail) - 12))
+        length = sum(len(part) for part in payload)
+        crc = zlib.crc32(b'paDd')
+        for part in payload:
+            crc = zlib.crc32(part, crc)
+        return [head, length.to_bytes(4, 'big') + b'paDd', *payload, crc.to_bytes(4, 'big'), tail]
+    
+    def pdf(self, tag: bytes, size: int, offset: int) -> List:
+        """One-page PDF with the payload as an embedded stream object"""
+        objects = [
+            b'<< /Type /Catalog /Pages 2 0 R >>',
+            b'<< /Type /Pages /Kids [3 0 R] /Count 1 >>',
+            b'<< /Type /Page /Parent 2 0 R /MediaBox [0 0 72 72] >>'
+        ]
+        head = b'%PDF-1.4\n%' + tag + b'\n'
+        offsets = []
+        for number, body in enumerate(objects, 1):
+            offsets.append(len(head))
+            head += b'%d 0 obj\n' % number + body + b'\nendobj\n'
+        offsets.append(len(head))
+        
+        # Size the stream so the whole file lands close to ``size``
+        length = max(0, size - len(head) - 280)
+        head += b'4 0 obj\n<< /Length %d >>\nstream\n' % length
+        xref_at = len(head) + length + len(b'\nendstream\nendobj\n')
+        tail = b'\nendstream\nendobj\nxref\n0 5\n0000000000 65535 f \n'
+        tail += b''.join(b'%010d 00000 n \n' % at for at in offsets)
+        tail += b'trailer\n<< /Size 5 /Root 1 0 R >>\nstartxref\n%d\n%%%%EOF\n' % xref_at
+        return [head, *self.payload(offset, length), tail]
+    
+    def mp4(self, tag: bytes, size: int, offset: int) -> List:
+        """ISO base media file with the payload in an ``mdat`` box"""
+        def box(kind: bytes, data: bytes) -> bytes:
+            return (len(data) + 8).to_bytes(4, 'big') + kind + data
+        
+        head = box(b'ftyp', b'isom' + (512).to_bytes(4, 'big') + b'isommp41') + box(b'free', tag)
+        length = max(0, size - len(head) - 8)
+        return [head, (length + 8).to_bytes(4, 'big') + b'mdat', *self.payload(offset, length)]
+
+CONTAINERS = {
+    'jpg': ContentPool.jpeg,
+    'jpeg': ContentPool.jpeg,
+    'png': ContentPool.png,
+    'pdf': ContentPool.pdf,
+    'mp4': ContentPool.mp4
+}
+
+def byte_range(parts: List, start: int, end: int) -> List[memoryview]:
+    """Slices of ``parts`` covering bytes ``start`` to ``end`` of their concatenation"""
+    window = []
+    position = 0
+    for part in parts:
+        part_end = position + len(part)
+        if part_end > start and position < end:
+            window.append(memoryview(part)[max(start - position, 0):min(end, part_end) - position])
+        if part_end >= end:
+            break
+        position = part_end
+    return window
+
+def is_retryable(error: Exception) -> bool:
+    """Whether an upload error is worth retrying (throttling, 5xx, network)"""
+    if isinstance(error, AppwriteException):
+        return error.code in RETRYABLE_STATUS
+    return isinstance(error, (requests.RequestException, OSError))
+
+def multipart_body(fields: dict, filename: str, parts: List) -> tuple:
+    """Streaming multipart/form-data body for a file upload
+    
+    Returns ``(reader, content_type)``. Only the small form headers are
+    new bytes; the file parts are streamed as they are.
+    """
+    boundary = uuid.uuid4().hex
+    mime_type = mimetypes.guess_type(filename)[0] or 'application/octet-stream'
+    head = ''.join(
+        f'--{boundary}\r\nContent-Disposition: form-data; name="{name}"\r\n\r\n{value}\r\n'
+        for name, value in fields.items()
+    )
+    head += (
+        f'--{boundary}\r\nContent-Disposition: form-data; name="file"; filename="{filename}"\r\n'
+        f'Content-Type: {mime_type}\r\n\r\n'
+    )
+    tail = f'\r\n--{boundary}--\r\n'
+    reader = PartsReader([head.encode(), *parts, tail.encode()])
+    return reader, f'multipart/form-data; boundary={boundary}'
+
+class UploadPool:
+    """Bounded worker pool that generates and uploads files concurrently
+    
+    At most ``2 * workers`` uploads are queued at a time, so content is
+    generated just ahead of the uploads instead of for the whole run.
+    Successes and failures are tallied per file for the bucket summary.
+    """
+    
+    def __init__(self, populator: 'StoragePopulator', bucket_id: str, count: int):
+        self.populator = populator
+        self.bucket_id = bucket_id
+        self.count = count
+        self.max_in_flight = populator.workers * 2
+        self.executor = ThreadPoolExecutor(
+            max_workers=populator.workers,
+            thread_name_prefix='upload'
+        )
+        self.in_flight = set()
+        self.uploaded = 0
+        self.uploaded_bytes = 0
+        self.errors = []
+        self._lock = threading.Lock()
+        self.started_at = time.monotonic()
+        self._last_progress = self.started_at
+    
+    def submit(self, filename: str, size: int, offset: int):
+        """Queue one upload, blocking while the pool is saturated"""
+        if len(self.in_flight) >= self.max_in_flight:
+            _, self.in_flight = wait(self.in_flight, return_when=FIRST_COMPLETED)
+        
+        self.in_flight.add(self.executor.submit(self._upload, filename, size, offset))
+    
+    def _upload(self, filename: str, size: int, offset: int):
+        try:
+            size = self.populator.upload_file(self.bucket_id, filename, size, offset)
+        except Exception as e:
+            with self._lock:
+                self.errors.append((filename, str(e)))
+            return
+        
+        with self._lock:
+            self.uploaded += 1
+            self.uploaded_bytes += size
+            now = time.monotonic()
+            if now - self._last_progress >= PROGRESS_INTERVAL:
+                self._last_progress = now
+                print(f"  ⏳ [{self.uploaded + len(self.errors)}/{self.count}] {self.throughput()}")
+    
+    @property
+    def elapsed(self) -> float:
+        return time.monotonic() - self.started_at
+    
+    def throughput(self) -> str:
+        elapsed = max(self.elapsed, 1e-9)
+        return f"{self.uploaded / elapsed:.1f} files/s, {self.uploaded_bytes / elapsed / 1024 / 1024:.2f} MB/s"
+    
+    def error_causes(self) -> list:
+        """Most frequent error messages with a count and an example file"""
+        causes = Counter(message for _, message in self.errors)
+        examples = {}
+        for filename, message in self.errors:
+            examples.setdefault(message, filename)
+        return [(message, n, examples[message]) for message, n in causes.most_common(MAX_ERROR_CAUSES)]
+    
+    def close(self):
+        """Wait for all queued uploads to finish"""
+        self.executor.shutdown(wait=True)
+        self.in_flight.clear()
+
 class StoragePopulator:
-    def __init__(self):
+    def __init__(self, workers: int = DEFAULT_WORKERS, seed: int = None, size_profile: str = DEFAULT_SIZE_PROFILE):
         """Initialize storage populator"""
         if not APPWRITE_PROJECT_ID or not APPWRITE_API_KEY:
             raise ValueError("Missing APPWRITE_PROJECT_ID or APPWRITE_API_KEY")
         
+        self.workers = max(1, workers)
+        self.size_profile = size_profile
+        self.bands = SIZE_PROFILES[size_profile]
+        
+        # Chunks of large files run on their own pool: queueing them behind
+        # the file uploads that wait for them would deadlock
+        self.chunk_executor = ThreadPoolExecutor(max_workers=self.workers, thread_name_prefix='chunk')
+        self.chunk_retries = 0
+        self.upload_retries = 0
+        self._lock = threading.Lock()
+        
+        # With a seed, file names, sizes and contents are reproducible
+        self.seed = seed
+        self.rng = random.Random(seed)
+        self.content = ContentPool(seed)
+        
+        # Keep-alive connection pool shared with the storage cleaner, one
+        # connection per file and chunk worker
+        self.transport = PooledTransport(pool_size=self.workers * 2, endpoint=APPWRITE_ENDPOINT)
+        self.transport.install()
+        
         self.client = Client()
         self.client.set_endpoint(APPWRITE_ENDPOINT)
         self.client.set_project(APPWRITE_PROJECT_ID)
         self.client.set_key(APPWRITE_API_KEY)
         
-        self.storage = Storage(self.client)
         print(f"🔧 Initialized Storage Populator")
-        print(f"📦 Project: {APPWRITE_PROJECT_ID}\n")
+        print(f"📦 Project: {APPWRITE_PROJECT_ID}")
+        print(f"⚙️  Workers: {self.workers}")
+        print(f"📏 Size profile: {size_profile}")
+        print(f"🎲 Seed: {seed if seed is not None else 'random'}\n")
     
-    def generate_test_image(self, size_kb: int = 100) -> bytes:
-        """Generate a simple test image file"""
-        # Create a simple bitmap header + random data
-        size_bytes = size_kb * 1024
-        header = b'BM' + size_bytes.to_bytes(4, 'little') + b'\x00' * 8
-        data = os.urandom(size_bytes - len(header))
-        return header + data
+    def generate_test_file(self, filename: str, size: int, offset: int) -> List:
+        """Build a test file matching its extension from content pool slices
+        
+        Returns the file as a list of buffers: small per-file container
+        headers around memoryview slices of the shared pool.
+        """
+        extension = filename.rsplit('.', 1)[-1].lower()
+        build = CONTAINERS.get(extension, ContentPool.jpeg)
+        tag = f"{filename}@{offset}".encode()
+        return build(self.content, tag, size, offset)
+    
+    def draw_file(self, prefixes: List[str]) -> tuple:
+        """Draw the name, size and pool offset of the next file"""
+        weights = [band[0] for band in self.bands]
+        _, low, high, extensions = self.rng.choices(self.bands, weights)[0]
+        prefix = self.rng.choice(prefixes)
+        extension = self.rng.choice(extensions)
+        size = int(math.exp(self.rng.uniform(math.log(low), math.log(high))))
+        
+        filename = f"{prefix}{self.rng.randint(1000, 9999)}.{extension}"
+        return filename, size, self.rng.randrange(self.content.size)
     
     def generate_random_date(self, days_back: int = 90) -> datetime:
         """Generate a random date in the past"""
@@ -92,50 +425,139 @@ class StoragePopulator:
         }
         
         prefixes = file_types.get(bucket_name, ['test_file_'])
-        extensions = ['jpg', 'png', 'pdf', 'jpeg']
         
-        uploaded = 0
-        errors = 0
-        
-        for i in range(count):
-            try:
-                # Generate file metadata
-                prefix = random.choice(prefixes)
-                extension = random.choice(extensions)
-                size_kb = random.randint(50, 500)  # 50KB to 500KB
-                
-                filename = f"{prefix}{random.randint(1000, 9999)}.{extension}"
-                
-                # Generate file content
-                content = self.generate_test_image(size_kb)
-                
-                # Upload file
-                file_id = ID.unique()
-                
-                result = self.storage.create_file(
-                    bucket_id=bucket_id,
-                    file_id=file_id,
-                    file=InputFile.from_bytes(content, filename=filename)
-                )
-                
-                uploaded += 1
-                print(f"  ✅ [{uploaded}/{count}] Uploaded: {filename} ({size_kb} KB)")
-                
-            except Exception as e:
-                errors += 1
-                print(f"  ❌ Error uploading file {i+1}: {e}")
+        pool = UploadPool(self, bucket_id, count)
+        try:
+            for _ in range(count):
+                # File metadata is drawn here, in order, so runs stay
+                # reproducible regardless of how the uploads interleave
+                pool.submit(*self.draw_file(prefixes))
+        finally:
+            pool.close()
         
         print(f"\n{'='*60}")
         print(f"📊 SUMMARY for {bucket_name}")
         print(f"{'='*60}")
-        print(f"✅ Uploaded: {uploaded}/{count}")
-        print(f"❌ Errors:   {errors}")
+        print(f"✅ Uploaded:   {pool.uploaded}/{count} ({pool.uploaded_bytes / 1024 / 1024:.1f} MB)")
+        print(f"❌ Errors:     {len(pool.errors)}")
+        print(f"⏱️  Duration:   {pool.elapsed:.1f}s")
+        print(f"🚀 Throughput: {pool.throughput()}")
+        
+        if pool.errors:
+            print(f"\n⚠️  Error causes:")
+            for message, n, example in pool.error_causes():
+                print(f"  - {n}× {message} (e.g. {example})")
         print()
     
+    def upload_file(self, bucket_id: str, filename: str, size: int, offset: int) -> int:
+        """Generate and upload one test file, returning its size in bytes"""
+        parts = self.generate_test_file(filename, size, offset)
+        size = sum(len(part) for part in parts)
+        if size >= CHUNK_SIZE:
+            self.upload_chunked(bucket_id, filename, parts, size)
+            return size
+        
+        # Retries reuse the file ID, so an upload that reached the server
+        # before its response was lost shows up as a conflict, not a copy
+        file_id = ID.unique()
+        for attempt in range(CHUNK_ATTEMPTS):
+            if attempt:
+                with self._lock:
+                    self.upload_retries += 1
+                time.sleep(backoff_delay(attempt - 1, CHUNK_RETRY_DELAY))
+            try:
+                body, content_type = multipart_body({'fileId': file_id}, filename, parts)
+                self.post(f'/storage/buckets/{bucket_id}/files', body, content_type)
+                return size
+            except Exception as e:
+                if attempt and isinstance(e, AppwriteException) and e.code == 409:
+                    return size
+                if attempt == CHUNK_ATTEMPTS - 1 or not is_retryable(e):
+                    raise
+    
+    def upload_chunked(self, bucket_id: str, filename: str, parts: List, size: int):
+        """Upload a large file in CHUNK_SIZE pieces, resuming after failures
+        
+        The first chunk goes alone because it creates the file; the server
+        then accepts the remaining chunks in any order, so they are sent in
+        parallel. Failed chunks are retried with the same file ID and only
+        they are sent again.
+        """
+        file_id = ID.unique()
+        pending = [(start, min(start + CHUNK_SIZE, size)) for start in range(0, size, CHUNK_SIZE)]
+        
+        for attempt in range(CHUNK_ATTEMPTS):
+            if attempt:
+                with self._lock:
+                    self.chunk_retries += len(pending)
+                time.sleep(backoff_delay(attempt - 1, CHUNK_RETRY_DELAY))
+            
+            failures = []
+            if pending[0][0] == 0:
+                try:
+                    self.send_chunk(bucket_id, file_id, filename, parts, pending[0], size)
+                    pending = pending[1:]
+                except Exception as e:
+                    failures.append((pending[0], e))
+            
+            if not failures:
+                futures = {
+                    self.chunk_executor.submit(self.send_chunk, bucket_id, file_id, filename, parts, chunk, size): chunk
+                    for chunk in pending
+                }
+                wait(futures)
+                failures = [(chunk, future.exception()) for future, chunk in futures.items() if future.exception()]
+            
+            if not failures:
+                return
+            
+            error = failures[0][1]
+            if not all(is_retryable(e) for _, e in failures):
+                raise error
+            pending = sorted(chunk for chunk, _ in failures)
+        
+        raise error
+    
+    def send_chunk(self, bucket_id: str, file_id: str, filename: str, parts: List, chunk: tuple, size: int) -> dict:
+        """POST one chunk of a file with its content-range"""
+        start, end = chunk
+        body, content_type = multipart_body({'fileId': file_id}, filename, byte_range(parts, start, end))
+        headers = {
+            'content-range': f'bytes {start}-{end - 1}/{size}',
+            'x-appwrite-id': file_id
+        }
+        return self.post(f'/storage/buckets/{bucket_id}/files', body, content_type, headers)
+    
+    def post(self, path: str, body: PartsReader, content_type: str, headers: dict = None) -> dict:
+        """POST a streamed body with the client's credentials
+        
+        ``Storage.create_file`` needs the whole file as one bytes object
+        and its multipart encoder copies it again, so uploads go straight
+        through the pooled transport instead.
+        """
+        request_headers = {
+            **appwrite_headers(APPWRITE_PROJECT_ID, APPWRITE_API_KEY),
+            **(headers or {}),
+            'content-type': content_type
+        }
+        response = self.transport.request('POST', APPWRITE_ENDPOINT + path, data=body, headers=request_headers)
+        
+        if response.headers.get('Content-Type', '').startswith('application/json'):
+            result = response.json()
+        else:
+            result = {'message': response.text}
+        if response.status_code >= 400:
+            raise AppwriteException(result.get('message'), response.status_code, result.get('type'), result)
+        return result
+    
     def populate_all(self, count_per_bucket: int):
         """Populate all buckets"""
         for bucket_name, bucket_id in BUCKETS.items():
             self.populate_bucket(bucket_id, bucket_name, count_per_bucket)
+    
+    def close(self):
+        self.chunk_executor.shutdown(wait=True)
+        self.transport.close()
 
 def main():
     parser = argparse.ArgumentParser(
@@ -156,10 +578,31 @@ def main():
         help='Number of files to create per bucket (default: 20)'
     )
     
+    parser.add_argument(
+        '--workers',
+        type=int,
+        default=DEFAULT_WORKERS,
+        help=f'Number of concurrent uploads (default: {DEFAULT_WORKERS})'
+    )
+    
+    parser.add_argument(
+        '--size-profile',
+        choices=list(SIZE_PROFILES.keys()),
+        default=DEFAULT_SIZE_PROFILE,
+        help=f'File size distribution; files of {CHUNK_SIZE // MB} MB and up are uploaded in chunks (default: {DEFAULT_SIZE_PROFILE})'
+    )
+    
+    parser.add_argument(
+        '--seed',
+        type=int,
+        help='Seed for reproducible file names, sizes and contents (default: random)'
+    )
+    
     args = parser.parse_args()
     
+    populator = None
     try:
-        populator = StoragePopulator()
+        populator = StoragePopulator(workers=args.workers, seed=args.seed, size_profile=args.size_profile)
         
         if args.bucket == 'all':
             populator.populate_all(args.count)
@@ -168,10 +611,19 @@ def main():
             populator.populate_bucket(bucket_id, args.bucket, args.count)
         
         print("✅ Population complete!")
+        print(f"🔌 Connections: {populator.transport.summary()}")
+        print(f"🚦 Rate control: {populator.transport.controller.summary()}")
+        if populator.upload_retries:
+            print(f"🔁 Uploads retried: {populator.upload_retries}")
+        if populator.chunk_retries:
+            print(f"🔁 Chunks resent: {populator.chunk_retries}")
         
     except Exception as e:
         print(f"\n❌ Fatal error: {e}")
         sys.exit(1)
+    finally:
+        if populator:
+            populator.close()
 
 if __name__ == '__main__':
     main()
@@ -6,65 +6,261 @@ Development utility to run storage cleaner locally with common presets.
 Usage:
     python scripts/development/run-storage-cleaner.py --preset test
     python scripts/development/run-storage-cleaner.py --preset production
+    python scripts/development/run-storage-cleaner.py --preset payment-proofs --preset orphaned
     python scripts/development/run-storage-cleaner.py --custom --days 30
+    python scripts/development/run-storage-cleaner.py --daemon --preset orphaned --preset payment-proofs
+
+Presets run in this process, one after another, on a single cleaner: the
+Appwrite client, connection pool, reference index and bucket listings are
+built once and shared by every preset. In --daemon mode the same cleaner
+stays up and runs each preset on its interval. Buckets larger than the
+first preset's --listing-cache-limit are streamed instead of cached, so the
+daemon's memory stays bounded however long it runs.
 """
 
 import os
 import sys
+import time
+import random
+import signal
 import argparse
-import subprocess
+import threading
+import importlib.util
+from datetime import datetime
 from pathlib import Path
 
 # Project root
 PROJECT_ROOT = Path(__file__).parent.parent.parent
 CLEANER_SCRIPT = PROJECT_ROOT / 'scripts' / 'storage-cleaner.py'
 
+# Daemon mode: reference cache used when a preset does not set --ref-cache,
+# and the default share of an interval added as random jitter
+DAEMON_REF_CACHE = os.path.join('.storage-cleaner', 'references.sqlite')
+DEFAULT_JITTER = 0.1
+INTERVAL_UNITS = {'s': 1, 'm': 60, 'h': 3600, 'd': 86400}
+
 PRESETS = {
     'test': {
         'description': 'Test mode - dry run with temp files',
-        'args': ['--dry-run', '--no-temp', '--orphaned-only']
+        'args': ['--dry-run', '--no-temp', '--orphaned-only'],
+        'interval': '1h'
     },
     'dev': {
         'description': 'Development - clean old test files (30 days)',
-        'args': ['--days', '30', '--bucket', 'all']
+        'args': ['--days', '30', '--bucket', 'all'],
+        'interval': '1d'
     },
     'staging': {
         'description': 'Staging - clean old files (60 days) with dry-run',
-        'args': ['--dry-run', '--days', '60', '--bucket', 'all']
+        'args': ['--dry-run', '--days', '60', '--bucket', 'all'],
+        'interval': '1d'
     },
     'production': {
         'description': 'Production - clean very old files (90 days)',
-        'args': ['--days', '90', '--bucket', 'all']
+        'args': ['--days', '90', '--bucket', 'all'],
+        'interval': '7d'
     },
     'orphaned': {
         'description': 'Remove only orphaned files (dry-run)',
-        'args': ['--dry-run', '--orphaned-only']
+        'args': ['--dry-run', '--orphaned-only'],
+        'interval': '6h'
     },
     'payment-proofs': {
         'description': 'Clean old payment proofs (60 days)',
-        'args': ['--days', '60', '--bucket', 'payment_proofs']
+        'args': ['--days', '60', '--bucket', 'payment_proofs'],
+        'interval': '1d'
     }
 }
 
-def run_cleaner(args: list, dry_run: bool = True):
-    """Run the storage cleaner with specified arguments"""
-    cmd = [sys.executable, str(CLEANER_SCRIPT)] + args
+def load_cleaner():
+    """Import storage-cleaner.py as a module (its file name is not importable)"""
+    sys.path.insert(0, str(CLEANER_SCRIPT.parent))
+    spec = importlib.util.spec_from_file_location('storage_cleaner', CLEANER_SCRIPT)
+    module = importlib.util.module_from_spec(spec)
+    spec.loader.exec_module(module)
+    return module
+
+def parse_interval(value: str) -> float:
+    """Parse an interval such as 90s, 30m, 6h or 1d (plain numbers are seconds)"""
+    value = value.strip().lower()
+    unit = INTERVAL_UNITS.get(value[-1:])
+    seconds = float(value[:-1] if unit else value) * (unit or 1)
+    if seconds <= 0:
+        raise ValueError(f"interval must be positive: {value}")
+    return seconds
+
+def prepare_passes(passes: list, dry_run: bool):
+    """Import the cleaner and parse each (name, arguments) pass with its parser"""
+    # Relative paths (journal directory, caches) resolve from the project
+    # root, as they did when the cleaner ran as a subprocess there
+    os.chdir(PROJECT_ROOT)
+    storage_cleaner = load_cleaner()
+    parser = storage_cleaner.build_parser()
+    
+    parsed = []
+    for name, args in passes:
+        if dry_run and '--dry-run' not in args:
+            args = args + ['--dry-run']
+        print(f"🚀 {name}: storage-cleaner.py {' '.join(args)}")
+        parsed.append((name, parser.parse_args(args)))
+    print(f"\n{'='*60}\n")
+    return storage_cleaner, parsed
+
+def run_pass(storage_cleaner, cleaner, name: str, args) -> dict:
+    """Run one preset on the shared cleaner and return its share of the stats"""
+    print(f"\n{'#'*60}")
+    print(f"📋 Preset: {name} ({'DRY RUN' if args.dry_run else 'LIVE'})")
+    print(f"{'#'*60}")
     
-    if dry_run and '--dry-run' not in args:
-        cmd.append('--dry-run')
+    cleaner.dry_run = args.dry_run
+    before = dict(cleaner.stats)
+    started = time.monotonic()
+    storage_cleaner.clean(cleaner, args)
     
-    print(f"🚀 Running: {' '.join(cmd)}\n")
-    print(f"{'='*60}\n")
+    result = {key: value - before[key] for key, value in cleaner.stats.items()}
+    result.update(name=name, dry_run=args.dry_run, elapsed=time.monotonic() - started)
+    return result
+
+def run_cleaner(passes: list, dry_run: bool = True):
+    """Run one or more (name, arguments) cleaner passes in this process
+    
+    Options that configure the cleaner itself (--workers, --ref-cache,
+    --rules, --lock-file, ...) are taken from the first pass; the others
+    are applied per pass. Returns the exit code.
+    """
+    storage_cleaner, parsed = prepare_passes(passes, dry_run)
+    options = parsed[0][1]
+    
+    with storage_cleaner.run_lock(options.lock_file) as acquired:
+        if not acquired:
+            print(f"⏭️  Another cleanup run holds {options.lock_file}; skipping this one")
+            return 0
+        
+        cleaner = None
+        try:
+            cleaner = storage_cleaner.create_cleaner(options, cache_listings=len(parsed) > 1)
+            results = [run_pass(storage_cleaner, cleaner, name, args) for name, args in parsed]
+            
+            cleaner.print_summary()
+            cleaner.export_metrics(options.metrics_prom, options.metrics_json)
+            print_results(results)
+            return 0
+            
+        except KeyboardInterrupt:
+            print("\n\n⚠️  Interrupted by user")
+            return 1
+        except Exception as e:
+            print(f"\n❌ Error running cleaner: {e}")
+            return 1
+        finally:
+            if cleaner and cleaner.report:
+                cleaner.report.close()
+
+def next_due(nominal: float, interval: float, now: float):
+    """Next nominal run time after ``now``, and how many runs were missed
     
+    A run that overran its interval does not cause catch-up runs: the
+    missed slots are skipped and the schedule stays on its grid.
+    """
+    nominal += interval
+    missed = 0
+    if nominal <= now:
+        missed = int((now - nominal) // interval) + 1
+        nominal += missed * interval
+    return nominal, missed
+
+def run_daemon(passes: list, intervals: dict, dry_run: bool = True, jitter: float = DEFAULT_JITTER):
+    """Run presets on their intervals until SIGTERM/SIGINT
+    
+    One cleaner lives for the whole daemon, so the client, connection
+    pool, reference cache and bucket listings stay warm: each run only
+    syncs changed references and lists newly created files. Listings are
+    capped by --listing-cache-limit; a bucket that outgrows it is
+    streamed on every run until the next relist. Presets that
+    are due together run in one batch under the cleanup lock; if another
+    process holds the lock the batch is skipped, not queued. Every run
+    is delayed by a random share (``jitter``) of its interval so several
+    daemons do not hit the API in step.
+    """
+    storage_cleaner, parsed = prepare_passes(passes, dry_run)
+    options = parsed[0][1]
+    if not options.ref_cache:
+        options.ref_cache = DAEMON_REF_CACHE
+    
+    stop = threading.Event()
+    
+    def request_stop(signum, frame):
+        print(f"\n🛑 {signal.Signals(signum).name} received; stopping after the current run")
+        stop.set()
+    
+    signal.signal(signal.SIGTERM, request_stop)
+    signal.signal(signal.SIGINT, request_stop)
+    
+    cleaner = None
     try:
-        result = subprocess.run(cmd, cwd=PROJECT_ROOT)
-        return result.returncode
-    except KeyboardInterrupt:
-        print("\n\n⚠️  Interrupted by user")
-        return 1
+        cleaner = storage_cleaner.create_cleaner(options, cache_listings=True)
+        print("🕒 Daemon started: " + ', '.join(f"{name} every {intervals[name]:g}s" for name, _ in parsed))
+        print(f"🗂️  Listings of buckets up to {cleaner.listing_cache_limit} files are cached between runs")
+        
+        # Every preset runs once at startup, then on its own grid
+        now = time.time()
+        nominal = {name: now for name, _ in parsed}
+        due = dict(nominal)
+        
+        while not stop.is_set():
+            if stop.wait(max(0.0, min(due.values()) - time.time())):
+                break
+            
+            batch = [(name, args) for name, args in parsed if due[name] <= time.time()]
+            with storage_cleaner.run_lock(options.lock_file) as acquired:
+                if acquired:
+                    cleaner.begin_run()
+                    print(f"\n⏰ Run started {datetime.now():%Y-%m-%d %H:%M:%S}: {', '.join(name for name, _ in batch)}")
+                    try:
+                        results = [run_pass(storage_cleaner, cleaner, name, args) for name, args in batch]
+                        cleaner.print_summary()
+                        cleaner.export_metrics(options.metrics_prom, options.metrics_json)
+                        print_results(results)
+                    except Exception as e:
+                        # A failed run is retried at its next slot
+                        print(f"\n❌ Run failed: {e}")
+                    files, buckets = cleaner.cached_listing_size()
+                    print(f"🗂️  Listing cache: {files} files in {buckets} buckets")
+                else:
+                    print(f"\n⏭️  Another cleanup run holds {options.lock_file}; skipping {', '.join(name for name, _ in batch)}")
+            
+            now = time.time()
+            for name, _ in batch:
+                nominal[name], missed = next_due(nominal[name], intervals[name], now)
+                if missed:
+                    print(f"⏩ {name}: skipped {missed} run(s) that fell inside the last one")
+                due[name] = nominal[name] + random.uniform(0, jitter * intervals[name])
+            
+            upcoming = min(due, key=due.get)
+            print(f"💤 Next: {upcoming} at {datetime.fromtimestamp(due[upcoming]):%Y-%m-%d %H:%M:%S}")
+        
+        return 0
+        
     except Exception as e:
         print(f"\n❌ Error running cleaner: {e}")
         return 1
+    finally:
+        if cleaner and cleaner.report:
+            cleaner.report.close()
+
+def print_results(results: list):
+    """Print one line of results per preset"""
+    if len(results) < 2:
+        return
+    
+    print(f"\n{'='*60}")
+    print("📋 RESULTS PER PRESET")
+    print(f"{'='*60}")
+    print(f"  {'preset':16} {'mode':8} {'scanned':>8} {'matched':>8} {'deleted':>8} {'errors':>6} {'freed MB':>9} {'time':>7}")
+    for result in results:
+        print(f"  {result['name']:16} {'dry-run' if result['dry_run'] else 'live':8} {result['scanned']:>8} "
+              f"{result['candidates']:>8} {result['deleted']:>8} {result['errors']:>6} "
+              f"{result['space_freed'] / (1024 * 1024):>9.2f} {result['elapsed']:>6.1f}s")
 
 def main():
     parser = argparse.ArgumentParser(
@@ -79,7 +275,8 @@ Available Presets:
     parser.add_argument(
         '--preset',
         choices=list(PRESETS.keys()),
-        help='Run with a preset configuration'
+        action='append',
+        help='Run with a preset configuration (repeat to run several presets in one process)'
     )
     
     parser.add_argument(
@@ -112,38 +309,88 @@ Available Presets:
         help='Actually delete files (disable dry-run)'
     )
     
+    parser.add_argument(
+        '--daemon',
+        action='store_true',
+        help='Keep running and repeat each preset on its interval'
+    )
+    
+    parser.add_argument(
+        '--interval',
+        action='append',
+        default=[],
+        metavar='PRESET=INTERVAL',
+        help='Override a preset\'s daemon interval, e.g. orphaned=6h (units: s, m, h, d)'
+    )
+    
+    parser.add_argument(
+        '--listing-cache-limit',
+        type=int,
+        metavar='FILES',
+        help='Stream buckets with more than FILES files instead of caching their listing (default: the cleaner\'s, 100000)'
+    )
+    
+    parser.add_argument(
+        '--jitter',
+        type=float,
+        default=DEFAULT_JITTER,
+        help=f'Random delay added to each daemon run, as a share of its interval (default: {DEFAULT_JITTER})'
+    )
+    
     args = parser.parse_args()
     
+    if args.daemon and args.custom:
+        parser.error('--daemon runs presets; use --preset instead of --custom')
+    
     # Check if cleaner script exists
     if not CLEANER_SCRIPT.exists():
         print(f"❌ Error: Storage cleaner not found at {CLEANER_SCRIPT}")
         sys.exit(1)
     
-    # Build command arguments
-    cleaner_args = []
+    # Build cleaner arguments for each pass
+    passes = []
     
     if args.preset:
-        # Use preset
-        preset = PRESETS[args.preset]
-        print(f"📋 Using preset: {args.preset}")
-        print(f"   {preset['description']}\n")
-        cleaner_args = preset['args'].copy()
+        # Use presets, in the order given
+        for name in args.preset:
+            preset = PRESETS[name]
+            print(f"📋 Using preset: {name}")
+            print(f"   {preset['description']}\n")
+            passes.append((name, preset['args'].copy()))
         
     elif args.custom:
         # Build custom arguments
+        cleaner_args = []
         if args.days:
             cleaner_args.extend(['--days', str(args.days)])
         if args.bucket:
             cleaner_args.extend(['--bucket', args.bucket])
         if args.orphaned_only:
             cleaner_args.append('--orphaned-only')
+        passes.append(('custom', cleaner_args))
     else:
         # Default to test mode
         print("📋 No preset specified, using 'test' mode (dry-run)\n")
-        cleaner_args = PRESETS['test']['args'].copy()
+        passes.append(('test', PRESETS['test']['args'].copy()))
+    
+    if args.listing_cache_limit is not None:
+        passes = [(name, cleaner_args + ['--listing-cache-limit', str(args.listing_cache_limit)])
+                  for name, cleaner_args in passes]
     
     # Run cleaner
-    returncode = run_cleaner(cleaner_args, dry_run=not args.live)
+    if args.daemon:
+        intervals = {name: parse_interval(PRESETS[name]['interval']) for name, _ in passes}
+        for override in args.interval:
+            name, _, value = override.partition('=')
+            if name not in intervals:
+                parser.error(f"--interval {override}: {name!r} is not one of the selected presets")
+            try:
+                intervals[name] = parse_interval(value)
+            except ValueError as e:
+                parser.error(f"--interval {override}: {e}")
+        returncode = run_daemon(passes, intervals, dry_run=not args.live, jitter=args.jitter)
+    else:
+        returncode = run_cleaner(passes, dry_run=not args.live)
     
     if returncode == 0:
         print("\n✅ Storage cleaner completed successfully")
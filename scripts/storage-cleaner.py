@@ -7,6 +7,9 @@ Features:
 - Identifies files older than specified days
 - Finds orphaned files not referenced in database
 - Removes temporary/test files
+- Removes unreferenced byte-identical copies of files (--dedup)
+- Shrinks buckets to a storage quota with the fewest deletions (--target-size)
+- Archives files to local tar.gz files before deleting them (--archive-dir)
 - Generates cleanup reports
 - Dry-run mode for safe testing
 
@@ -14,12 +17,40 @@ Usage:
     python storage-cleaner.py --dry-run
     python storage-cleaner.py --days 30 --bucket payment_proofs
     python storage-cleaner.py --orphaned-only
+    python storage-cleaner.py --days 90 --workers 16
+    python storage-cleaner.py --days 90 --async --workers 32
+    python storage-cleaner.py --orphaned-only --ref-cache .storage-cleaner/references.sqlite
+    python storage-cleaner.py --days 90 --resume
+    python storage-cleaner.py --rules cleanup-rules.json --dry-run
+    python storage-cleaner.py --days 90 --report cleanup.jsonl
+    python storage-cleaner.py --orphaned-only --metrics-prom /var/lib/node_exporter/storage_cleaner.prom
+    python storage-cleaner.py --dedup --dry-run
+    python storage-cleaner.py --target-size 5GB --bucket payment_proofs --dry-run
+    python storage-cleaner.py --days 365 --bucket payment_proofs --archive-dir /backups/payment-proofs
 """
 
 import os
 import sys
-from datetime import datetime, timedelta
-from typing import List, Dict, Set
+import time
+import asyncio
+import threading
+import sqlite3
+import bisect
+import hashlib
+import heapq
+import math
+import re
+import csv
+import gzip
+import queue
+import tarfile
+import tempfile
+import contextvars
+from collections import deque
+from contextlib import contextmanager, asynccontextmanager, nullcontext
+from concurrent.futures import ThreadPoolExecutor, wait, FIRST_COMPLETED
+from datetime import datetime, timedelta, timezone
+from typing import List, Dict, Set, Iterator, Iterable
 import argparse
 import json
 from dotenv import load_dotenv
@@ -32,11 +63,25 @@ try:
     from appwrite.services.storage import Storage
     from appwrite.services.databases import Databases
     from appwrite.query import Query
+    from appwrite.exception import AppwriteException
 except ImportError:
     print("❌ Error: appwrite package not installed")
     print("Install with: pip install appwrite")
     sys.exit(1)
 
+import requests
+from appwrite_transport import PooledTransport, appwrite_headers, backoff_delay
+
+try:
+    import aiohttp  # Optional: only needed for the --async engine
+except ImportError:
+    aiohttp = None
+
+try:
+    import fcntl  # Unix only; without it runs are not locked against each other
+except ImportError:
+    fcntl = None
+
 # Appwrite Configuration
 APPWRITE_ENDPOINT = os.getenv('VITE_APPWRITE_ENDPOINT', 'https://cloud.appwrite.io/v1')
 APPWRITE_PROJECT_ID = os.getenv('VITE_APPWRITE_PROJECT_ID')
@@ -56,16 +101,1948 @@ COLLECTIONS = {
     'therapists': 'therapists_collection_id'
 }
 
+# Document fields that reference storage files: (collection, field, label)
+REFERENCE_SOURCES = [
+    ('bookings', 'paymentProofFileId', 'bookings'),
+    ('chat_messages', 'fileId', 'chat messages'),
+    ('therapists', 'imageFileId', 'therapist profiles')
+]
+
+# Page size used when scanning reference collections
+REFERENCE_PAGE_SIZE = 1000
+
+# Membership structures for the reference index (see make_id_builder)
+REFERENCE_INDEX_TYPES = ['set', 'sorted', 'bloom']
+
+# Appwrite IDs are at most 36 ASCII characters; the sorted index stores
+# them as fixed-width records padded with NUL bytes
+ID_WIDTH = 36
+SORTED_RUN_SIZE = 1 << 16
+BLOOM_FALSE_POSITIVE_RATE = 0.01
+
+# Deletion journal location and how often appended records are fsynced
+DEFAULT_JOURNAL_DIR = os.path.join('.storage-cleaner', 'journal')
+JOURNAL_SYNC_INTERVAL = 1.0
+
+# Lock file that keeps two cleanup runs from overlapping
+DEFAULT_LOCK_FILE = os.path.join('.storage-cleaner', 'cleaner.lock')
+
+# Duplicate detection: content hash cache and the download read size
+DEFAULT_HASH_CACHE = os.path.join('.storage-cleaner', 'hashes.sqlite')
+DOWNLOAD_CHUNK_SIZE = 1024 * 1024
+LISTING_BATCH_SIZE = 1000
+
+# Listing cache (runner and daemon): only the fields the cleanup passes
+# read are kept, as one tuple per file (about 0.5 KB instead of the 1.8 KB
+# of the full file document). A bucket with more than LISTING_CACHE_LIMIT
+# files is streamed on every pass instead of being cached.
+LISTING_FIELDS = ('$id', '$createdAt', 'sizeOriginal', 'mimeType', 'name', 'signature')
+LISTING_CACHE_LIMIT = 100_000
+
+# Archive-before-delete: a new archive file is started after
+# ARCHIVE_ROLL_SIZE bytes. Receipts and attachments are mostly already
+# compressed (JPEG, PNG, PDF, video), so those entries are stored without
+# deflating them again, which would only cost CPU. Downloads are spooled to
+# disk beyond ARCHIVE_SPOOL_MEMORY, and at most ARCHIVE_BATCH_SIZE entries
+# share one fsync.
+ARCHIVE_ROLL_SIZE = 1024 ** 3
+ARCHIVE_COMPRESS_LEVEL = 6
+ARCHIVE_STORED_TYPES = ('image/jpeg', 'image/png', 'image/gif', 'image/webp', 'application/pdf',
+                        'application/zip', 'application/gzip', 'video/', 'audio/')
+ARCHIVE_SPOOL_MEMORY = 256 * 1024
+ARCHIVE_BATCH_SIZE = 64
+
+# Reference cache: full reconcile interval (picks up deleted documents) and
+# how far the $updatedAt watermark is rewound to absorb clock skew
+DEFAULT_RECONCILE_HOURS = 24
+REFERENCE_SYNC_OVERLAP = timedelta(minutes=5)
+
+# Built-in name patterns for temporary/test uploads (matched case-insensitively)
+TEMP_NAME_PATTERNS = ['test', 'temp', 'tmp', 'debug', 'demo', 'sample']
+
+# Name-pattern syntax that breaks once the patterns are merged into one
+# regex: numbered backreferences count the groups of the merged pattern,
+# and global inline flags such as (?i) must start the whole pattern
+NUMBERED_BACKREFERENCE = re.compile(r'(?<!\\)(?:\\\\)*\\[1-9]')
+GLOBAL_INLINE_FLAGS = re.compile(r'(?<!\\)(?:\\\\)*\(\?[aiLmsux]+\)')
+
+# Keys accepted by a --rules config, both globally and per bucket
+RULE_KEYS = {'max_age_days', 'min_size_bytes', 'mime_types', 'name_patterns', 'temp_files', 'orphaned'}
+
+# Machine-readable report formats and the CSV column layout
+REPORT_FORMATS = ['jsonl', 'csv']
+REPORT_FIELDS = ['time', 'record', 'bucket', 'file_id', 'name', 'size', 'action', 'reasons', 'latency_ms', 'detail']
+
+# API call types timed by RunMetrics and the latency histogram bounds (seconds)
+API_CALL_TYPES = ['list_files', 'list_documents', 'delete_file', 'download_file']
+LATENCY_BUCKETS = [0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0]
+METRICS_PREFIX = 'storage_cleaner'
+
+# Binary multipliers accepted by --target-size
+SIZE_UNITS = {'': 1, 'k': 1024, 'm': 1024 ** 2, 'g': 1024 ** 3, 't': 1024 ** 4}
+
+# Number of candidate files shown in the per-bucket preview
+PREVIEW_LIMIT = 10
+
+# Default number of concurrent API requests (shared by all buckets)
+DEFAULT_WORKERS = 4
+
+# Console line prefix for the bucket being cleaned (set per bucket thread/task)
+OUTPUT_PREFIX = contextvars.ContextVar('output_prefix', default='')
+
+# Retry policy for transient API errors (rate limits, 5xx, network)
+MAX_RETRIES = 3
+RETRY_BASE_DELAY = 0.5
+TRANSIENT_STATUS_CODES = {0, 408, 429, 500, 502, 503, 504}
+
+def is_transient_error(error: Exception) -> bool:
+    """Check if an API error is worth retrying (throttling, 5xx, network)"""
+    if isinstance(error, AppwriteException):
+        return (error.code or 0) in TRANSIENT_STATUS_CODES
+    return isinstance(error, (ConnectionError, TimeoutError))
+
+class ReferenceIndexError(Exception):
+    """Raised when a reference collection could not be scanned completely"""
+
+class ListingError(Exception):
+    """Raised when a bucket listing fails after retries, instead of ending it early"""
+
+def reference_queries(field: str, cursor: str = None) -> List[str]:
+    """Queries for one page of a reference scan, projected to the file ID field"""
+    queries = [
+        Query.select(['$id', field]),
+        Query.is_not_null(field),
+        Query.limit(REFERENCE_PAGE_SIZE)
+    ]
+    if cursor:
+        queries.append(Query.cursor_after(cursor))
+    return queries
+
+def file_list_queries(limit: int, cursor: str = None, created_before: str = None, created_after: str = None) -> List[str]:
+    """Queries for one page of a bucket listing
+    
+    With ``created_before`` the age filter runs on the server and files
+    come back oldest first, so only candidates are transferred.
+    ``created_after`` limits the listing to files created since then
+    (inclusive), for refreshing a cached listing.
+    """
+    queries = [Query.limit(limit)]
+    if created_before:
+        queries.append(Query.less_than('$createdAt', created_before))
+        queries.append(Query.order_asc('$createdAt'))
+    if created_after:
+        queries.append(Query.greater_than_equal('$createdAt', created_after))
+    if cursor:
+        queries.append(Query.cursor_after(cursor))
+    return queries
+
+def age_cutoff(days: int) -> str:
+    """Creation timestamp before which a file counts as older than ``days``"""
+    return format_timestamp(datetime.now(timezone.utc) - timedelta(days=days))
+
+def is_created_before(file: Dict, cutoff: str) -> bool:
+    """Check if a file was created before a timestamp
+    
+    Appwrite timestamps are fixed-width UTC strings
+    (2026-01-15T10:30:00.000+00:00), so they are compared directly
+    against the cutoff. Anything in another format falls back to parsing;
+    a file whose date cannot be parsed counts as not created before.
+    """
+    created_at = file['$createdAt']
+    if created_at.endswith('+00:00') and len(created_at) == len(cutoff):
+        return created_at < cutoff
+    
+    try:
+        return parse_timestamp(created_at) < parse_timestamp(cutoff)
+    except Exception as e:
+        print(f"⚠️  Could not parse date for file {file['$id']}: {e}")
+        return False
+
+def parse_size(value: str) -> int:
+    """Parse a size such as 500MB, 2.5G or 1048576 (plain numbers are bytes)"""
+    match = re.fullmatch(r'\s*(\d+(?:\.\d+)?)\s*([kmgt]?)i?b?\s*', value, re.IGNORECASE)
+    if not match:
+        raise argparse.ArgumentTypeError(f"invalid size: {value!r} (use e.g. 500MB or 2GB)")
+    number, unit = match.groups()
+    return int(float(number) * SIZE_UNITS[unit.lower()])
+
+def format_timestamp(moment: datetime) -> str:
+    """Format a datetime the way Appwrite stores $createdAt/$updatedAt"""
+    moment = moment.astimezone(timezone.utc)
+    return moment.strftime('%Y-%m-%dT%H:%M:%S.') + f"{moment.microsecond // 1000:03d}+00:00"
+
+def parse_timestamp(value: str) -> datetime:
+    """Parse an Appwrite timestamp (ISO 8601, e.g. 2026-01-15T10:30:00.000+00:00)"""
+    return datetime.fromisoformat(value.replace('Z', '+00:00'))
+
+def load_rules_config(path: str) -> Dict:
+    """Read and validate a --rules JSON config
+    
+    Format: {"rules": {...}, "buckets": {"<bucket name>": {...}}}, where
+    each rule block may set any of RULE_KEYS. Bucket blocks override the
+    global rules key by key; null switches a rule off.
+    """
+    with open(path, encoding='utf-8') as f:
+        config = json.load(f)
+    
+    unknown = set(config) - {'rules', 'buckets'}
+    if unknown:
+        raise ValueError(f"Unknown sections in rules config: {', '.join(sorted(unknown))}")
+    
+    if not isinstance(config.get('buckets', {}), dict):
+        raise ValueError("The buckets section of the rules config must be an object")
+    validate_rules(config.get('rules', {}), 'rules')
+    for bucket_name, overrides in config.get('buckets', {}).items():
+        if bucket_name not in BUCKETS:
+            raise ValueError(f"Unknown bucket in rules config: {bucket_name}")
+        validate_rules(overrides, f"buckets.{bucket_name}")
+    return config
+
+def validate_rules(rules: Dict, where: str):
+    """Reject unknown rule keys, mistyped values and name patterns that do not compile
+    
+    Every rule may be null (switched off). Otherwise name_patterns and
+    mime_types must be lists of strings (a bare string would turn each
+    character into a pattern), max_age_days and min_size_bytes
+    non-negative numbers, and temp_files and orphaned booleans.
+    
+    A bucket block replaces the global name_patterns as a whole, so each
+    block's patterns are checked merged exactly as CleanupPolicy runs
+    them, together with the built-in temp names.
+    """
+    if not isinstance(rules, dict):
+        raise ValueError(f"Rules in {where} must be an object, got {type(rules).__name__}")
+    unknown = set(rules) - RULE_KEYS
+    if unknown:
+        raise ValueError(f"Unknown rules in {where}: {', '.join(sorted(unknown))}")
+    
+    for key, value in rules.items():
+        if value is None:
+            continue
+        if key in ('name_patterns', 'mime_types'):
+            valid = isinstance(value, list) and all(isinstance(item, str) for item in value)
+            expected = "a list of strings"
+        elif key in ('max_age_days', 'min_size_bytes'):
+            valid = isinstance(value, (int, float)) and not isinstance(value, bool) and value >= 0
+            expected = "a non-negative number"
+        else:
+            valid = isinstance(value, bool)
+            expected = "true or false"
+        if not valid:
+            raise ValueError(f"Invalid {key} in {where}: {value!r} (expected {expected})")
+    
+    name_patterns = rules.get('name_patterns') or []
+    for pattern in name_patterns:
+        if NUMBERED_BACKREFERENCE.search(pattern):
+            raise ValueError(f"Invalid name pattern in {where}: {pattern!r} "
+                             f"(numbered backreferences are not supported, use (?P=name))")
+        if GLOBAL_INLINE_FLAGS.search(pattern):
+            raise ValueError(f"Invalid name pattern in {where}: {pattern!r} "
+                             f"(global inline flags are not supported, use a scoped group such as (?s:...))")
+    try:
+        compile_name_patterns(name_patterns, temp_files=True)
+    except re.error as e:
+        raise ValueError(f"Invalid name patterns in {where}: {name_patterns!r} ({e})")
+
+def compile_name_patterns(name_patterns: List[str], temp_files: bool):
+    """Merge the temp names and name patterns into one case-insensitive regex
+    
+    Each pattern gets its own named group (temp, name0, name1, ...), so
+    ``lastgroup`` of a match tells which one hit. Returns the compiled
+    regex and a report label per group, or (None, {}) without patterns.
+    """
+    labels = {}
+    alternatives = []
+    if temp_files:
+        labels['temp'] = "temporary/test file"
+        alternatives.append(f"(?P<temp>{'|'.join(map(re.escape, TEMP_NAME_PATTERNS))})")
+    for i, pattern in enumerate(name_patterns):
+        labels[f'name{i}'] = f"name matches {pattern!r}"
+        alternatives.append(f"(?P<name{i}>{pattern})")
+    if not alternatives:
+        return None, {}
+    return re.compile('|'.join(alternatives), re.IGNORECASE), labels
+
+def api_call_type(method: str, path: str) -> str:
+    """Classify an Appwrite REST request for the latency metrics"""
+    method = method.upper()
+    path = path.split('?', 1)[0].rstrip('/')
+    if method == 'GET' and path.endswith('/files'):
+        return 'list_files'
+    if method == 'GET' and path.endswith('/documents'):
+        return 'list_documents'
+    if method == 'GET' and path.endswith('/download'):
+        return 'download_file'
+    if method == 'DELETE' and '/files/' in path:
+        return 'delete_file'
+    return 'other'
+
+def is_not_found_error(error: Exception) -> bool:
+    """Check if an API error means the file no longer exists"""
+    return isinstance(error, AppwriteException) and error.code == 404
+
+def retry_delay(attempt: int) -> float:
+    """Jittered exponential backoff delay for the given retry attempt"""
+    return backoff_delay(attempt, RETRY_BASE_DELAY)
+
+def call_with_retries(call, on_retry=None):
+    """Run an API call, retrying transient errors with backoff
+    
+    Retry-After is honored by the transport's rate controller, which holds
+    the retried request back until the server's delay has passed.
+    """
+    for attempt in range(MAX_RETRIES + 1):
+        try:
+            return call()
+        except Exception as e:
+            if attempt < MAX_RETRIES and is_transient_error(e):
+                if on_retry:
+                    on_retry()
+                time.sleep(retry_delay(attempt))
+                continue
+            raise
+
+async def call_with_retries_async(call, on_retry=None):
+    """``call_with_retries`` for a coroutine function"""
+    for attempt in range(MAX_RETRIES + 1):
+        try:
+            return await call()
+        except Exception as e:
+            if attempt < MAX_RETRIES and is_transient_error(e):
+                if on_retry:
+                    on_retry()
+                await asyncio.sleep(retry_delay(attempt))
+                continue
+            raise
+
+class SetIdBuilder:
+    """Collects file IDs into a plain Python set"""
+    
+    def __init__(self):
+        self.ids = set()
+    
+    def update(self, file_ids: Iterable[str]):
+        self.ids.update(file_ids)
+    
+    def build(self) -> Set[str]:
+        return self.ids
+
+class SortedIdIndex:
+    """Sorted array of fixed-width encoded IDs, searched with bisect
+    
+    Holds every ID in one byte buffer of ID_WIDTH-byte records, about
+    36 bytes per ID instead of 100+ for a str in a set. IDs that don't fit
+    a record (never the case for Appwrite-generated IDs) go to a small
+    exact overflow set, so membership answers are the same as a set's.
+    """
+    
+    def __init__(self, data: bytearray = b'', overflow: Set[str] = None):
+        self.data = data
+        self.overflow = overflow or set()
+    
+    def __len__(self) -> int:
+        return len(self.data) // ID_WIDTH + len(self.overflow)
+    
+    def __getitem__(self, index: int) -> bytes:
+        # Lets bisect treat the buffer as a sequence of records
+        return self.data[index * ID_WIDTH:(index + 1) * ID_WIDTH]
+    
+    def __contains__(self, file_id: str) -> bool:
+        record = encode_id(file_id)
+        if record is None:
+            return file_id in self.overflow
+        
+        records = len(self.data) // ID_WIDTH
+        position = bisect.bisect_left(self, record, 0, records)
+        return position < records and self[position] == record
+    
+    def __iter__(self) -> Iterator[bytes]:
+        for index in range(len(self.data) // ID_WIDTH):
+            yield self[index]
+    
+    @property
+    def nbytes(self) -> int:
+        return len(self.data)
+
+class SpilledIdRun:
+    """Sorted, de-duplicated ID records spilled to a temporary file"""
+    
+    def __init__(self, records: Iterable[bytes], overflow: Set[str] = None):
+        self.file = tempfile.TemporaryFile()
+        self.count = 0
+        self.overflow = overflow or set()
+        
+        previous = None
+        for record in records:
+            if record != previous:
+                self.file.write(record)
+                self.count += 1
+                previous = record
+    
+    def __len__(self) -> int:
+        return self.count + len(self.overflow)
+    
+    def __iter__(self) -> Iterator[bytes]:
+        self.file.seek(0)
+        while chunk := self.file.read(ID_WIDTH * 4096):
+            for start in range(0, len(chunk), ID_WIDTH):
+                yield chunk[start:start + ID_WIDTH]
+    
+    def close(self):
+        self.file.close()
+
+class SortedIdBuilder:
+    """Builds a sorted ID run from a stream of IDs in bounded memory
+    
+    IDs are buffered SORTED_RUN_SIZE at a time. Each buffer is sorted and
+    spilled to a temporary file, and the spilled runs are merged into one
+    run at the end (an external merge sort). Memory use stays at one
+    buffer, however many IDs a collection holds.
+    """
+    
+    def __init__(self):
+        self.buffer = []
+        self.runs = []
+        self.overflow = set()
+    
+    def update(self, file_ids: Iterable[str]):
+        for file_id in file_ids:
+            record = encode_id(file_id)
+            if record is None:
+                self.overflow.add(file_id)
+                continue
+            self.buffer.append(record)
+            if len(self.buffer) >= SORTED_RUN_SIZE:
+                self._spill_run()
+    
+    def _spill_run(self):
+        self.buffer.sort()
+        self.runs.append(SpilledIdRun(self.buffer))
+        self.buffer = []
+    
+    def build(self) -> SpilledIdRun:
+        if self.buffer or not self.runs:
+            self._spill_run()
+        
+        if len(self.runs) == 1:
+            run = self.runs[0]
+        else:
+            run = SpilledIdRun(heapq.merge(*self.runs))
+            for spilled in self.runs:
+                spilled.close()
+        
+        run.overflow |= self.overflow
+        self.runs = []
+        return run
+
+class BloomFrontIndex:
+    """Bloom filter in front of an exact SortedIdIndex
+    
+    Most lookups for unreferenced files are rejected by the filter without
+    touching the sorted array. Positives are always confirmed against the
+    exact index, so false positives never change the result.
+    """
+    
+    def __init__(self, exact: SortedIdIndex, false_positive_rate: float = BLOOM_FALSE_POSITIVE_RATE):
+        self.exact = exact
+        count = max(1, len(exact))
+        self.size = max(64, int(-count * math.log(false_positive_rate) / (math.log(2) ** 2)))
+        self.hashes = max(1, round(self.size / count * math.log(2)))
+        self.bits = bytearray((self.size + 7) // 8)
+        
+        for record in exact:
+            self._add(record)
+        for file_id in exact.overflow:
+            self._add(file_id.encode('utf-8'))
+    
+    def _positions(self, key: bytes) -> Iterator[int]:
+        digest = hashlib.blake2b(key, digest_size=16).digest()
+        first = int.from_bytes(digest[:8], 'little')
+        second = int.from_bytes(digest[8:], 'little') | 1
+        for i in range(self.hashes):
+            yield (first + i * second) % self.size
+    
+    def _add(self, key: bytes):
+        for position in self._positions(key):
+            self.bits[position >> 3] |= 1 << (position & 7)
+    
+    def __contains__(self, file_id: str) -> bool:
+        key = encode_id(file_id) or file_id.encode('utf-8')
+        for position in self._positions(key):
+            if not self.bits[position >> 3] & (1 << (position & 7)):
+                return False
+        return file_id in self.exact
+    
+    def __len__(self) -> int:
+        return len(self.exact)
+    
+    @property
+    def nbytes(self) -> int:
+        return self.exact.nbytes + len(self.bits)
+
+def encode_id(file_id: str):
+    """Encode an ID as a fixed-width record, or None if it doesn't fit"""
+    encoded = file_id.encode('utf-8')
+    if len(encoded) > ID_WIDTH or b'\0' in encoded:
+        return None
+    return encoded.ljust(ID_WIDTH, b'\0')
+
+def join_unique_records(records: Iterable[bytes]) -> bytearray:
+    """Concatenate sorted records, dropping consecutive duplicates"""
+    output = bytearray()
+    previous = None
+    for record in records:
+        if record != previous:
+            output += record
+            previous = record
+    return output
+
+def make_id_builder(index_type: str):
+    """Builder for one reference source in the selected index type"""
+    return SetIdBuilder() if index_type == 'set' else SortedIdBuilder()
+
+def combine_references(index_type: str, results: List):
+    """Union per-source results into the final membership structure"""
+    if index_type == 'set':
+        return set().union(*results)
+    
+    # Per-source runs live on disk, so only the merged index is in memory
+    merged = SortedIdIndex(
+        join_unique_records(heapq.merge(*results)),
+        set().union(*(run.overflow for run in results))
+    )
+    for run in results:
+        run.close()
+    
+    return BloomFrontIndex(merged) if index_type == 'bloom' else merged
+
+class ReferenceCache:
+    """On-disk cache of file references per collection, synced on $updatedAt
+    
+    Each run only fetches documents updated since the last sync watermark
+    (rewound by REFERENCE_SYNC_OVERLAP). Updates that clear or change the
+    file field overwrite the cached row. Deleted documents are not visible
+    to an incremental sync, so their rows are kept until the next full
+    reconcile. A stale reference only keeps a file alive and never
+    deletes one.
+    """
+    
+    def __init__(self, path: str, reconcile_hours: float = DEFAULT_RECONCILE_HOURS):
+        self.path = path
+        self.reconcile_interval = timedelta(hours=reconcile_hours)
+        
+        directory = os.path.dirname(os.path.abspath(path))
+        os.makedirs(directory, exist_ok=True)
+        
+        with self._connect() as db:
+            db.execute("PRAGMA journal_mode=WAL")
+            db.execute("""
+                CREATE TABLE IF NOT EXISTS refs (
+                    source TEXT NOT NULL,
+                    document_id TEXT NOT NULL,
+                    file_id TEXT NOT NULL,
+                    PRIMARY KEY (source, document_id)
+                )
+            """)
+            db.execute("""
+                CREATE TABLE IF NOT EXISTS sync_state (
+                    source TEXT PRIMARY KEY,
+                    watermark TEXT,
+                    reconciled_at TEXT NOT NULL
+                )
+            """)
+    
+    def _connect(self) -> sqlite3.Connection:
+        # One connection per call so sources can sync from separate threads
+        return sqlite3.connect(self.path, timeout=60)
+    
+    def sync_source(self, databases: 'Databases', collection: str, field: str, label: str, builder=None):
+        """Bring one reference source up to date and return its file IDs"""
+        source = f"{DATABASE_ID}/{COLLECTIONS[collection]}/{field}"
+        
+        db = self._connect()
+        try:
+            state = db.execute(
+                "SELECT watermark, reconciled_at FROM sync_state WHERE source = ?",
+                (source,)
+            ).fetchone()
+            
+            now = datetime.now(timezone.utc)
+            if state is None or now - parse_timestamp(state[1]) >= self.reconcile_interval:
+                changed = self._full_reconcile(db, databases, source, collection, field, now)
+                print(f"🔁 {label}: full reconcile ({changed} documents)")
+            else:
+                changed = self._incremental_sync(db, databases, source, collection, field, state[0])
+                print(f"🔄 {label}: {changed} documents changed since last sync")
+            
+            builder = builder or SetIdBuilder()
+            builder.update(row[0] for row in db.execute("SELECT file_id FROM refs WHERE source = ?", (source,)))
+            return builder.build()
+        finally:
+            db.close()
+    
+    def _full_reconcile(self, db, databases, source: str, collection: str, field: str, started: datetime) -> int:
+        """Replace a source's rows with a complete scan, in one transaction"""
+        count = 0
+        cursor = None
+        
+        with db:
+            db.execute("DELETE FROM refs WHERE source = ?", (source,))
+            while True:
+                documents = call_with_retries(lambda: databases.list_documents(
+                    database_id=DATABASE_ID,
+                    collection_id=COLLECTIONS[collection],
+                    queries=reference_queries(field, cursor)
+                ))['documents']
+                db.executemany(
+                    "INSERT OR REPLACE INTO refs (source, document_id, file_id) VALUES (?, ?, ?)",
+                    [(source, document['$id'], document[field]) for document in documents if document.get(field)]
+                )
+                count += len(documents)
+                
+                if len(documents) < REFERENCE_PAGE_SIZE:
+                    break
+                cursor = documents[-1]['$id']
+            
+            # Documents updated while the scan ran are caught by the next
+            # incremental sync, which starts from the scan's start time
+            db.execute(
+                "INSERT OR REPLACE INTO sync_state (source, watermark, reconciled_at) VALUES (?, ?, ?)",
+                (source, format_timestamp(started), format_timestamp(started))
+            )
+        
+        return count
+    
+    def _incremental_sync(self, db, databases, source: str, collection: str, field: str, watermark: str) -> int:
+        """Apply documents updated since the watermark, oldest first"""
+        since = format_timestamp(parse_timestamp(watermark) - REFERENCE_SYNC_OVERLAP)
+        newest = watermark
+        count = 0
+        cursor = None
+        
+        with db:
+            while True:
+                queries = [
+                    Query.select(['$id', '$updatedAt', field]),
+                    Query.greater_than_equal('$updatedAt', since),
+                    Query.order_asc('$updatedAt'),
+                    Query.limit(REFERENCE_PAGE_SIZE)
+                ]
+                if cursor:
+                    queries.append(Query.cursor_after(cursor))
+                
+                documents = call_with_retries(lambda: databases.list_documents(
+                    database_id=DATABASE_ID,
+                    collection_id=COLLECTIONS[collection],
+                    queries=queries
+                ))['documents']
+                
+                for document in documents:
+                    if document.get(field):
+                        db.execute(
+                            "INSERT OR REPLACE INTO refs (source, document_id, file_id) VALUES (?, ?, ?)",
+                            (source, document['$id'], document[field])
+                        )
+                    else:
+                        db.execute(
+                            "DELETE FROM refs WHERE source = ? AND document_id = ?",
+                            (source, document['$id'])
+                        )
+                    newest = max(newest, document['$updatedAt'])
+                count += len(documents)
+                
+                if len(documents) < REFERENCE_PAGE_SIZE:
+                    break
+                cursor = documents[-1]['$id']
+            
+            db.execute("UPDATE sync_state SET watermark = ? WHERE source = ?", (newest, source))
+        
+        return count
+
+class ReferenceSnapshot:
+    """Referenced file IDs as of one reference scan
+    
+    The scan reads documents while files keep being uploaded, and the
+    snapshot may be reused long after it was taken (by every bucket of a
+    run, and by later presets). A file uploaded and referenced after the
+    scan started is missing from ``ids`` but is not an orphan, so only
+    files created before ``cutoff`` (server time when the scan started,
+    minus REFERENCE_SYNC_OVERLAP) can be classified as orphaned.
+    
+    The guard only looks at when a file was created, not at when it was
+    referenced. An old file that a document starts pointing to after the
+    cutoff (a re-shared attachment, say) is missing from ``ids`` and is
+    still treated as orphaned until the next reference scan.
+    """
+    
+    def __init__(self, ids, cutoff: str):
+        self.ids = ids
+        self.cutoff = cutoff
+    
+    def __len__(self) -> int:
+        return len(self.ids)
+    
+    def __contains__(self, file_id: str) -> bool:
+        return file_id in self.ids
+    
+    def is_orphaned(self, file: Dict) -> bool:
+        return file['$id'] not in self.ids and is_created_before(file, self.cutoff)
+
+class CleanupPolicy:
+    """Cleanup rules for one bucket pass, compiled into a single predicate
+    
+    Every enabled rule becomes a check with a relative cost. ``matches``
+    runs the checks cheapest first and stops at the first hit, which is
+    all the per-file loop needs; ``reasons`` runs every check in report
+    order and is only called for files that will be deleted. All name
+    patterns (built-in temp names and configured regexes) are merged into
+    one case-insensitive regex, so names are scanned once per file.
+    """
+    
+    def __init__(self, rules: Dict):
+        self.rules = rules
+        self.references = None
+        self.created_before = None
+        checks = []
+        
+        if rules.get('orphaned'):
+            checks.append((3, self._is_orphaned, lambda file: "orphaned"))
+        
+        days = rules.get('max_age_days')
+        if days:
+            self.created_before = age_cutoff(days)
+            checks.append((2, self._is_old, lambda file: f"older than {days} days"))
+        
+        names, labels = compile_name_patterns(rules.get('name_patterns') or [], bool(rules.get('temp_files')))
+        if names:
+            search = names.search
+            checks.append((4,
+                           lambda file: search(file.get('name', '')) is not None,
+                           lambda file: labels[search(file.get('name', '')).lastgroup]))
+        
+        min_size = rules.get('min_size_bytes')
+        if min_size:
+            size_mb = min_size / (1024 * 1024)
+            checks.append((1,
+                           lambda file: file['sizeOriginal'] >= min_size,
+                           lambda file: f"larger than {size_mb:.2f} MB"))
+        
+        mime_types = rules.get('mime_types') or []
+        if mime_types:
+            exact = frozenset(m for m in mime_types if not m.endswith('/*'))
+            prefixes = tuple(m[:-1] for m in mime_types if m.endswith('/*'))
+            checks.append((1,
+                           lambda file: file.get('mimeType') in exact or file.get('mimeType', '').startswith(prefixes),
+                           lambda file: f"type {file.get('mimeType')}"))
+        
+        self._report_order = checks
+        self._by_cost = [check for _, check, _ in sorted(checks, key=lambda entry: entry[0])]
+    
+    @property
+    def enabled(self) -> bool:
+        return bool(self._by_cost)
+    
+    @property
+    def needs_references(self) -> bool:
+        return bool(self.rules.get('orphaned'))
+    
+    @property
+    def age_only(self) -> bool:
+        """True when age is the only rule, so listing can be filtered server-side"""
+        return self.created_before is not None and len(self._by_cost) == 1
+    
+    def describe(self) -> str:
+        """One-line summary of the enabled rules for the console"""
+        parts = []
+        if self.rules.get('orphaned'):
+            parts.append("orphaned")
+        if self.created_before:
+            parts.append(f"older than {self.rules['max_age_days']} days")
+        if self.rules.get('temp_files'):
+            parts.append("temporary/test names")
+        if self.rules.get('name_patterns'):
+            parts.append(f"{len(self.rules['name_patterns'])} name patterns")
+        if self.rules.get('min_size_bytes'):
+            parts.append(f"size >= {self.rules['min_size_bytes'] / (1024 * 1024):.2f} MB")
+        if self.rules.get('mime_types'):
+            parts.append(f"type in {', '.join(self.rules['mime_types'])}")
+        return ' | '.join(parts) if parts else "none"
+    
+    def matches(self, file: Dict) -> bool:
+        """Check if any rule selects the file for deletion"""
+        for check in self._by_cost:
+            if check(file):
+                return True
+        return False
+    
+    def reasons(self, file: Dict) -> List[str]:
+        """Return every reason the file should be deleted (empty list to keep it)"""
+        return [describe(file) for _, check, describe in self._report_order if check(file)]
+    
+    def _is_orphaned(self, file: Dict) -> bool:
+        return self.references.is_orphaned(file)
+    
+    def _is_old(self, file: Dict) -> bool:
+        return is_created_before(file, self.created_before)
+
+class BucketScan:
+    """Running totals and console preview for one bucket pass"""
+    
+    def __init__(self, server_filtered: bool = False):
+        self.server_filtered = server_filtered
+        self.scanned = 0
+        self.to_delete = 0
+        self.total_size = 0
+    
+    def add_candidate(self, file: Dict, reason: List[str]):
+        """Count a deletion candidate and show it if it is within the preview"""
+        self.to_delete += 1
+        self.total_size += file['sizeOriginal']
+        
+        if self.to_delete == 1:
+            print("\n📋 Files to be deleted:")
+        if self.to_delete <= PREVIEW_LIMIT:
+            size_mb = file['sizeOriginal'] / (1024 * 1024)
+            print(f"  • {file['name']} ({size_mb:.2f} MB) - {', '.join(reason)}")
+    
+    def print_report(self, dry_run: bool):
+        """Print the per-bucket findings once the pass has finished"""
+        if self.server_filtered:
+            print(f"\n📁 Found {self.scanned} files matching the server-side filter")
+        else:
+            print(f"\n📁 Found {self.scanned} files in bucket")
+        
+        if self.scanned == 0:
+            print("✅ No matching files" if self.server_filtered else "✅ Bucket is empty")
+            return
+        
+        print(f"📊 Found {self.to_delete} files to delete")
+        
+        if self.to_delete == 0:
+            print("✅ No files need cleaning")
+            return
+        
+        if self.to_delete > PREVIEW_LIMIT:
+            print(f"  ... and {self.to_delete - PREVIEW_LIMIT} more")
+        
+        total_size_mb = self.total_size / (1024 * 1024)
+        print(f"\n💾 Total space to free: {total_size_mb:.2f} MB")
+        
+        if dry_run:
+            print("\n🔒 DRY RUN: No files were deleted")
+            print("   Run without --dry-run to actually delete files")
+
+class EvictionQueue:
+    """Smallest set of files whose deletion frees ``excess`` bytes
+    
+    Files are evicted orphaned first, then oldest, then largest. The queue
+    keeps the files that come first in that order in a heap whose root is
+    the one that would be evicted last. Whenever the other files already
+    free enough, the root is dropped again, so the heap holds at most the
+    deletion set plus one file however large the bucket is.
+    """
+    
+    def __init__(self, excess: int):
+        self.excess = excess
+        self.size = 0
+        self._heap = []
+    
+    def __len__(self) -> int:
+        return len(self._heap)
+    
+    def offer(self, file: Dict, orphaned: bool):
+        """Consider a listed file for eviction"""
+        if self.excess <= 0:
+            return
+        
+        key = (not orphaned, file['$createdAt'], -file['sizeOriginal'], file['$id'])
+        heapq.heappush(self._heap, (_EvictedLast(key), orphaned, file))
+        self.size += file['sizeOriginal']
+        
+        while self.size - self._heap[0][2]['sizeOriginal'] >= self.excess:
+            self.size -= heapq.heappop(self._heap)[2]['sizeOriginal']
+    
+    def files(self) -> List:
+        """(file, orphaned) pairs of the deletion set, in eviction order"""
+        return [(file, orphaned) for _, orphaned, file in sorted(self._heap, key=lambda entry: entry[0].key)]
+
+class _EvictedLast:
+    """Heap key that puts the file evicted last at the root of a min-heap"""
+    __slots__ = ('key',)
+    
+    def __init__(self, key: tuple):
+        self.key = key
+    
+    def __lt__(self, other: '_EvictedLast') -> bool:
+        return self.key > other.key
+
+class BucketListing:
+    """Cached listing of one bucket, kept current across runs
+    
+    A later run only lists files created since the last sync (rewound by
+    REFERENCE_SYNC_OVERLAP for clock skew), and files the cleaner deletes
+    are dropped as it goes. Files deleted by anyone else stay until the
+    next full listing; deleting one of them again is harmless. Each file
+    is stored as a tuple of its LISTING_FIELDS and handed out as a dict
+    of just those fields (missing ones left out).
+    """
+    
+    def __init__(self, run: int):
+        self.files = {}
+        self.run = run
+        self.listed_at = datetime.now(timezone.utc)
+        self.synced_at = self.listed_at
+    
+    def __len__(self) -> int:
+        return len(self.files)
+    
+    def add(self, file: Dict) -> bool:
+        """Add or update a file, returning True if it was not listed yet"""
+        new = file['$id'] not in self.files
+        self.files[file['$id']] = tuple(file.get(field) for field in LISTING_FIELDS)
+        return new
+    
+    def discard(self, file_id: str):
+        self.files.pop(file_id, None)
+    
+    def snapshot(self) -> Iterator[Dict]:
+        """The cached files, safe to iterate while deletions discard others"""
+        for row in list(self.files.values()):
+            yield {field: value for field, value in zip(LISTING_FIELDS, row) if value is not None}
+    
+    def since(self) -> str:
+        return format_timestamp(self.synced_at - REFERENCE_SYNC_OVERLAP)
+    
+    def mark_synced(self, synced_at: datetime, run: int):
+        self.synced_at = synced_at
+        self.run = run
+    
+    def is_expired(self, max_age: timedelta) -> bool:
+        return datetime.now(timezone.utc) - self.listed_at >= max_age
+
+class HashIndex:
+    """Size groups and cached content hashes for duplicate detection
+    
+    Listed files go into a SQLite temp table, so grouping them by
+    ``sizeOriginal`` costs no Python memory however large the buckets
+    are. Only files that share their size with another file are hashed.
+    Hashes are kept in the ``hashes`` table of ``path`` (an anonymous
+    temporary database when ``path`` is empty). Appwrite files are
+    immutable, so a cached hash stays valid while the file's size and
+    signature still match the listing. Later runs only download files
+    they have not hashed yet.
+    """
+    
+    def __init__(self, path: str = None):
+        self.path = path
+        if path:
+            os.makedirs(os.path.dirname(os.path.abspath(path)), exist_ok=True)
+        self.db = sqlite3.connect(path or '', timeout=60)
+        self.db.execute("""
+            CREATE TABLE IF NOT EXISTS hashes (
+                bucket_id TEXT NOT NULL,
+                file_id TEXT NOT NULL,
+                size INTEGER NOT NULL,
+                signature TEXT NOT NULL,
+                sha256 TEXT NOT NULL,
+                PRIMARY KEY (bucket_id, file_id)
+            )
+        """)
+        self.db.execute("""
+            CREATE TEMP TABLE listed (
+                bucket_id TEXT NOT NULL,
+                file_id TEXT NOT NULL,
+                name TEXT,
+                size INTEGER NOT NULL,
+                signature TEXT NOT NULL,
+                created_at TEXT NOT NULL,
+                PRIMARY KEY (bucket_id, file_id)
+            )
+        """)
+        self.db.execute("CREATE TEMP TABLE fresh (bucket_id TEXT, file_id TEXT, size INTEGER, signature TEXT, sha256 TEXT)")
+        self.db.commit()
+    
+    def add_files(self, bucket_id: str, files: List[Dict]):
+        """Record a batch of listed files"""
+        self.db.executemany(
+            "INSERT OR REPLACE INTO listed VALUES (?, ?, ?, ?, ?, ?)",
+            [(bucket_id, file['$id'], file.get('name'), file['sizeOriginal'], file.get('signature') or '',
+              file['$createdAt']) for file in files]
+        )
+    
+    def size_groups(self) -> int:
+        """Number of sizes shared by more than one listed file"""
+        self.db.execute("CREATE INDEX IF NOT EXISTS temp.listed_size ON listed (size)")
+        return self.db.execute(
+            "SELECT COUNT(*) FROM (SELECT size FROM listed GROUP BY size HAVING COUNT(*) > 1)"
+        ).fetchone()[0]
+    
+    def unhashed(self) -> Iterator[Dict]:
+        """Listed files that share their size and have no valid cached hash"""
+        rows = self.db.execute("""
+            SELECT l.bucket_id, l.file_id, l.name, l.size, l.signature, l.created_at
+            FROM listed l
+            LEFT JOIN hashes h
+                ON h.bucket_id = l.bucket_id AND h.file_id = l.file_id
+                AND h.size = l.size AND h.signature = l.signature
+            WHERE h.sha256 IS NULL
+              AND l.size IN (SELECT size FROM listed GROUP BY size HAVING COUNT(*) > 1)
+            ORDER BY l.size
+        """)
+        for row in rows:
+            yield self._file(row)
+    
+    def add_hash(self, file: Dict, digest: str):
+        """Stage a computed hash (moved into the cache by save_hashes)"""
+        self.db.execute(
+            "INSERT INTO fresh VALUES (?, ?, ?, ?, ?)",
+            (file['bucketId'], file['$id'], file['sizeOriginal'], file['signature'], digest)
+        )
+    
+    def save_hashes(self):
+        """Move staged hashes into the cache and commit them"""
+        with self.db:
+            self.db.execute("INSERT OR REPLACE INTO hashes SELECT * FROM fresh")
+            self.db.execute("DELETE FROM fresh")
+    
+    def prune(self, bucket_ids: List[str]):
+        """Drop cached hashes of files that are no longer in these completely listed buckets"""
+        with self.db:
+            self.db.executemany("""
+                DELETE FROM hashes
+                WHERE bucket_id = ?
+                  AND NOT EXISTS (
+                      SELECT 1 FROM listed l
+                      WHERE l.bucket_id = hashes.bucket_id AND l.file_id = hashes.file_id
+                  )
+            """, [(bucket_id,) for bucket_id in bucket_ids])
+    
+    def duplicate_groups(self) -> Iterator[List[Dict]]:
+        """Groups of files with identical content, oldest file first
+        
+        Rows come back sorted by hash, so only one group is held in memory.
+        """
+        rows = self.db.execute("""
+            WITH digests AS (
+                SELECT l.bucket_id, l.file_id, l.name, l.size, l.signature, l.created_at, h.sha256
+                FROM listed l
+                JOIN hashes h
+                    ON h.bucket_id = l.bucket_id AND h.file_id = l.file_id
+                    AND h.size = l.size AND h.signature = l.signature
+            )
+            SELECT * FROM digests
+            WHERE sha256 IN (SELECT sha256 FROM digests GROUP BY sha256 HAVING COUNT(*) > 1)
+            ORDER BY sha256, created_at, bucket_id, file_id
+        """)
+        group = []
+        for row in rows:
+            if group and row[6] != group[0]['sha256']:
+                yield group
+                group = []
+            group.append(dict(self._file(row), sha256=row[6]))
+        if group:
+            yield group
+    
+    @staticmethod
+    def _file(row) -> Dict:
+        bucket_id, file_id, name, size, signature, created_at = row[:6]
+        return {
+            '$id': file_id,
+            'bucketId': bucket_id,
+            'name': name,
+            'sizeOriginal': size,
+            'signature': signature,
+            '$createdAt': created_at
+        }
+    
+    def close(self):
+        self.db.close()
+
+class CleanupReport:
+    """Streaming JSONL/CSV report with one record per evaluated or deleted file
+    
+    Records are written as files are evaluated and deleted, so memory use
+    does not grow with the bucket. Evaluation records carry the action
+    taken (keep, would_delete, delete) and the reasons; deletion records
+    (deleted, already_deleted, failed) add the latency of the delete call
+    including retries. print_summary appends a final summary record.
+    """
+    
+    def __init__(self, path: str, report_format: str = None):
+        self.path = path
+        self.format = report_format or ('csv' if path.lower().endswith('.csv') else 'jsonl')
+        self._lock = threading.Lock()
+        self._handle = open(path, 'w', encoding='utf-8', newline='')
+        self._writer = None
+        if self.format == 'csv':
+            self._writer = csv.DictWriter(self._handle, fieldnames=REPORT_FIELDS)
+            self._writer.writeheader()
+    
+    def _write(self, record: Dict):
+        record = {'time': format_timestamp(datetime.now(timezone.utc)), **record}
+        with self._lock:
+            if self._writer:
+                if isinstance(record.get('reasons'), list):
+                    record['reasons'] = '; '.join(record['reasons'])
+                if isinstance(record.get('detail'), dict):
+                    record['detail'] = json.dumps(record['detail'])
+                self._writer.writerow(record)
+            else:
+                self._handle.write(json.dumps(record) + '\n')
+    
+    def file(
+        self,
+        bucket_id: str,
+        file: Dict,
+        action: str,
+        reasons: List[str] = None,
+        latency: float = None,
+        error: Exception = None
+    ):
+        """Write the record for one file"""
+        record = {
+            'record': 'file',
+            'bucket': bucket_id,
+            'file_id': file['$id'],
+            'name': file.get('name'),
+            'size': file.get('sizeOriginal'),
+            'action': action,
+            'reasons': reasons or []
+        }
+        if latency is not None:
+            record['latency_ms'] = round(latency * 1000, 1)
+        if error is not None:
+            record['detail'] = str(error)
+        self._write(record)
+    
+    def summary(self, stats: Dict, bucket_stats: Dict, dry_run: bool, elapsed: float):
+        """Write the final run summary"""
+        self._write({
+            'record': 'summary',
+            'action': 'dry_run' if dry_run else 'live',
+            'size': stats['space_freed'],
+            'latency_ms': round(elapsed * 1000, 1),
+            'detail': dict(stats, buckets=list(bucket_stats.values()))
+        })
+        self.flush()
+    
+    def flush(self):
+        with self._lock:
+            self._handle.flush()
+    
+    def close(self):
+        with self._lock:
+            self._handle.close()
+
+class LatencyHistogram:
+    """Fixed-bucket latency histogram (Prometheus ``le`` semantics)"""
+    
+    def __init__(self):
+        self.counts = [0] * (len(LATENCY_BUCKETS) + 1)
+        self.count = 0
+        self.sum = 0.0
+        self.errors = 0
+    
+    def observe(self, seconds: float):
+        self.counts[bisect.bisect_left(LATENCY_BUCKETS, seconds)] += 1
+        self.count += 1
+        self.sum += seconds
+    
+    def cumulative(self) -> List:
+        """(upper bound, cumulative count) pairs, ending with +Inf"""
+        total = 0
+        pairs = []
+        for bound, count in zip(LATENCY_BUCKETS + [math.inf], self.counts):
+            total += count
+            pairs.append((bound, total))
+        return pairs
+    
+    def quantile(self, q: float) -> float:
+        """Upper bound of the bucket holding the q-quantile (None if empty)"""
+        if not self.count:
+            return None
+        for bound, total in self.cumulative():
+            if total >= q * self.count:
+                return bound
+
+class RunMetrics:
+    """Per-run instrumentation: phase wall times and API latency histograms
+    
+    Every Appwrite request of both engines passes through ``timed_call``
+    (InstrumentedClient for the SDK, AsyncAppwriteClient for aiohttp), so
+    latency and errors are recorded per call type in one place. Phases are
+    summed across buckets. Stats and retry counts come from the cleaner
+    when the metrics are exported.
+    """
+    
+    def __init__(self):
+        self.started = time.monotonic()
+        self.phases = {}
+        self.api = {call_type: LatencyHistogram() for call_type in API_CALL_TYPES}
+        self._lock = threading.Lock()
+    
+    def elapsed(self) -> float:
+        return time.monotonic() - self.started
+    
+    def reset(self):
+        """Clear phases and histograms and restart the clock for a new run"""
+        with self._lock:
+            self.started = time.monotonic()
+            self.phases = {}
+            self.api = {call_type: LatencyHistogram() for call_type in API_CALL_TYPES}
+    
+    def add_phase(self, name: str, seconds: float):
+        with self._lock:
+            self.phases[name] = self.phases.get(name, 0.0) + seconds
+    
+    @contextmanager
+    def phase(self, name: str):
+        """Time a block as (part of) the named phase"""
+        started = time.monotonic()
+        try:
+            yield
+        finally:
+            self.add_phase(name, time.monotonic() - started)
+    
+    def observe(self, call_type: str, seconds: float, failed: bool = False):
+        with self._lock:
+            histogram = self.api.get(call_type)
+            if histogram is None:
+                histogram = self.api[call_type] = LatencyHistogram()
+            histogram.observe(seconds)
+            if failed:
+                histogram.errors += 1
+    
+    @contextmanager
+    def timed_call(self, call_type: str):
+        """Time one API request, counting it as an error if it raises"""
+        started = time.monotonic()
+        failed = True
+        try:
+            yield
+            failed = False
+        finally:
+            self.observe(call_type, time.monotonic() - started, failed)
+    
+    def snapshot(self, stats: Dict, bucket_stats: Dict, dry_run: bool, connections: Dict = None) -> Dict:
+        """Everything exported at the end of a run, as plain data"""
+        elapsed = self.elapsed()
+        with self._lock:
+            api = {}
+            for call_type, histogram in self.api.items():
+                api[call_type] = {
+                    'count': histogram.count,
+                    'errors': histogram.errors,
+                    'sum_seconds': round(histogram.sum, 6),
+                    'mean_seconds': round(histogram.sum / histogram.count, 6) if histogram.count else None,
+                    'p50_seconds': histogram.quantile(0.5),
+                    'p95_seconds': histogram.quantile(0.95),
+                    'p99_seconds': histogram.quantile(0.99),
+                    'buckets': {
+                        ('+Inf' if bound == math.inf else str(bound)): total
+                        for bound, total in histogram.cumulative()
+                    }
+                }
+            phases = {name: round(seconds, 6) for name, seconds in self.phases.items()}
+        
+        return {
+            'timestamp': format_timestamp(datetime.now(timezone.utc)),
+            'dry_run': dry_run,
+            'duration_seconds': round(elapsed, 6),
+            'files_per_second': round(stats['scanned'] / elapsed, 3) if elapsed else 0.0,
+            'deletes_per_second': round(stats['deleted'] / elapsed, 3) if elapsed else 0.0,
+            'stats': dict(stats),
+            'buckets': [dict(bucket) for bucket in bucket_stats.values()],
+            'phases': phases,
+            'api': api,
+            'connections': connections or {}
+        }
+    
+    def write_json(self, path: str, stats: Dict, bucket_stats: Dict, dry_run: bool, connections: Dict = None):
+        snapshot = self.snapshot(stats, bucket_stats, dry_run, connections)
+        for histogram in snapshot['api'].values():
+            for key in ('p50_seconds', 'p95_seconds', 'p99_seconds'):
+                if histogram[key] == math.inf:
+                    histogram[key] = '+Inf'
+        write_atomically(path, json.dumps(snapshot, indent=2) + '\n')
+    
+    def write_prometheus(self, path: str, stats: Dict, bucket_stats: Dict, dry_run: bool, connections: Dict = None):
+        """Write a node_exporter textfile-collector file"""
+        snapshot = self.snapshot(stats, bucket_stats, dry_run, connections)
+        p = METRICS_PREFIX
+        lines = []
+        
+        def metric(name: str, kind: str, help_text: str, samples: List):
+            lines.append(f"# HELP {p}_{name} {help_text}")
+            lines.append(f"# TYPE {p}_{name} {kind}")
+            for suffix, labels, value in samples:
+                label_text = ','.join(f'{key}="{val}"' for key, val in labels.items())
+                lines.append(f"{p}_{name}{suffix}{{{label_text}}} {value}" if label_text else f"{p}_{name}{suffix} {value}")
+        
+        metric('last_run_timestamp_seconds', 'gauge', 'Unix time the last run finished',
+               [('', {}, round(time.time(), 3))])
+        metric('dry_run', 'gauge', '1 if the last run was a dry run', [('', {}, int(dry_run))])
+        metric('run_duration_seconds', 'gauge', 'Wall time of the last run',
+               [('', {}, snapshot['duration_seconds'])])
+        metric('phase_duration_seconds', 'gauge', 'Wall time per phase of the last run (summed over buckets)',
+               [('', {'phase': name}, seconds) for name, seconds in sorted(snapshot['phases'].items())])
+        metric('files_scanned', 'gauge', 'Files listed and evaluated', [('', {}, stats['scanned'])])
+        metric('files_deleted', 'gauge', 'Files deleted', [('', {}, stats['deleted'])])
+        metric('bytes_freed', 'gauge', 'Bytes freed by deletions', [('', {}, stats['space_freed'])])
+        metric('delete_errors', 'gauge', 'Deletions that failed after retries', [('', {}, stats['errors'])])
+        metric('retries', 'gauge', 'Retried API calls', [('', {}, stats['retries'])])
+        metric('files_per_second', 'gauge', 'Files evaluated per second of run time',
+               [('', {}, snapshot['files_per_second'])])
+        for key, help_text in [('scanned', 'Files listed and evaluated per bucket'),
+                               ('deleted', 'Files deleted per bucket'),
+                               ('space_freed', 'Bytes freed per bucket'),
+                               ('errors', 'Failed deletions per bucket')]:
+            metric(f'bucket_{key}', 'gauge', help_text,
+                   [('', {'bucket': bucket['bucket']}, bucket[key]) for bucket in snapshot['buckets']])
+        
+        samples = []
+        for call_type, histogram in sorted(snapshot['api'].items()):
+            for bound, total in histogram['buckets'].items():
+                samples.append(('_bucket', {'call': call_type, 'le': bound}, total))
+            samples.append(('_sum', {'call': call_type}, histogram['sum_seconds']))
+            samples.append(('_count', {'call': call_type}, histogram['count']))
+        metric('api_request_duration_seconds', 'histogram', 'Appwrite API request latency by call type', samples)
+        if snapshot['connections']:
+            metric('http_requests', 'gauge', 'HTTP requests sent through the connection pool',
+                   [('', {}, snapshot['connections']['requests'])])
+            metric('http_connections_opened', 'gauge', 'New HTTP connections opened (the rest reused a pooled one)',
+                   [('', {}, snapshot['connections']['new_connections'])])
+            metric('concurrency_limit', 'gauge', 'Adaptive request concurrency limit at the end of the run',
+                   [('', {}, snapshot['connections']['concurrency_limit'])])
+            metric('throttled_responses', 'gauge', 'Requests answered with 429 Too Many Requests',
+                   [('', {}, snapshot['connections']['throttled'])])
+        metric('api_errors', 'gauge', 'Appwrite API requests that raised, by call type',
+               [('', {'call': call_type}, histogram['errors'])
+                for call_type, histogram in sorted(snapshot['api'].items())])
+        
+        write_atomically(path, '\n'.join(lines) + '\n')
+
+def write_atomically(path: str, text: str):
+    """Replace ``path`` in one step so collectors never read a partial file"""
+    directory = os.path.dirname(path)
+    if directory:
+        os.makedirs(directory, exist_ok=True)
+    tmp_path = f"{path}.tmp"
+    with open(tmp_path, 'w', encoding='utf-8') as f:
+        f.write(text)
+    os.replace(tmp_path, path)
+
+class InstrumentedClient(Client):
+    """Appwrite SDK client that reports every request to RunMetrics"""
+    
+    def __init__(self, metrics: RunMetrics):
+        super().__init__()
+        self.metrics = metrics
+    
+    def call(self, method, path='', headers=None, params=None, response_type='json'):
+        with self.metrics.timed_call(api_call_type(method, path)):
+            return super().call(method, path, headers, params, response_type)
+
+class DeletionJournal:
+    """Append-only JSONL record of planned and completed deletions for one bucket
+    
+    A ``plan`` record is written before a file is handed to a delete worker.
+    A ``done`` or ``failed`` record is written once the worker finishes.
+    After a crash, planned files without a ``done`` record are the pending
+    work that ``--resume`` retries. Losing the tail of the journal is
+    harmless: a lost ``plan`` means the file is still listed next run, and
+    a lost ``done`` means the retry finds the file already gone.
+    """
+    
+    def __init__(self, directory: str, bucket_id: str):
+        os.makedirs(directory, exist_ok=True)
+        self.path = os.path.join(directory, f"{bucket_id}.jsonl")
+        self.lock = threading.Lock()
+        self.failures = 0
+        self.file = None
+        self.last_sync = time.monotonic()
+    
+    def load_pending(self) -> List[Dict]:
+        """Files planned for deletion in earlier runs but never confirmed"""
+        planned = {}
+        if not os.path.exists(self.path):
+            return []
+        
+        with open(self.path, encoding='utf-8') as journal:
+            for line in journal:
+                try:
+                    record = json.loads(line)
+                except json.JSONDecodeError:
+                    continue  # Torn final line from a crash
+                
+                if record['op'] == 'plan':
+                    planned[record['id']] = {
+                        '$id': record['id'],
+                        'name': record['name'],
+                        'sizeOriginal': record['size']
+                    }
+                elif record['op'] == 'done':
+                    planned.pop(record['id'], None)
+        
+        return list(planned.values())
+    
+    def open(self, append: bool):
+        """Start writing; a fresh run discards any previous journal"""
+        self.file = open(self.path, 'a' if append else 'w', encoding='utf-8')
+    
+    def _append(self, record: Dict):
+        with self.lock:
+            self.file.write(json.dumps(record) + '\n')
+            self.file.flush()
+            if time.monotonic() - self.last_sync >= JOURNAL_SYNC_INTERVAL:
+                os.fsync(self.file.fileno())
+                self.last_sync = time.monotonic()
+    
+    def plan(self, file: Dict):
+        self._append({'op': 'plan', 'id': file['$id'], 'name': file['name'], 'size': file['sizeOriginal']})
+    
+    def record_result(self, file: Dict, deleted: bool):
+        if deleted:
+            self._append({'op': 'done', 'id': file['$id']})
+        else:
+            self.failures += 1
+            self._append({'op': 'failed', 'id': file['$id']})
+    
+    def close(self) -> int:
+        """Flush the journal; remove it if every planned deletion completed"""
+        with self.lock:
+            os.fsync(self.file.fileno())
+            self.file.close()
+        
+        if self.failures == 0:
+            os.remove(self.path)
+        return self.failures
+
+class DeletionPool:
+    """Bounded worker pool that deletes files from one bucket concurrently
+    
+    At most ``2 * workers`` deletions are queued at a time, so a fast
+    listing applies backpressure instead of buffering the whole bucket.
+    With a single worker deletions run in submission order, exactly like
+    the serial path.
+    """
+    
+    def __init__(self, cleaner: 'AppwriteStorageCleaner', bucket_id: str, journal: DeletionJournal = None):
+        self.cleaner = cleaner
+        self.bucket_id = bucket_id
+        self.journal = journal
+        self.max_in_flight = cleaner.workers * 2
+        self.executor = ThreadPoolExecutor(
+            max_workers=cleaner.workers,
+            thread_name_prefix='delete'
+        )
+        self.in_flight = set()
+        self.started = False
+    
+    def submit(self, file: Dict, resumed: bool = False):
+        """Queue a file for deletion, blocking while the pool is saturated
+        
+        ``resumed`` files come from the journal of an interrupted run. They
+        are already planned there, and finding them gone is not an error.
+        """
+        if not self.started:
+            print("\n🗑️  Deleting files...")
+            self.started = True
+        
+        if len(self.in_flight) >= self.max_in_flight:
+            _, self.in_flight = wait(self.in_flight, return_when=FIRST_COMPLETED)
+        
+        if self.journal and not resumed:
+            self.journal.plan(file)
+        
+        self.in_flight.add(self.executor.submit(contextvars.copy_context().run, self._delete, file, resumed))
+    
+    def _delete(self, file: Dict, resumed: bool):
+        deleted = self.cleaner.delete_file(self.bucket_id, file, missing_ok=resumed)
+        if self.journal:
+            self.journal.record_result(file, deleted)
+    
+    def close(self):
+        """Wait for all queued deletions to finish"""
+        self.executor.shutdown(wait=True)
+        self.in_flight.clear()
+
+class GzipMembers:
+    """Write-only stream compressed into a series of gzip members
+    
+    ``sync`` ends the current member and fsyncs the file, so everything
+    written so far is a complete gzip stream on disk. gzip and tar read
+    concatenated members as one stream, so an archive cut short by a
+    crash still unpacks up to its last sync. Changing ``level`` also starts
+    a new member, which is how already-compressed files are stored
+    uncompressed (level 0) inside the same archive.
+    """
+    
+    def __init__(self, raw, level: int):
+        self.raw = raw
+        self.level = level
+        self.position = 0
+        self._member = None
+    
+    def write(self, data: bytes) -> int:
+        if self._member is None:
+            self._member = gzip.GzipFile(fileobj=self.raw, mode='wb', compresslevel=self.level)
+        self._member.write(data)
+        self.position += len(data)
+        return len(data)
+    
+    def tell(self) -> int:
+        return self.position
+    
+    def set_level(self, level: int):
+        if level != self.level:
+            self._end_member()
+            self.level = level
+    
+    def _end_member(self):
+        if self._member is not None:
+            self._member.close()
+            self._member = None
+    
+    def sync(self):
+        self._end_member()
+        self.raw.flush()
+        os.fsync(self.raw.fileno())
+
+class ArchiveWriter:
+    """Rolling tar.gz archives of one bucket's files, with a JSONL manifest
+    
+    Archives are written to ``directory`` as <timestamp>-<n>.tar.gz, and a
+    new one is started once the current one reaches ``roll_size`` bytes.
+    ``manifest.jsonl`` in the same directory gets one line per archived
+    file: its ID, name, size, SHA-256, and the archive and member holding
+    it. ``commit`` fsyncs both, and only committed entries may be deleted
+    from the bucket.
+    """
+    
+    def __init__(self, directory: str, roll_size: int = ARCHIVE_ROLL_SIZE):
+        os.makedirs(directory, exist_ok=True)
+        self.directory = directory
+        self.roll_size = roll_size
+        self.stamp = datetime.now(timezone.utc).strftime('%Y%m%dT%H%M%SZ')
+        self.sequence = 0
+        self.archived = 0
+        self.tar = None
+        self.manifest = open(os.path.join(directory, 'manifest.jsonl'), 'a', encoding='utf-8')
+    
+    def _open_archive(self):
+        self.sequence += 1
+        self.path = os.path.join(self.directory, f"{self.stamp}-{self.sequence:03d}.tar.gz")
+        self.raw = open(self.path, 'xb')
+        self.stream = GzipMembers(self.raw, ARCHIVE_COMPRESS_LEVEL)
+        self.tar = tarfile.open(fileobj=self.stream, mode='w', format=tarfile.PAX_FORMAT, copybufsize=DOWNLOAD_CHUNK_SIZE)
+    
+    def add(self, file: Dict, content, sha256: str):
+        """Append a downloaded file (a seekable file object) to the current archive"""
+        if self.tar is None:
+            self._open_archive()
+        
+        info = tarfile.TarInfo(f"{file['$id']}/{file['name'].replace('/', '_')}")
+        info.size = content.seek(0, os.SEEK_END)
+        info.mtime = parse_timestamp(file['$createdAt']).timestamp()
+        content.seek(0)
+        stored = (file.get('mimeType') or '').startswith(ARCHIVE_STORED_TYPES)
+        self.stream.set_level(0 if stored else ARCHIVE_COMPRESS_LEVEL)
+        self.tar.addfile(info, content)
+        
+        self.manifest.write(json.dumps({
+            'file_id': file['$id'],
+            'name': file['name'],
+            'size': info.size,
+            'sha256': sha256,
+            'mime_type': file.get('mimeType'),
+            'created_at': file['$createdAt'],
+            'archive': os.path.basename(self.path),
+            'member': info.name,
+            'archived_at': format_timestamp(datetime.now(timezone.utc))
+        }) + '\n')
+        self.archived += 1
+    
+    def commit(self):
+        """Make every added entry durable, rolling over to a new archive if needed"""
+        if self.tar is None:
+            return
+        self.stream.sync()
+        self.manifest.flush()
+        os.fsync(self.manifest.fileno())
+        if self.raw.tell() >= self.roll_size:
+            self._close_archive()
+    
+    def _close_archive(self):
+        self.tar.close()  # Writes the end-of-archive blocks
+        self.stream.sync()
+        self.raw.close()
+        self.tar = None
+    
+    def close(self):
+        if self.tar is not None:
+            self._close_archive()
+        self.manifest.close()
+
+class ArchivePipeline:
+    """Archive-then-delete stage that stands in for DeletionPool
+    
+    Candidates are downloaded by ``workers`` threads into spool files
+    (held in memory only up to ARCHIVE_SPOOL_MEMORY), appended to the
+    bucket's ArchiveWriter by one writer thread, and handed to a
+    DeletionPool only after the batch holding their entries has been
+    committed. Downloads, compression and deletes overlap. Every stage is
+    bounded, so the slowest one sets the pace. If archiving fails, no
+    further files are deleted.
+    """
+    
+    def __init__(self, cleaner: 'AppwriteStorageCleaner', bucket_id: str, journal: DeletionJournal, archive: ArchiveWriter):
+        self.cleaner = cleaner
+        self.bucket_id = bucket_id
+        self.journal = journal
+        self.archive = archive
+        self.deleter = DeletionPool(cleaner, bucket_id, journal)
+        self.max_in_flight = cleaner.workers * 2
+        self.downloads = ThreadPoolExecutor(
+            max_workers=cleaner.workers,
+            thread_name_prefix='archive'
+        )
+        self.in_flight = set()
+        self.ready = queue.Queue(maxsize=cleaner.workers * 2)
+        self.error = None
+        self.started = False
+        self.writer = threading.Thread(
+            target=contextvars.copy_context().run,
+            args=(self._write,),
+            name='archive-writer',
+            daemon=True
+        )
+        self.writer.start()
+    
+    def submit(self, file: Dict, resumed: bool = False):
+        """Queue a file for archiving and deletion, blocking while the pipeline is saturated
+        
+        ``resumed`` files were archived by the interrupted run that planned
+        them, so they go straight to deletion.
+        """
+        if resumed:
+            self.ready.put((file, None, None))
+            return
+        
+        if not self.started:
+            print(f"\n🗄️  Archiving to {self.archive.directory} before deleting...")
+            self.started = True
+        
+        if self.error:
+            self.cleaner.record_archive_error(self.bucket_id, file, self.error)
+            return
+        
+        if len(self.in_flight) >= self.max_in_flight:
+            _, self.in_flight = wait(self.in_flight, return_when=FIRST_COMPLETED)
+        self.in_flight.add(self.downloads.submit(contextvars.copy_context().run, self._download, file))
+    
+    def _download(self, file: Dict):
+        spool = tempfile.SpooledTemporaryFile(max_size=ARCHIVE_SPOOL_MEMORY)
+        try:
+            sha256 = self.cleaner.hash_file(self.bucket_id, file['$id'], spool)
+        except Exception as e:
+            spool.close()
+            self.cleaner.record_archive_error(self.bucket_id, file, e)
+            return
+        self.ready.put((file, spool, sha256))
+    
+    def _write(self):
+        """Writer thread: archive whatever has been downloaded, commit, then delete"""
+        while True:
+            batch = [self.ready.get()]
+            while batch[-1] is not None and len(batch) < ARCHIVE_BATCH_SIZE:
+                try:
+                    batch.append(self.ready.get_nowait())
+                except queue.Empty:
+                    break
+            
+            items = [item for item in batch if item is not None]
+            try:
+                if self.error is None:
+                    self._archive(items)
+                else:
+                    for file, spool, _ in items:
+                        if spool is not None:
+                            self.cleaner.record_archive_error(self.bucket_id, file, self.error)
+            finally:
+                for _, spool, _ in items:
+                    if spool is not None:
+                        spool.close()
+            
+            if batch[-1] is None:
+                return
+    
+    def _archive(self, items: List):
+        try:
+            for file, spool, sha256 in items:
+                if spool is not None:
+                    self.archive.add(file, spool, sha256)
+            self.archive.commit()
+        except Exception as e:
+            self.error = e
+            print(f"❌ Archiving failed, no further files will be deleted: {e}")
+            for file, spool, _ in items:
+                if spool is not None:
+                    self.cleaner.record_archive_error(self.bucket_id, file, e)
+            items = [item for item in items if item[1] is None]
+        
+        for file, spool, _ in items:
+            self.deleter.submit(file, resumed=spool is None)
+    
+    def close(self):
+        """Wait for every queued file to be archived and deleted"""
+        wait(self.in_flight)
+        self.downloads.shutdown(wait=True)
+        self.ready.put(None)
+        self.writer.join()
+        self.deleter.close()
+        self.archive.close()
+        if self.archive.archived:
+            print(f"🗄️  Archived {self.archive.archived} files to {self.archive.directory}")
+
+class RoundRobinWaiters:
+    """Waiters queued per key, served one key at a time in rotation"""
+    
+    def __init__(self):
+        self._waiting = {}
+        self._rotation = deque()
+    
+    def __bool__(self) -> bool:
+        return bool(self._rotation)
+    
+    def append(self, key: str, waiter):
+        if key not in self._waiting:
+            self._waiting[key] = deque()
+            self._rotation.append(key)
+        self._waiting[key].append(waiter)
+    
+    def pop(self):
+        """First waiter of the next key in rotation, or None if nobody waits"""
+        if not self._rotation:
+            return None
+        key = self._rotation.popleft()
+        waiters = self._waiting[key]
+        waiter = waiters.popleft()
+        if waiters:
+            self._rotation.append(key)
+        else:
+            del self._waiting[key]
+        return waiter
+
+class FairLimiter:
+    """Global cap on in-flight API requests, shared round-robin between keys
+    
+    Requests are keyed by bucket and call type. Once the limit is reached,
+    a finished request hands its slot to the next waiting key in rotation
+    rather than to whoever asked first, so a huge bucket flooding the pool
+    with deletions cannot starve another bucket's listing or deletions.
+    """
+    
+    def __init__(self, limit: int):
+        self.limit = max(1, limit)
+        self.in_flight = 0
+        self._waiters = RoundRobinWaiters()
+        self._cond = threading.Condition()
+    
+    @contextmanager
+    def slot(self, key: str):
+        with self._cond:
+            if self.in_flight < self.limit and not self._waiters:
+                self.in_flight += 1
+            else:
+                ticket = [False]
+                self._waiters.append(key, ticket)
+                while not ticket[0]:
+                    self._cond.wait()
+        try:
+            yield
+        finally:
+            with self._cond:
+                ticket = self._waiters.pop()
+                if ticket is None:
+                    self.in_flight -= 1
+                else:
+                    ticket[0] = True
+                    self._cond.notify_all()
+
+class AsyncFairLimiter:
+    """FairLimiter for the asyncio engine (waiters are futures, not threads)"""
+    
+    def __init__(self, limit: int):
+        self.limit = max(1, limit)
+        self.in_flight = 0
+        self._waiters = RoundRobinWaiters()
+    
+    @asynccontextmanager
+    async def slot(self, key: str):
+        if self.in_flight < self.limit and not self._waiters:
+            self.in_flight += 1
+        else:
+            waiter = asyncio.get_running_loop().create_future()
+            self._waiters.append(key, waiter)
+            try:
+                await waiter
+            except asyncio.CancelledError:
+                # The slot may have been handed over just before cancellation
+                if waiter.done() and not waiter.cancelled():
+                    self._release()
+                raise
+        try:
+            yield
+        finally:
+            self._release()
+    
+    def _release(self):
+        while (waiter := self._waiters.pop()) is not None:
+            if not waiter.done():
+                waiter.set_result(None)
+                return
+        self.in_flight -= 1
+
+class PrefixedOutput:
+    """stdout wrapper that tags each line with the current OUTPUT_PREFIX
+    
+    Partial writes are buffered per thread until the line is complete,
+    so lines from buckets cleaned concurrently never interleave.
+    """
+    
+    def __init__(self, stream):
+        self.stream = stream
+        self._partial = {}
+        self._lock = threading.Lock()
+    
+    def write(self, text: str) -> int:
+        key = threading.get_ident()
+        *lines, rest = (self._partial.pop(key, '') + text).split('\n')
+        if rest:
+            self._partial[key] = rest
+        if lines:
+            prefix = OUTPUT_PREFIX.get()
+            with self._lock:
+                self.stream.write(''.join(f"{prefix}{line}\n" if line else "\n" for line in lines))
+        return len(text)
+    
+    def flush(self):
+        self.stream.flush()
+    
+    def __getattr__(self, name):
+        return getattr(self.stream, name)
+
+@contextmanager
+def run_lock(path: str):
+    """Hold an exclusive lock on ``path`` for the duration of a run
+    
+    Yields True once the lock is held, or False straight away if another
+    process holds it, so an overlapping run can be skipped instead of
+    piling up. An empty path disables locking.
+    """
+    if not path or fcntl is None:
+        yield True
+        return
+    
+    os.makedirs(os.path.dirname(os.path.abspath(path)), exist_ok=True)
+    with open(path, 'a+') as handle:
+        try:
+            fcntl.flock(handle, fcntl.LOCK_EX | fcntl.LOCK_NB)
+        except BlockingIOError:
+            acquired = False
+        else:
+            acquired = True
+            handle.seek(0)
+            handle.truncate()
+            handle.write(f"{os.getpid()}\n")
+            handle.flush()
+        
+        try:
+            yield acquired
+        finally:
+            if acquired:
+                fcntl.flock(handle, fcntl.LOCK_UN)
+
+@contextmanager
+def prefixed_output():
+    """Route stdout through PrefixedOutput for the duration of a parallel run"""
+    original = sys.stdout
+    sys.stdout = PrefixedOutput(original)
+    try:
+        yield
+    finally:
+        sys.stdout = original
+
 class AppwriteStorageCleaner:
-    def __init__(self, dry_run: bool = True):
-        """Initialize Appwrite Storage Cleaner"""
+    def __init__(
+        self,
+        dry_run: bool = True,
+        workers: int = DEFAULT_WORKERS,
+        ref_cache: 'ReferenceCache' = None,
+        ref_index: str = 'set',
+        journal_dir: str = DEFAULT_JOURNAL_DIR,
+        resume: bool = False,
+        rules_config: Dict = None,
+        report: CleanupReport = None,
+        pool_size: int = None,
+        cache_listings: bool = False,
+        listing_cache_limit: int = LISTING_CACHE_LIMIT,
+        relist_hours: float = DEFAULT_RECONCILE_HOURS,
+        hash_cache: str = DEFAULT_HASH_CACHE,
+        archive_dir: str = None,
+        archive_roll_size: int = ARCHIVE_ROLL_SIZE
+    ):
+        """Initialize Appwrite Storage Cleaner
+        
+        ``cache_listings`` keeps each bucket's complete listing in memory
+        so later passes in the same process (see run-storage-cleaner.py)
+        reuse it instead of listing the bucket again, unless the bucket has
+        more than ``listing_cache_limit`` files. Cached listings are
+        listed in full again after ``relist_hours``. ``hash_cache`` is the
+        SQLite file that keeps content hashes for dedup_buckets between
+        runs (None or empty to hash from scratch every time). With
+        ``archive_dir`` every file is downloaded into a rolling tar.gz
+        archive there before it is deleted (see ArchivePipeline).
+        """
         self.dry_run = dry_run
+        self.workers = max(1, workers)
+        self.ref_cache = ref_cache
+        self.ref_index = ref_index
+        self.journal_dir = journal_dir
+        self.resume = resume
+        self.rules_config = rules_config or {}
+        self.report = report
+        self.metrics = RunMetrics()
+        # One keep-alive pool for every SDK request: deletes/listing under
+        # the limiter plus the concurrent reference scans
+        self.transport = PooledTransport(
+            pool_size or self.workers + len(REFERENCE_SOURCES),
+            endpoint=APPWRITE_ENDPOINT
+        )
+        self.transport.install()
         self.stats = {
             'scanned': 0,
+            'candidates': 0,
             'deleted': 0,
             'errors': 0,
-            'space_freed': 0
+            'space_freed': 0,
+            'retries': 0
         }
+        self.bucket_stats = {}
+        self._stats_lock = threading.Lock()
+        self.limiter = FairLimiter(self.workers)
+        self._referenced_ids = None
+        self._references_lock = threading.Lock()
+        self.listings = {} if cache_listings else None
+        self.listing_cache_limit = listing_cache_limit
+        self._streamed_buckets = {}
+        self.relist_interval = timedelta(hours=relist_hours)
+        self.hash_cache = hash_cache
+        self.archive_dir = archive_dir
+        self.archive_roll_size = archive_roll_size
+        self.run_number = 1
+        self._partial_listings = {}
         
         # Validate configuration
         if not APPWRITE_PROJECT_ID:
@@ -74,7 +2051,7 @@ class AppwriteStorageCleaner:
             raise ValueError("APPWRITE_API_KEY not found in environment (use server API key)")
         
         # Initialize Appwrite client
-        self.client = Client()
+        self.client = InstrumentedClient(self.metrics)
         self.client.set_endpoint(APPWRITE_ENDPOINT)
         self.client.set_project(APPWRITE_PROJECT_ID)
         self.client.set_key(APPWRITE_API_KEY)
@@ -84,219 +2061,800 @@ class AppwriteStorageCleaner:
         
         print(f"🔧 Initialized Appwrite Storage Cleaner")
         print(f"📊 Mode: {'DRY RUN (no files will be deleted)' if dry_run else 'LIVE (files will be deleted)'}")
+        if not dry_run:
+            print(f"⚙️  Delete workers: {self.workers}")
+        if archive_dir:
+            print(f"🗄️  Archive before delete: {archive_dir}")
+        print(f"🔌 Connection pool: {self.transport.pool_size}")
         print(f"🌐 Endpoint: {APPWRITE_ENDPOINT}")
         print(f"📦 Project: {APPWRITE_PROJECT_ID}")
+        if report:
+            print(f"📝 Report: {report.path} ({report.format})")
         print()
     
-    def get_bucket_files(self, bucket_id: str, limit: int = 100) -> List[Dict]:
-        """Get all files from a storage bucket"""
-        files = []
-        offset = 0
+    def get_bucket_files(self, bucket_id: str, limit: int = 100, created_before: str = None) -> Iterator[Dict]:
+        """Stream all files from a storage bucket using cursor pagination
         
-        while True:
-            try:
-                result = self.storage.list_files(
-                    bucket_id=bucket_id,
-                    queries=[
-                        Query.limit(limit),
-                        Query.offset(offset)
-                    ]
-                )
-                
-                batch = result['files']
-                files.extend(batch)
-                
-                if len(batch) < limit:
-                    break
-                    
-                offset += limit
-                
-            except Exception as e:
-                print(f"❌ Error fetching files from bucket {bucket_id}: {e}")
-                break
+        Files are yielded as pages arrive, so memory stays at roughly two
+        pages regardless of bucket size. The next page is always requested
+        before the current one is handed out: the cursor file (last of a
+        page) has been used by the time the caller sees it, which makes it
+        safe to delete yielded files while listing is still going.
+        ``created_before`` pushes an age filter down to the server.
+        """
+        if self.listings is not None:
+            return self._cached_bucket_files(bucket_id, limit, created_before)
+        return self._stream_bucket_files(bucket_id, limit, created_before)
+    
+    def _stream_bucket_files(
+        self,
+        bucket_id: str,
+        limit: int,
+        created_before: str = None,
+        created_after: str = None
+    ) -> Iterator[Dict]:
+        page = self._list_files_page(bucket_id, limit, created_before=created_before, created_after=created_after)
         
-        return files
+        while page:
+            next_page = []
+            if len(page) == limit:
+                next_page = self._list_files_page(
+                    bucket_id, limit, cursor=page[-1]['$id'],
+                    created_before=created_before, created_after=created_after
+                )
+            
+            yield from page
+            page = next_page
     
-    def get_referenced_file_ids(self) -> Set[str]:
-        """Get all file IDs referenced in database documents"""
-        referenced_ids = set()
+    def _cached_bucket_files(self, bucket_id: str, limit: int, created_before: str = None) -> Iterator[Dict]:
+        """Serve a bucket listing from the listing cache, filling it if needed
+        
+        Cached files are filtered by age locally, which matches the server
+        filter because both compare the fixed-width $createdAt strings. A
+        server-filtered listing is partial, so it is streamed but not cached.
+        Files deleted by any pass are dropped from the cache. In a later
+        run (see begin_run) the cached listing is first brought up to date,
+        or listed again in full once it is older than the relist interval.
+        A bucket with more than listing_cache_limit files, whether on the
+        first listing or after a refresh, is streamed instead and only
+        tried for caching again after the relist interval.
+        """
+        streamed_since = self._streamed_buckets.get(bucket_id)
+        if streamed_since is not None:
+            if datetime.now(timezone.utc) - streamed_since < self.relist_interval:
+                yield from self._stream_bucket_files(bucket_id, limit, created_before)
+                return
+            del self._streamed_buckets[bucket_id]
         
-        # Check bookings collection for payment proof file IDs
+        cached = self.listings.get(bucket_id)
+        if cached is not None and cached.run != self.run_number:
+            if cached.is_expired(self.relist_interval):
+                del self.listings[bucket_id]
+                cached = None
+            else:
+                try:
+                    self._refresh_listing(bucket_id, cached, limit)
+                except ListingError:
+                    del self.listings[bucket_id]
+                    raise
+                if len(cached) > self.listing_cache_limit:
+                    self._stop_caching(bucket_id)
+                    del self.listings[bucket_id]
+                    yield from self._stream_bucket_files(bucket_id, limit, created_before)
+                    return
+        
+        if cached is not None:
+            print(f"♻️  Reusing listing of {len(cached)} files")
+            for file in cached.snapshot():
+                if created_before is None or file['$createdAt'] < created_before:
+                    yield file
+            return
+        
+        if created_before:
+            yield from self._stream_bucket_files(bucket_id, limit, created_before)
+            return
+        
+        listing = self._partial_listings[bucket_id] = BucketListing(self.run_number)
         try:
-            bookings = self.databases.list_documents(
-                database_id=DATABASE_ID,
-                collection_id=COLLECTIONS['bookings'],
-                queries=[Query.limit(1000)]
-            )
-            
-            for booking in bookings['documents']:
-                if 'paymentProofFileId' in booking and booking['paymentProofFileId']:
-                    referenced_ids.add(booking['paymentProofFileId'])
-                    
-            print(f"✅ Found {len(referenced_ids)} referenced files in bookings")
+            for file in self._stream_bucket_files(bucket_id, limit):
+                if listing is not None:
+                    listing.add(file)
+                    if len(listing) > self.listing_cache_limit:
+                        self._stop_caching(bucket_id)
+                        listing = None
+                        del self._partial_listings[bucket_id]
+                yield file
             
-        except Exception as e:
-            print(f"⚠️  Warning: Could not check bookings: {e}")
+            if listing is not None:
+                self.listings[bucket_id] = listing
+        finally:
+            self._partial_listings.pop(bucket_id, None)
+    
+    def _stop_caching(self, bucket_id: str):
+        """Stream a bucket that outgrew the listing cache until the next relist"""
+        print(f"📭 More than {self.listing_cache_limit} files; streaming this bucket instead of caching its listing")
+        self._streamed_buckets[bucket_id] = datetime.now(timezone.utc)
+    
+    def cached_listing_size(self) -> tuple:
+        """(files, buckets) currently held in the listing cache"""
+        if self.listings is None:
+            return 0, 0
+        return sum(len(listing) for listing in self.listings.values()), len(self.listings)
+    
+    def _refresh_listing(self, bucket_id: str, listing: 'BucketListing', limit: int):
+        """Add files created since the listing was last synced"""
+        since = listing.since()
+        synced_at = datetime.now(timezone.utc)
+        added = 0
+        for file in self._stream_bucket_files(bucket_id, limit, created_after=since):
+            added += listing.add(file)
+        
+        listing.mark_synced(synced_at, self.run_number)
+        print(f"🔄 Listing refreshed: {added} new files since {since}")
+    
+    def forget_listed(self, bucket_id: str, file: Dict):
+        """Drop a deleted file from the listing cache"""
+        if self.listings is None:
+            return
+        for listing in (self.listings.get(bucket_id), self._partial_listings.get(bucket_id)):
+            if listing:
+                listing.discard(file['$id'])
+    
+    def _list_files_page(
+        self,
+        bucket_id: str,
+        limit: int,
+        cursor: str = None,
+        created_before: str = None,
+        created_after: str = None
+    ) -> List[Dict]:
+        """Fetch a single page of files after the given cursor
+        
+        Transient errors are retried. A page that still cannot be fetched
+        raises ListingError, because ending the listing early would pass
+        a partial bucket off as the whole one.
+        """
+        def fetch():
+            with self.limiter.slot(f"{bucket_id}/list"):
+                return self.storage.list_files(
+                    bucket_id=bucket_id,
+                    queries=file_list_queries(limit, cursor, created_before, created_after)
+                )
         
-        # Check chat messages for file attachments
         try:
-            messages = self.databases.list_documents(
-                database_id=DATABASE_ID,
-                collection_id=COLLECTIONS['chat_messages'],
-                queries=[Query.limit(1000)]
-            )
-            
-            chat_files = 0
-            for message in messages['documents']:
-                if 'fileId' in message and message['fileId']:
-                    referenced_ids.add(message['fileId'])
-                    chat_files += 1
-                    
-            print(f"✅ Found {chat_files} referenced files in chat messages")
-            
+            return call_with_retries(fetch, self.record_retry)['files']
         except Exception as e:
-            print(f"⚠️  Warning: Could not check chat messages: {e}")
+            print(f"❌ Error fetching files from bucket {bucket_id}: {e}")
+            raise ListingError(f"Listing bucket {bucket_id} failed: {e}") from e
+    
+    def get_referenced_file_ids(self, refresh: bool = False) -> ReferenceSnapshot:
+        """Get all file IDs referenced in database documents
         
-        # Check therapists for profile images
-        try:
-            therapists = self.databases.list_documents(
-                database_id=DATABASE_ID,
-                collection_id=COLLECTIONS['therapists'],
-                queries=[Query.limit(100)]
-            )
+        Every reference collection is paginated to the end, fetching only
+        the file ID field, and the collections are scanned concurrently.
+        The index is built once per run and shared by all buckets; with a
+        ReferenceCache only documents changed since the last run are
+        fetched. If any collection cannot be read completely a
+        ReferenceIndexError is raised rather than returning a partial
+        index, because files missing from the index would be treated as
+        orphans.
+        
+        A shared snapshot can be older than a listing by a whole run
+        (buckets cleaned concurrently, later presets), so reuse is only
+        safe through its cutoff: every consumer classifies orphans with
+        ReferenceSnapshot.is_orphaned, which never counts files created
+        after the scan started.
+        """
+        with self._references_lock:
+            if self._referenced_ids is not None and not refresh:
+                print(f"♻️  Reusing reference index ({len(self._referenced_ids)} file IDs, "
+                      f"orphans only before {self._referenced_ids.cutoff})")
+                return self._referenced_ids
             
-            profile_images = 0
-            for therapist in therapists['documents']:
-                if 'imageFileId' in therapist and therapist['imageFileId']:
-                    referenced_ids.add(therapist['imageFileId'])
-                    profile_images += 1
-                    
-            print(f"✅ Found {profile_images} referenced files in therapist profiles")
+            self._referenced_ids = self._build_reference_index()
+            return self._referenced_ids
+    
+    def _build_reference_index(self) -> ReferenceSnapshot:
+        """Scan (or sync from the cache) every reference source and merge them"""
+        started = time.monotonic()
+        with ThreadPoolExecutor(max_workers=len(REFERENCE_SOURCES), thread_name_prefix='refs') as executor:
+            if self.ref_cache:
+                futures = [
+                    executor.submit(
+                        self.ref_cache.sync_source, self.databases, collection, field, label,
+                        make_id_builder(self.ref_index)
+                    )
+                    for collection, field, label in REFERENCE_SOURCES
+                ]
+            else:
+                futures = [
+                    executor.submit(self._scan_reference_source, collection, field)
+                    for collection, field, _ in REFERENCE_SOURCES
+                ]
+            results = [future.exception() or future.result() for future in futures]
+        
+        index = self._snapshot(self._merge_references(results), started)
+        self.metrics.add_phase('references', time.monotonic() - started)
+        return index
+    
+    def _snapshot(self, ids, started: float) -> ReferenceSnapshot:
+        """Wrap a merged index with the cutoff of a scan that began at ``started``
+        
+        The server clock is read after the scan, when responses have
+        certainly carried a Date header, and projected back to the start.
+        """
+        cutoff = format_timestamp(self.transport.server_time(started) - REFERENCE_SYNC_OVERLAP)
+        print(f"🕒 Only files created before {cutoff} can count as orphaned")
+        return ReferenceSnapshot(ids, cutoff)
+    
+    def _scan_reference_source(self, collection: str, field: str):
+        """Collect every non-empty ``field`` value from a collection"""
+        file_ids = make_id_builder(self.ref_index)
+        cursor = None
+        
+        while True:
+            result = call_with_retries(lambda: self.databases.list_documents(
+                database_id=DATABASE_ID,
+                collection_id=COLLECTIONS[collection],
+                queries=reference_queries(field, cursor)
+            ), self.record_retry)
+            documents = result['documents']
+            file_ids.update(document[field] for document in documents if document.get(field))
             
-        except Exception as e:
-            print(f"⚠️  Warning: Could not check therapists: {e}")
+            if len(documents) < REFERENCE_PAGE_SIZE:
+                return file_ids.build()
+            cursor = documents[-1]['$id']
+    
+    def _merge_references(self, results: List):
+        """Combine per-source scan results, failing if any source errored"""
+        failed = []
         
+        for (collection, field, label), result in zip(REFERENCE_SOURCES, results):
+            if isinstance(result, Exception):
+                print(f"⚠️  Warning: Could not check {label}: {result}")
+                failed.append(label)
+                continue
+            print(f"✅ Found {len(result)} referenced files in {label}")
+        
+        if failed:
+            raise ReferenceIndexError(
+                f"Reference index incomplete ({', '.join(failed)}); refusing to treat files as orphaned"
+            )
+        
+        referenced_ids = combine_references(self.ref_index, results)
+        if self.ref_index == 'set':
+            print(f"📇 Reference index: {len(referenced_ids)} file IDs")
+        else:
+            size_mb = referenced_ids.nbytes / (1024 * 1024)
+            print(f"📇 Reference index: {len(referenced_ids)} file IDs ({self.ref_index}, {size_mb:.2f} MB)")
         return referenced_ids
     
-    def is_file_old(self, file: Dict, days_threshold: int) -> bool:
-        """Check if file is older than threshold"""
+    def clean_bucket(
+        self,
+        bucket_id: str,
+        bucket_name: str,
+        days_old: int = None,
+        orphaned_only: bool = False,
+        remove_temp: bool = True
+    ):
+        """Clean files from a storage bucket"""
+        self.print_bucket_header(bucket_id, bucket_name)
+        
+        policy = self.build_policy(bucket_name, days_old, orphaned_only, remove_temp)
+        if not policy.enabled:
+            return
+        
+        # Get referenced files if checking for orphans (shared by all buckets)
+        if policy.needs_references:
+            print("\n🔍 Checking for orphaned files...")
+            policy.references = self.get_referenced_file_ids()
+        
+        created_before = self.prepare_age_filter(policy)
+        
+        # Stream files and evaluate each one as it arrives; deletions are
+        # handed to the worker pool so they start before listing has finished
+        scan = BucketScan(server_filtered=created_before is not None)
+        journal, pending = self.open_journal(bucket_id)
+        resumed_ids = {file['$id'] for file in pending}
+        deleter = None if self.dry_run else self.open_deleter(bucket_id, journal)
+        
         try:
-            # Parse created date (ISO 8601 format: 2026-01-15T10:30:00.000+00:00)
-            created_at = datetime.fromisoformat(file['$createdAt'].replace('Z', '+00:00'))
-            threshold_date = datetime.now(created_at.tzinfo) - timedelta(days=days_threshold)
-            return created_at < threshold_date
-        except Exception as e:
-            print(f"⚠️  Could not parse date for file {file['$id']}: {e}")
-            return False
+            for file in pending:
+                deleter.submit(file, resumed=True)
+            
+            started = time.monotonic()
+            for file in self.get_bucket_files(bucket_id, created_before=created_before):
+                scan.scanned += 1
+                if file['$id'] in resumed_ids:
+                    continue
+                
+                if not policy.matches(file):
+                    if self.report:
+                        self.report.file(bucket_id, file, 'keep')
+                    continue
+                
+                reasons = policy.reasons(file)
+                scan.add_candidate(file, reasons)
+                if self.report:
+                    self.report.file(bucket_id, file, 'delete' if deleter else 'would_delete', reasons)
+                if deleter:
+                    deleter.submit(file)
+            self.metrics.add_phase('scan', time.monotonic() - started)
+        finally:
+            if deleter:
+                with self.metrics.phase('delete_drain'):
+                    deleter.close()
+            self.close_journal(journal)
+            self.count(bucket_id, scanned=scan.scanned, candidates=scan.to_delete)
+            if self.report:
+                self.report.flush()
+        
+        scan.print_report(self.dry_run)
     
-    def is_temp_file(self, file: Dict) -> bool:
-        """Check if file is a temporary/test file"""
-        name = file.get('name', '').lower()
-        temp_patterns = ['test', 'temp', 'tmp', 'debug', 'demo', 'sample']
-        return any(pattern in name for pattern in temp_patterns)
+    def shrink_bucket(self, bucket_id: str, bucket_name: str, target_size: int, evict_referenced: bool = False):
+        """Delete the fewest files that bring a bucket under ``target_size`` bytes
+        
+        A first listing pass only adds up the bucket's size. The second
+        pass feeds the files into an EvictionQueue, which keeps just the
+        deletion set: orphaned files first, then the oldest, then the
+        largest. Only orphans are offered unless ``evict_referenced`` is
+        set, so by default the bucket may stay over its target and the
+        shortfall is reported; deleting a referenced file would leave a
+        broken link in the database. Files created after the reference
+        snapshot's cutoff count as referenced.
+        """
+        self.print_bucket_header(bucket_id, bucket_name)
+        print(f"\n🎯 Target size: {target_size / (1024 * 1024):.2f} MB")
+        
+        print("\n🔍 Checking for orphaned files...")
+        references = self.get_referenced_file_ids()
+        
+        journal, pending = self.open_journal(bucket_id)
+        resumed_ids = {file['$id'] for file in pending}
+        deleter = None if self.dry_run else self.open_deleter(bucket_id, journal)
+        scan = BucketScan()
+        
+        try:
+            for file in pending:
+                deleter.submit(file, resumed=True)
+            
+            with self.metrics.phase('scan'):
+                total_size = sum(
+                    file['sizeOriginal'] for file in self.get_bucket_files(bucket_id)
+                    if file['$id'] not in resumed_ids
+                )
+                print(f"\n📦 Bucket size: {total_size / (1024 * 1024):.2f} MB")
+                
+                eviction = EvictionQueue(total_size - target_size)
+                for file in self.get_bucket_files(bucket_id):
+                    scan.scanned += 1
+                    if file['$id'] in resumed_ids:
+                        continue
+                    orphaned = references.is_orphaned(file)
+                    if orphaned or evict_referenced:
+                        eviction.offer(file, orphaned)
+            
+            for file, orphaned in eviction.files():
+                reasons = ["over target size", "orphaned" if orphaned else "referenced"]
+                scan.add_candidate(file, reasons)
+                if self.report:
+                    self.report.file(bucket_id, file, 'delete' if deleter else 'would_delete', reasons)
+                if deleter:
+                    deleter.submit(file)
+        finally:
+            if deleter:
+                with self.metrics.phase('delete_drain'):
+                    deleter.close()
+            self.close_journal(journal)
+            self.count(bucket_id, scanned=scan.scanned, candidates=scan.to_delete)
+            if self.report:
+                self.report.flush()
+        
+        scan.print_report(self.dry_run)
+        if scan.scanned:
+            remaining = total_size - scan.total_size
+            print(f"📉 Size after cleanup: {remaining / (1024 * 1024):.2f} MB "
+                  f"(target {target_size / (1024 * 1024):.2f} MB)")
+            if remaining > target_size:
+                print(f"⚠️  Still {(remaining - target_size) / (1024 * 1024):.2f} MB over target after every orphan; "
+                      f"referenced files are kept (use --evict-referenced to delete them too)")
     
-    def clean_bucket(
+    def build_policy(
         self,
-        bucket_id: str,
         bucket_name: str,
         days_old: int = None,
         orphaned_only: bool = False,
         remove_temp: bool = True
-    ):
-        """Clean files from a storage bucket"""
+    ) -> CleanupPolicy:
+        """Compile the cleanup rules for one bucket pass
+        
+        Rules are layered: built-in defaults, the global --rules block, the
+        bucket's overrides, then command-line flags. The age cutoff is
+        computed here, so it is fresh for every pass.
+        """
+        rules = {'temp_files': True}
+        rules.update(self.rules_config.get('rules', {}))
+        rules.update(self.rules_config.get('buckets', {}).get(bucket_name, {}))
+        if days_old:
+            rules['max_age_days'] = days_old
+        if orphaned_only:
+            rules['orphaned'] = True
+        if not remove_temp:
+            rules['temp_files'] = False
+        
+        policy = CleanupPolicy(rules)
+        print(f"\n📐 Rules: {policy.describe()}")
+        if not policy.enabled:
+            print("✅ No cleanup rules enabled for this bucket")
+        return policy
+    
+    def prepare_age_filter(self, policy: CleanupPolicy):
+        """Decide on server-side filtering for this pass
+        
+        When age is the only rule, the listing itself can be limited to
+        old files. Returns the $createdAt cutoff to push down, or None when
+        every file has to be listed for the other checks.
+        """
+        if not policy.age_only:
+            return None
+        
+        print(f"\n⏬ Server-side filter: $createdAt < {policy.created_before}")
+        return policy.created_before
+    
+    def open_journal(self, bucket_id: str):
+        """Start the deletion journal for a live pass
+        
+        Returns the journal (None in dry-run mode or when journaling is
+        off) and, with --resume, the files still pending from the previous
+        run.
+        """
+        if self.dry_run or not self.journal_dir:
+            return None, []
+        
+        journal = DeletionJournal(self.journal_dir, bucket_id)
+        pending = journal.load_pending() if self.resume else []
+        
+        if pending:
+            print(f"\n📒 Resuming {len(pending)} pending deletions from {journal.path}")
+        elif not self.resume and os.path.exists(journal.path):
+            print(f"\n📒 Discarding journal from an earlier run ({journal.path}); use --resume to retry it")
+        
+        journal.open(append=self.resume)
+        return journal, pending
+    
+    def open_deleter(self, bucket_id: str, journal: DeletionJournal = None):
+        """Deletion stage for a live pass: plain deletes, or archive-then-delete with --archive-dir"""
+        if self.archive_dir:
+            archive = ArchiveWriter(os.path.join(self.archive_dir, bucket_id), self.archive_roll_size)
+            return ArchivePipeline(self, bucket_id, journal, archive)
+        return DeletionPool(self, bucket_id, journal)
+    
+    def close_journal(self, journal: DeletionJournal):
+        """Close the journal, reporting deletions that still need a --resume"""
+        if journal is None:
+            return
+        
+        failures = journal.close()
+        if failures:
+            print(f"📒 {failures} deletions failed; journal kept at {journal.path} (rerun with --resume)")
+    
+    def print_bucket_header(self, bucket_id: str, bucket_name: str):
+        """Print the banner that starts a bucket pass"""
         print(f"\n{'='*60}")
         print(f"🧹 Cleaning bucket: {bucket_name} ({bucket_id})")
         print(f"{'='*60}")
+        with self._stats_lock:
+            self.bucket_stats.setdefault(bucket_id, {
+                'bucket': bucket_name,
+                'scanned': 0,
+                'candidates': 0,
+                'deleted': 0,
+                'errors': 0,
+                'space_freed': 0
+            })
+    
+    def delete_file(self, bucket_id: str, file: Dict, missing_ok: bool = False) -> bool:
+        """Delete a single file, retrying transient errors with backoff"""
+        started = time.monotonic()
+        for attempt in range(MAX_RETRIES + 1):
+            try:
+                with self.limiter.slot(f"{bucket_id}/delete"):
+                    self.storage.delete_file(
+                        bucket_id=bucket_id,
+                        file_id=file['$id']
+                    )
+                self.record_deleted(bucket_id, file, time.monotonic() - started)
+                return True
+            except Exception as e:
+                if missing_ok and is_not_found_error(e):
+                    self.record_already_deleted(bucket_id, file, time.monotonic() - started)
+                    return True
+                if attempt < MAX_RETRIES and is_transient_error(e):
+                    self.record_retry()
+                    time.sleep(retry_delay(attempt))
+                    continue
+                self.record_delete_error(bucket_id, file, e, time.monotonic() - started)
+                return False
+    
+    def begin_run(self):
+        """Start another run on a long-lived cleaner (see the runner's daemon mode)
+        
+        Stats and metrics start over. The reference index is rebuilt on
+        first use, which only fetches changed documents when a
+        ReferenceCache is configured, and cached listings are refreshed
+        before they are reused. Clients and connections stay warm.
+        """
+        with self._stats_lock:
+            for key in self.stats:
+                self.stats[key] = 0
+            self.bucket_stats.clear()
+        self.metrics.reset()
+        with self._references_lock:
+            self._referenced_ids = None
+        self.run_number += 1
+    
+    def count(self, bucket_id: str, **increments):
+        """Add to the run totals and to the bucket's own stats"""
+        with self._stats_lock:
+            bucket = self.bucket_stats.get(bucket_id, {})
+            for key, value in increments.items():
+                self.stats[key] += value
+                if key in bucket:
+                    bucket[key] += value
+    
+    def record_deleted(self, bucket_id: str, file: Dict, latency: float):
+        """Account for a successfully deleted file"""
+        self.count(bucket_id, deleted=1, space_freed=file['sizeOriginal'])
+        self.forget_listed(bucket_id, file)
+        print(f"  ✅ Deleted: {file['name']}")
+        if self.report:
+            self.report.file(bucket_id, file, 'deleted', latency=latency)
+    
+    def record_already_deleted(self, bucket_id: str, file: Dict, latency: float):
+        """Account for a resumed deletion whose file was already gone"""
+        self.forget_listed(bucket_id, file)
+        print(f"  ⏭️  Already deleted: {file['name']}")
+        if self.report:
+            self.report.file(bucket_id, file, 'already_deleted', latency=latency)
+    
+    def record_delete_error(self, bucket_id: str, file: Dict, error: Exception, latency: float):
+        """Account for a file that could not be deleted"""
+        self.count(bucket_id, errors=1)
+        print(f"  ❌ Failed to delete {file['name']}: {error}")
+        if self.report:
+            self.report.file(bucket_id, file, 'failed', latency=latency, error=error)
+    
+    def record_archive_error(self, bucket_id: str, file: Dict, error: Exception):
+        """Account for a file that was not deleted because it could not be archived"""
+        self.count(bucket_id, errors=1)
+        print(f"  ❌ Failed to archive {file['name']}: {error}")
+        if self.report:
+            self.report.file(bucket_id, file, 'archive_failed', error=error)
+    
+    def record_retry(self):
+        """Account for a retried API call"""
+        with self._stats_lock:
+            self.stats['retries'] += 1
+    
+    def clean_all_buckets(self, **kwargs):
+        """Clean all configured storage buckets concurrently
         
-        # Get all files
-        files = self.get_bucket_files(bucket_id)
-        print(f"📁 Found {len(files)} files in bucket")
+        Each bucket runs in its own thread with its console lines prefixed
+        by the bucket name. All of them share one FairLimiter, so total
+        API concurrency stays at ``workers`` and runtime tracks the
+        largest bucket rather than the sum of all buckets.
+        """
+        buckets = list(BUCKETS.items())
         
-        if len(files) == 0:
-            print("✅ Bucket is empty")
-            return
+        def clean_labeled(bucket_name: str, bucket_id: str):
+            OUTPUT_PREFIX.set(f"[{bucket_name}] ")
+            self.clean_bucket(bucket_id, bucket_name, **kwargs)
         
-        # Get referenced files if checking for orphans
-        referenced_ids = set()
-        if orphaned_only:
-            print("\n🔍 Checking for orphaned files...")
-            referenced_ids = self.get_referenced_file_ids()
+        with prefixed_output():
+            with ThreadPoolExecutor(max_workers=len(buckets), thread_name_prefix='bucket') as executor:
+                futures = [
+                    executor.submit(contextvars.copy_context().run, clean_labeled, bucket_name, bucket_id)
+                    for bucket_name, bucket_id in buckets
+                ]
+                wait(futures)
         
-        # Process each file
-        files_to_delete = []
+        for future in futures:
+            future.result()
+    
+    def dedup_buckets(self, buckets: List):
+        """Find byte-identical files across buckets and remove unreferenced copies
         
-        for file in files:
-            self.stats['scanned'] += 1
-            should_delete = False
-            reason = []
-            
-            # Check if orphaned
-            if orphaned_only and file['$id'] not in referenced_ids:
-                should_delete = True
-                reason.append("orphaned")
+        Every file of the given (name, id) buckets is listed into a
+        HashIndex. Only files sharing their size with another file are
+        downloaded, and each download is hashed as it streams in, so memory
+        per file stays at one DOWNLOAD_CHUNK_SIZE read. In each group of
+        identical files, every referenced copy is kept, and so is every
+        copy created after the reference snapshot's cutoff. If no copy is
+        kept that way, the oldest one is kept. All other copies are deleted.
+        A file whose download fails is never treated as a duplicate.
+        """
+        index = HashIndex(self.hash_cache)
+        try:
+            with self.metrics.phase('scan'):
+                for bucket_name, bucket_id in buckets:
+                    self.print_bucket_header(bucket_id, bucket_name)
+                    self._index_bucket(index, bucket_id)
+            index.prune([bucket_id for _, bucket_id in buckets])
             
-            # Check if old
-            if days_old and self.is_file_old(file, days_old):
-                should_delete = True
-                reason.append(f"older than {days_old} days")
+            print("\n🔍 Checking references of duplicate candidates...")
+            references = self.get_referenced_file_ids()
             
-            # Check if temp file
-            if remove_temp and self.is_temp_file(file):
-                should_delete = True
-                reason.append("temporary/test file")
+            print(f"\n📏 {index.size_groups()} file sizes shared by more than one file")
+            with self.metrics.phase('hash'):
+                self._hash_candidates(index)
             
-            if should_delete:
-                files_to_delete.append({
-                    'file': file,
-                    'reason': ', '.join(reason)
-                })
+            self._remove_duplicates(index, references, {bucket_id: name for name, bucket_id in buckets})
+        finally:
+            index.close()
+    
+    def _index_bucket(self, index: HashIndex, bucket_id: str):
+        """List a bucket into the index"""
+        scanned = 0
+        batch = []
+        for file in self.get_bucket_files(bucket_id):
+            batch.append(file)
+            if len(batch) >= LISTING_BATCH_SIZE:
+                index.add_files(bucket_id, batch)
+                scanned += len(batch)
+                batch = []
+        index.add_files(bucket_id, batch)
+        scanned += len(batch)
+        
+        self.count(bucket_id, scanned=scanned)
+        print(f"\n📁 Found {scanned} files in bucket")
+    
+    def _hash_candidates(self, index: HashIndex):
+        """Download and hash every same-size file without a cached hash"""
+        hashed = 0
+        failed = 0
+        downloaded = 0
+        in_flight = {}
         
-        # Report findings
-        print(f"\n📊 Found {len(files_to_delete)} files to delete")
+        def collect(done):
+            nonlocal hashed, failed, downloaded
+            for future in done:
+                file = in_flight.pop(future)
+                try:
+                    index.add_hash(file, future.result())
+                    hashed += 1
+                    downloaded += file['sizeOriginal']
+                except Exception as e:
+                    failed += 1
+                    print(f"  ⚠️  Could not hash {file['name']}: {e}")
         
-        if len(files_to_delete) == 0:
-            print("✅ No files need cleaning")
-            return
+        with ThreadPoolExecutor(max_workers=self.workers, thread_name_prefix='hash') as executor:
+            try:
+                for file in index.unhashed():
+                    if len(in_flight) >= self.workers * 2:
+                        done, _ = wait(in_flight, return_when=FIRST_COMPLETED)
+                        collect(done)
+                    in_flight[executor.submit(self.hash_file, file['bucketId'], file['$id'])] = file
+                collect(list(in_flight))
+            finally:
+                index.save_hashes()
         
-        # Show preview
-        print("\n📋 Files to be deleted:")
-        for item in files_to_delete[:10]:  # Show first 10
-            file = item['file']
-            size_mb = file['sizeOriginal'] / (1024 * 1024)
-            print(f"  • {file['name']} ({size_mb:.2f} MB) - {item['reason']}")
+        print(f"🔑 Hashed {hashed} files ({downloaded / (1024 * 1024):.2f} MB downloaded)"
+              + (f", {failed} failed" if failed else ""))
+    
+    def hash_file(self, bucket_id: str, file_id: str, sink=None) -> str:
+        """SHA-256 of a file's content, retrying transient errors with backoff
         
-        if len(files_to_delete) > 10:
-            print(f"  ... and {len(files_to_delete) - 10} more")
+        With ``sink`` (a writable, seekable file object) the content is
+        also written there; a retried download starts it over.
+        """
+        for attempt in range(MAX_RETRIES + 1):
+            try:
+                if sink is not None:
+                    sink.seek(0)
+                    sink.truncate()
+                with self.limiter.slot(f"{bucket_id}/download"):
+                    return self._download_hash(bucket_id, file_id, sink)
+            except Exception as e:
+                if attempt < MAX_RETRIES and is_transient_error(e):
+                    self.record_retry()
+                    time.sleep(retry_delay(attempt))
+                    continue
+                raise
+    
+    def _download_hash(self, bucket_id: str, file_id: str, sink=None) -> str:
+        """Stream a file download into SHA-256 without holding the file
         
-        # Calculate total size
-        total_size = sum(f['file']['sizeOriginal'] for f in files_to_delete)
-        total_size_mb = total_size / (1024 * 1024)
-        print(f"\n💾 Total space to free: {total_size_mb:.2f} MB")
+        ``Storage.get_file_download`` returns the whole file as bytes, so
+        the download goes straight through the pooled transport instead.
+        """
+        path = f"/storage/buckets/{bucket_id}/files/{file_id}/download"
+        digest = hashlib.sha256()
+        with self.metrics.timed_call('download_file'):
+            try:
+                with self.transport.request(
+                    'GET',
+                    APPWRITE_ENDPOINT + path,
+                    headers=appwrite_headers(APPWRITE_PROJECT_ID, APPWRITE_API_KEY),
+                    stream=True
+                ) as response:
+                    if response.status_code >= 400:
+                        if response.headers.get('Content-Type', '').startswith('application/json'):
+                            body = response.json()
+                            raise AppwriteException(body.get('message'), response.status_code, body.get('type'), body)
+                        raise AppwriteException(response.text, response.status_code)
+                    
+                    for chunk in response.iter_content(DOWNLOAD_CHUNK_SIZE):
+                        digest.update(chunk)
+                        if sink is not None:
+                            sink.write(chunk)
+            except requests.RequestException as e:
+                raise AppwriteException(str(e) or type(e).__name__)
+        return digest.hexdigest()
+    
+    def _remove_duplicates(self, index: HashIndex, references: ReferenceSnapshot, bucket_names: Dict):
+        """Report each duplicate group and delete the copies that are not kept"""
+        scan = BucketScan()
+        groups = 0
+        pools = {}
+        
+        try:
+            for group in index.duplicate_groups():
+                groups += 1
+                keep = [file for file in group if not references.is_orphaned(file)] or group[:1]
+                kept_ids = {file['$id'] for file in keep}
+                original = keep[0]
+                
+                for file in group:
+                    bucket_id = file['bucketId']
+                    if file['$id'] in kept_ids:
+                        if self.report:
+                            self.report.file(bucket_id, file, 'keep', ['duplicate original'])
+                        continue
+                    
+                    reasons = [f"duplicate of {original['name']} ({bucket_names[original['bucketId']]}/{original['$id']})"]
+                    scan.add_candidate(file, reasons)
+                    self.count(bucket_id, candidates=1)
+                    if self.report:
+                        self.report.file(bucket_id, file, 'would_delete' if self.dry_run else 'delete', reasons)
+                    if not self.dry_run:
+                        if bucket_id not in pools:
+                            pools[bucket_id] = self._open_dedup_pool(bucket_id)
+                        pools[bucket_id].submit(file)
+        finally:
+            with self.metrics.phase('delete_drain'):
+                for deleter in pools.values():
+                    deleter.close()
+                    self.close_journal(deleter.journal)
+            if self.report:
+                self.report.flush()
+        
+        if not groups:
+            print("\n✅ No duplicate files found")
+            return
         
-        # Delete files
+        print(f"\n🧬 {groups} groups of identical files, {scan.to_delete} unreferenced copies")
+        print(f"💾 Total space to free: {scan.total_size / (1024 * 1024):.2f} MB")
         if self.dry_run:
             print("\n🔒 DRY RUN: No files were deleted")
             print("   Run without --dry-run to actually delete files")
-        else:
-            print("\n🗑️  Deleting files...")
-            for item in files_to_delete:
-                file = item['file']
-                try:
-                    self.storage.delete_file(
-                        bucket_id=bucket_id,
-                        file_id=file['$id']
-                    )
-                    self.stats['deleted'] += 1
-                    self.stats['space_freed'] += file['sizeOriginal']
-                    print(f"  ✅ Deleted: {file['name']}")
-                except Exception as e:
-                    self.stats['errors'] += 1
-                    print(f"  ❌ Failed to delete {file['name']}: {e}")
     
-    def clean_all_buckets(self, **kwargs):
-        """Clean all configured storage buckets"""
-        for bucket_name, bucket_id in BUCKETS.items():
-            self.clean_bucket(bucket_id, bucket_name, **kwargs)
+    def _open_dedup_pool(self, bucket_id: str):
+        """Deletion stage and journal for one bucket of a dedup pass"""
+        journal, pending = self.open_journal(bucket_id)
+        deleter = self.open_deleter(bucket_id, journal)
+        for file in pending:
+            deleter.submit(file, resumed=True)
+        return deleter
+    
+    def print_bucket_stats(self):
+        """Print the per-bucket breakdown of a multi-bucket run"""
+        if len(self.bucket_stats) < 2:
+            return
+        
+        print("\nPer bucket:")
+        for bucket in self.bucket_stats.values():
+            print(f"  {bucket['bucket']:16} scanned {bucket['scanned']:>8}  deleted {bucket['deleted']:>8}  "
+                  f"errors {bucket['errors']:>4}  freed {bucket['space_freed'] / (1024 * 1024):.2f} MB")
     
     def print_summary(self):
         """Print cleanup summary"""
@@ -306,12 +2864,370 @@ class AppwriteStorageCleaner:
         print(f"Files scanned:  {self.stats['scanned']}")
         print(f"Files deleted:  {self.stats['deleted']}")
         print(f"Errors:         {self.stats['errors']}")
+        if self.stats['retries']:
+            print(f"Retries:        {self.stats['retries']}")
         print(f"Space freed:    {self.stats['space_freed'] / (1024 * 1024):.2f} MB")
+        elapsed = self.metrics.elapsed()
+        print(f"Duration:       {elapsed:.1f}s ({self.stats['scanned'] / elapsed if elapsed else 0:.1f} files/s)")
+        print(f"Connections:    {self.transport.summary()}")
+        print(f"Rate control:   {self.transport.controller.summary()}")
+        if self.metrics.phases:
+            phases = ', '.join(f"{name} {seconds:.1f}s" for name, seconds in self.metrics.phases.items())
+            print(f"Phases:         {phases}")
+        self.print_bucket_stats()
         
         if self.dry_run:
             print(f"\n🔒 DRY RUN: No actual changes were made")
+        
+        if self.report:
+            self.report.summary(self.stats, self.bucket_stats, self.dry_run, self.metrics.elapsed())
+    
+    def export_metrics(self, prom_path: str = None, json_path: str = None):
+        """Write the run metrics as a Prometheus textfile and/or JSON"""
+        if prom_path:
+            self.metrics.write_prometheus(prom_path, self.stats, self.bucket_stats, self.dry_run, self.transport.stats())
+            print(f"📈 Metrics written to {prom_path}")
+        if json_path:
+            self.metrics.write_json(json_path, self.stats, self.bucket_stats, self.dry_run, self.transport.stats())
+            print(f"📈 Metrics written to {json_path}")
 
-def main():
+class AsyncAppwriteClient:
+    """Minimal asyncio client for the Appwrite REST endpoints the cleaner uses
+    
+    Errors are raised as ``AppwriteException`` with the HTTP status as code,
+    the same way the SDK does, so retry handling is shared with the sync
+    engine. Requests go through the same rate controller as the pooled
+    transport.
+    """
+    
+    def __init__(self, session: 'aiohttp.ClientSession', metrics: RunMetrics, controller: 'AdaptiveRateController'):
+        self.session = session
+        self.metrics = metrics
+        self.controller = controller
+        self.headers = {
+            **appwrite_headers(APPWRITE_PROJECT_ID, APPWRITE_API_KEY),
+            'x-sdk-name': 'storage-cleaner',
+            'accept': 'application/json'
+        }
+    
+    async def call(self, method: str, path: str, queries: List[str] = None):
+        """Send a request and return the decoded JSON body (None if empty)"""
+        params = {f'queries[{i}]': query for i, query in enumerate(queries or [])}
+        
+        with self.metrics.timed_call(api_call_type(method, path)):
+            return await self._request(method, path, params)
+    
+    async def _request(self, method: str, path: str, params: Dict):
+        await self.controller.acquire_async()
+        started = time.monotonic()
+        status = None
+        retry_after = None
+        try:
+            async with self.session.request(
+                method,
+                APPWRITE_ENDPOINT + path,
+                params=params,
+                headers=self.headers
+            ) as response:
+                status = response.status
+                retry_after = response.headers.get('Retry-After')
+                if response.content_type == 'application/json':
+                    body = await response.json()
+                else:
+                    body = await response.text()
+                
+                if response.status >= 400:
+                    if isinstance(body, dict):
+                        raise AppwriteException(body.get('message'), response.status, body.get('type'), body)
+                    raise AppwriteException(body, response.status)
+                
+                return body or None
+        except (aiohttp.ClientError, asyncio.TimeoutError) as e:
+            raise AppwriteException(str(e) or type(e).__name__)
+        finally:
+            self.controller.release(method, status, time.monotonic() - started, retry_after)
+    
+    async def list_files(self, bucket_id: str, queries: List[str]) -> Dict:
+        return await self.call('GET', f'/storage/buckets/{bucket_id}/files', queries)
+    
+    async def list_documents(self, database_id: str, collection_id: str, queries: List[str]) -> Dict:
+        return await self.call(
+            'GET',
+            f'/databases/{database_id}/collections/{collection_id}/documents',
+            queries
+        )
+    
+    async def delete_file(self, bucket_id: str, file_id: str):
+        return await self.call('DELETE', f'/storage/buckets/{bucket_id}/files/{file_id}')
+
+class AsyncAppwriteStorageCleaner(AppwriteStorageCleaner):
+    """Storage cleaner driven by asyncio instead of blocking SDK calls
+    
+    Listing, reference lookups and deletions go straight to the REST API
+    through aiohttp. Listing runs as its own task, so page N+1 is fetched
+    while candidates from page N are being deleted. Evaluation, console
+    output and stats are shared with the sync engine.
+    """
+    
+    def __init__(self, **kwargs):
+        if aiohttp is None:
+            raise ValueError("aiohttp package not installed (required for --async). Install with: pip install aiohttp")
+        if kwargs.get('archive_dir'):
+            raise ValueError("--archive-dir is not supported by the --async engine")
+        super().__init__(**kwargs)
+    
+    async def _open_api(self) -> AsyncAppwriteClient:
+        connector = aiohttp.TCPConnector(**self.transport.aiohttp_connector_kwargs())
+        session = aiohttp.ClientSession(
+            connector=connector,
+            trace_configs=[self.transport.aiohttp_trace_config()]
+        )
+        return AsyncAppwriteClient(session, self.metrics, self.transport.controller)
+    
+    def clean_bucket(self, bucket_id: str, bucket_name: str, **kwargs):
+        """Clean files from a storage bucket"""
+        asyncio.run(self._run_buckets([(bucket_name, bucket_id)], **kwargs))
+    
+    def clean_all_buckets(self, **kwargs):
+        """Clean all configured storage buckets"""
+        asyncio.run(self._run_buckets(list(BUCKETS.items()), **kwargs))
+    
+    async def _run_buckets(self, buckets: List, **kwargs):
+        """Clean buckets as concurrent tasks sharing one fair request budget"""
+        self.async_limiter = AsyncFairLimiter(self.workers)
+        self._references_async_lock = asyncio.Lock()
+        api = await self._open_api()
+        
+        async def clean_labeled(bucket_name: str, bucket_id: str):
+            if len(buckets) > 1:
+                OUTPUT_PREFIX.set(f"[{bucket_name}] ")
+            await self.clean_bucket_async(api, bucket_id, bucket_name, **kwargs)
+        
+        try:
+            with prefixed_output() if len(buckets) > 1 else nullcontext():
+                results = await asyncio.gather(*[
+                    clean_labeled(bucket_name, bucket_id) for bucket_name, bucket_id in buckets
+                ], return_exceptions=True)
+            for result in results:
+                if isinstance(result, BaseException):
+                    raise result
+        finally:
+            await api.session.close()
+    
+    async def get_referenced_file_ids_async(self, api: AsyncAppwriteClient, refresh: bool = False) -> ReferenceSnapshot:
+        """Get all file IDs referenced in database documents (sources scanned concurrently)"""
+        async with self._references_async_lock:
+            if self._referenced_ids is not None and not refresh:
+                print(f"♻️  Reusing reference index ({len(self._referenced_ids)} file IDs, "
+                      f"orphans only before {self._referenced_ids.cutoff})")
+                return self._referenced_ids
+            
+            return await self._build_reference_index_async(api, refresh)
+    
+    async def _build_reference_index_async(self, api: AsyncAppwriteClient, refresh: bool):
+        # The cache sync is SQLite-bound and only fetches changed documents,
+        # so it runs through the sync implementation off the event loop
+        if self.ref_cache:
+            return await asyncio.to_thread(self.get_referenced_file_ids, refresh)
+        
+        started = time.monotonic()
+        results = await asyncio.gather(*[
+            self._scan_reference_source_async(api, collection, field)
+            for collection, field, _ in REFERENCE_SOURCES
+        ], return_exceptions=True)
+        
+        self._referenced_ids = self._snapshot(self._merge_references(results), started)
+        self.metrics.add_phase('references', time.monotonic() - started)
+        return self._referenced_ids
+    
+    async def _scan_reference_source_async(self, api: AsyncAppwriteClient, collection: str, field: str):
+        """Collect every non-empty ``field`` value from a collection"""
+        file_ids = make_id_builder(self.ref_index)
+        cursor = None
+        
+        while True:
+            result = await call_with_retries_async(
+                lambda: api.list_documents(DATABASE_ID, COLLECTIONS[collection], reference_queries(field, cursor)),
+                self.record_retry
+            )
+            documents = result['documents']
+            file_ids.update(document[field] for document in documents if document.get(field))
+            
+            if len(documents) < REFERENCE_PAGE_SIZE:
+                return file_ids.build()
+            cursor = documents[-1]['$id']
+    
+    async def _list_files_page_async(
+        self,
+        api: AsyncAppwriteClient,
+        bucket_id: str,
+        limit: int,
+        cursor: str = None,
+        created_before: str = None
+    ) -> List[Dict]:
+        """Fetch a single page of files after the given cursor (see _list_files_page)"""
+        async def fetch():
+            async with self.async_limiter.slot(f"{bucket_id}/list"):
+                return await api.list_files(bucket_id, file_list_queries(limit, cursor, created_before))
+        
+        try:
+            return (await call_with_retries_async(fetch, self.record_retry))['files']
+        except Exception as e:
+            print(f"❌ Error fetching files from bucket {bucket_id}: {e}")
+            raise ListingError(f"Listing bucket {bucket_id} failed: {e}") from e
+    
+    async def _produce_pages(
+        self,
+        api: AsyncAppwriteClient,
+        bucket_id: str,
+        pages: asyncio.Queue,
+        limit: int = 100,
+        created_before: str = None
+    ):
+        """Feed pages into the queue, one page ahead of the consumer
+        
+        Page N is only queued once page N+1 has been fetched, so deleting
+        the files of page N can never invalidate the listing cursor. A
+        ListingError is queued in place of the page that failed.
+        """
+        try:
+            page = await self._list_files_page_async(api, bucket_id, limit, created_before=created_before)
+            while page:
+                next_page = []
+                if len(page) == limit:
+                    next_page = await self._list_files_page_async(
+                        api, bucket_id, limit, cursor=page[-1]['$id'], created_before=created_before
+                    )
+                await pages.put(page)
+                page = next_page
+        except ListingError as e:
+            await pages.put(e)
+            return
+        
+        await pages.put(None)
+    
+    async def _delete_file_async(
+        self,
+        api: AsyncAppwriteClient,
+        bucket_id: str,
+        file: Dict,
+        journal: DeletionJournal = None,
+        missing_ok: bool = False
+    ) -> bool:
+        """Delete a single file, retrying transient errors with backoff"""
+        deleted = False
+        started = time.monotonic()
+        for attempt in range(MAX_RETRIES + 1):
+            try:
+                async with self.async_limiter.slot(f"{bucket_id}/delete"):
+                    await api.delete_file(bucket_id, file['$id'])
+                self.record_deleted(bucket_id, file, time.monotonic() - started)
+                deleted = True
+                break
+            except Exception as e:
+                if missing_ok and is_not_found_error(e):
+                    self.record_already_deleted(bucket_id, file, time.monotonic() - started)
+                    deleted = True
+                    break
+                if attempt < MAX_RETRIES and is_transient_error(e):
+                    self.record_retry()
+                    await asyncio.sleep(retry_delay(attempt))
+                    continue
+                self.record_delete_error(bucket_id, file, e, time.monotonic() - started)
+                break
+        
+        if journal:
+            journal.record_result(file, deleted)
+        return deleted
+    
+    async def clean_bucket_async(
+        self,
+        api: AsyncAppwriteClient,
+        bucket_id: str,
+        bucket_name: str,
+        days_old: int = None,
+        orphaned_only: bool = False,
+        remove_temp: bool = True
+    ):
+        """Clean files from a storage bucket with overlapping list/delete phases"""
+        self.print_bucket_header(bucket_id, bucket_name)
+        
+        policy = self.build_policy(bucket_name, days_old, orphaned_only, remove_temp)
+        if not policy.enabled:
+            return
+        
+        if policy.needs_references:
+            print("\n🔍 Checking for orphaned files...")
+            policy.references = await self.get_referenced_file_ids_async(api)
+        
+        created_before = self.prepare_age_filter(policy)
+        
+        scan = BucketScan(server_filtered=created_before is not None)
+        journal, pending = self.open_journal(bucket_id)
+        resumed_ids = {file['$id'] for file in pending}
+        pages = asyncio.Queue(maxsize=1)
+        lister = asyncio.create_task(
+            self._produce_pages(api, bucket_id, pages, created_before=created_before)
+        )
+        deletions = set()
+        
+        if pending:
+            print("\n🗑️  Deleting files...")
+        
+        async def schedule_delete(file: Dict, resumed: bool = False):
+            nonlocal deletions
+            if len(deletions) >= self.workers * 2:
+                _, deletions = await asyncio.wait(deletions, return_when=asyncio.FIRST_COMPLETED)
+            if journal and not resumed:
+                journal.plan(file)
+            deletions.add(asyncio.create_task(
+                self._delete_file_async(api, bucket_id, file, journal, missing_ok=resumed)
+            ))
+        
+        try:
+            for file in pending:
+                await schedule_delete(file, resumed=True)
+            
+            started = time.monotonic()
+            while (page := await pages.get()) is not None:
+                if isinstance(page, ListingError):
+                    raise page
+                for file in page:
+                    scan.scanned += 1
+                    if file['$id'] in resumed_ids:
+                        continue
+                    
+                    if not policy.matches(file):
+                        if self.report:
+                            self.report.file(bucket_id, file, 'keep')
+                        continue
+                    
+                    reasons = policy.reasons(file)
+                    scan.add_candidate(file, reasons)
+                    if self.report:
+                        self.report.file(bucket_id, file, 'would_delete' if self.dry_run else 'delete', reasons)
+                    if self.dry_run:
+                        continue
+                    
+                    if scan.to_delete == 1 and not pending:
+                        print("\n🗑️  Deleting files...")
+                    await schedule_delete(file)
+            self.metrics.add_phase('scan', time.monotonic() - started)
+        finally:
+            # Deletions already scheduled finish even if the listing failed
+            if deletions:
+                with self.metrics.phase('delete_drain'):
+                    await asyncio.wait(deletions)
+            lister.cancel()
+            self.close_journal(journal)
+            self.count(bucket_id, scanned=scan.scanned, candidates=scan.to_delete)
+            if self.report:
+                self.report.flush()
+        
+        scan.print_report(self.dry_run)
+
+def build_parser() -> argparse.ArgumentParser:
+    """Command-line options of the cleaner (also used by the preset runner)"""
     parser = argparse.ArgumentParser(
         description='Clean up old and orphaned files from Appwrite storage',
         formatter_class=argparse.RawDescriptionHelpFormatter
@@ -348,35 +3264,235 @@ def main():
         help='Skip deletion of temporary/test files'
     )
     
-    args = parser.parse_args()
+    parser.add_argument(
+        '--rules',
+        metavar='PATH',
+        help='JSON file with cleanup rules (age, size, mimeType, name patterns, orphans) and per-bucket overrides'
+    )
+    
+    parser.add_argument(
+        '--dedup',
+        action='store_true',
+        help='Find byte-identical files (same size, then SHA-256) and delete unreferenced copies instead of applying the cleanup rules'
+    )
+    
+    parser.add_argument(
+        '--target-size',
+        type=parse_size,
+        metavar='SIZE',
+        help='Delete the fewest orphaned files (oldest, then largest first) that bring each bucket under SIZE, e.g. 5GB, instead of applying the cleanup rules'
+    )
+    
+    parser.add_argument(
+        '--evict-referenced',
+        action='store_true',
+        help='With --target-size, also delete files still referenced in the database (oldest, then largest) once the orphans are not enough'
+    )
+    
+    parser.add_argument(
+        '--archive-dir',
+        metavar='PATH',
+        help='Download every file into rolling tar.gz archives (one directory per bucket, with a manifest) before deleting it'
+    )
+    
+    parser.add_argument(
+        '--archive-roll-size',
+        type=parse_size,
+        default=ARCHIVE_ROLL_SIZE,
+        metavar='SIZE',
+        help='Start a new archive file once the current one reaches SIZE (default: 1GB)'
+    )
+    
+    parser.add_argument(
+        '--hash-cache',
+        metavar='PATH',
+        default=DEFAULT_HASH_CACHE,
+        help=f'SQLite file caching content hashes for --dedup; empty to disable (default: {DEFAULT_HASH_CACHE})'
+    )
+    
+    parser.add_argument(
+        '--report',
+        metavar='PATH',
+        help='Stream a machine-readable record per evaluated/deleted file, plus a summary, to PATH'
+    )
+    
+    parser.add_argument(
+        '--report-format',
+        choices=REPORT_FORMATS,
+        help='Report format (default: csv for *.csv paths, jsonl otherwise)'
+    )
+    
+    parser.add_argument(
+        '--metrics-prom',
+        metavar='PATH',
+        help='Write run metrics (phase times, API latency histograms) as a Prometheus textfile'
+    )
+    
+    parser.add_argument(
+        '--metrics-json',
+        metavar='PATH',
+        help='Write run metrics as JSON'
+    )
+    
+    parser.add_argument(
+        '--ref-cache',
+        metavar='PATH',
+        help='SQLite file caching database references between runs (incremental sync on $updatedAt)'
+    )
+    
+    parser.add_argument(
+        '--listing-cache-limit',
+        type=int,
+        default=LISTING_CACHE_LIMIT,
+        metavar='FILES',
+        help=f'Runner/daemon only: stream buckets with more than FILES files on every pass instead of caching their listing (default: {LISTING_CACHE_LIMIT})'
+    )
+    
+    parser.add_argument(
+        '--reconcile-hours',
+        type=float,
+        default=DEFAULT_RECONCILE_HOURS,
+        help=f'Hours between full reference cache reconciles and full relists of cached listings (default: {DEFAULT_RECONCILE_HOURS})'
+    )
+    
+    parser.add_argument(
+        '--ref-index',
+        choices=REFERENCE_INDEX_TYPES,
+        default='set',
+        help='Reference index structure: set (fastest), sorted (compact) or bloom (compact, fast misses)'
+    )
+    
+    parser.add_argument(
+        '--journal-dir',
+        default=DEFAULT_JOURNAL_DIR,
+        help=f'Directory for per-bucket deletion journals (default: {DEFAULT_JOURNAL_DIR})'
+    )
+    
+    parser.add_argument(
+        '--lock-file',
+        default=DEFAULT_LOCK_FILE,
+        help=f'Lock file that makes overlapping runs skip instead of piling up; empty to disable (default: {DEFAULT_LOCK_FILE})'
+    )
     
+    parser.add_argument(
+        '--resume',
+        action='store_true',
+        help='Retry deletions left pending in the journal by an interrupted run, then continue cleaning'
+    )
+    
+    parser.add_argument(
+        '--async',
+        dest='use_async',
+        action='store_true',
+        help='Use the asyncio engine (requires aiohttp)'
+    )
+    
+    parser.add_argument(
+        '--pool-size',
+        type=int,
+        help=f'HTTP keep-alive connections to keep open (default: workers + {len(REFERENCE_SOURCES)})'
+    )
+    
+    parser.add_argument(
+        '--workers',
+        type=int,
+        default=DEFAULT_WORKERS,
+        help=f'Concurrent API requests, shared fairly by all buckets (default: {DEFAULT_WORKERS})'
+    )
+    
+    return parser
+
+def create_cleaner(args: argparse.Namespace, **options) -> AppwriteStorageCleaner:
+    """Build the cleaner engine selected by the parsed options
+    
+    ``options`` are passed on to the engine, overriding the defaults.
+    """
+    engine = AsyncAppwriteStorageCleaner if args.use_async else AppwriteStorageCleaner
+    ref_cache = ReferenceCache(args.ref_cache, args.reconcile_hours) if args.ref_cache else None
+    rules_config = load_rules_config(args.rules) if args.rules else None
+    report = CleanupReport(args.report, args.report_format) if args.report else None
     try:
-        # Initialize cleaner
-        cleaner = AppwriteStorageCleaner(dry_run=args.dry_run)
-        
-        # Clean specified bucket(s)
-        if args.bucket == 'all':
-            cleaner.clean_all_buckets(
-                days_old=args.days,
-                orphaned_only=args.orphaned_only,
-                remove_temp=not args.no_temp
-            )
-        else:
-            bucket_id = BUCKETS[args.bucket]
-            cleaner.clean_bucket(
-                bucket_id=bucket_id,
-                bucket_name=args.bucket,
-                days_old=args.days,
-                orphaned_only=args.orphaned_only,
-                remove_temp=not args.no_temp
-            )
-        
-        # Print summary
-        cleaner.print_summary()
+        return engine(
+            dry_run=args.dry_run,
+            workers=args.workers,
+            ref_cache=ref_cache,
+            ref_index=args.ref_index,
+            journal_dir=args.journal_dir,
+            resume=args.resume,
+            rules_config=rules_config,
+            report=report,
+            pool_size=args.pool_size,
+            relist_hours=args.reconcile_hours,
+            hash_cache=args.hash_cache,
+            archive_dir=args.archive_dir,
+            archive_roll_size=args.archive_roll_size,
+            listing_cache_limit=args.listing_cache_limit,
+            **options
+        )
+    except Exception:
+        if report:
+            report.close()
+        raise
+
+def clean(cleaner: AppwriteStorageCleaner, args: argparse.Namespace):
+    """Run one cleanup pass over the bucket(s) selected by the options"""
+    buckets = BUCKETS if args.bucket == 'all' else {args.bucket: BUCKETS[args.bucket]}
+    if args.dedup:
+        cleaner.dedup_buckets(list(buckets.items()))
+    elif args.target_size is not None:
+        for bucket_name, bucket_id in buckets.items():
+            cleaner.shrink_bucket(bucket_id, bucket_name, args.target_size, args.evict_referenced)
+    elif args.bucket == 'all':
+        cleaner.clean_all_buckets(
+            days_old=args.days,
+            orphaned_only=args.orphaned_only,
+            remove_temp=not args.no_temp
+        )
+    else:
+        bucket_id = BUCKETS[args.bucket]
+        cleaner.clean_bucket(
+            bucket_id=bucket_id,
+            bucket_name=args.bucket,
+            days_old=args.days,
+            orphaned_only=args.orphaned_only,
+            remove_temp=not args.no_temp
+        )
+
+def run(args: argparse.Namespace) -> int:
+    """Run the cleaner for parsed options, returning the exit code"""
+    with run_lock(args.lock_file) as acquired:
+        if not acquired:
+            print(f"⏭️  Another cleanup run holds {args.lock_file}; skipping this one")
+            return 0
         
-    except Exception as e:
-        print(f"\n❌ Fatal error: {e}")
-        sys.exit(1)
+        cleaner = None
+        try:
+            cleaner = create_cleaner(args)
+            clean(cleaner, args)
+            
+            # Print summary
+            cleaner.print_summary()
+            cleaner.export_metrics(args.metrics_prom, args.metrics_json)
+            return 0
+            
+        except Exception as e:
+            print(f"\n❌ Fatal error: {e}")
+            return 1
+        finally:
+            if cleaner and cleaner.report:
+                cleaner.report.close()
+
+def main():
+    parser = build_parser()
+    args = parser.parse_args()
+    for option, enabled in (('--dedup', args.dedup), ('--target-size', args.target_size is not None)):
+        if enabled and (args.days or args.orphaned_only or args.rules):
+            parser.error(f"{option} cannot be combined with --days, --orphaned-only or --rules")
+    if args.dedup and args.target_size is not None:
+        parser.error("--dedup and --target-size are separate modes")
+    if args.evict_referenced and args.target_size is None:
+        parser.error("--evict-referenced requires --target-size")
+    sys.exit(run(args))
 
 if __name__ == '__main__':
     main()